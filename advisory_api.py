@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from pydantic import BaseModel
+
+import model_provider
+import telemetry
+
+from investmentadvisor_be import (acall_graph, aanswer_with_rag, antwort_cache, get_chat_historie, metadaten_cache,
+                                  session_store, warmup)
+from produktblaetter import produktblaetter
+from session_store import new_session_id
+
+# Zustandslose HTTP-Schnittstelle fuer die Anlageberatung. Der Zustand liegt im Session-Store (SESSION_STORE), sodass
+# mehrere Worker-Prozesse hinter einem Load Balancer dieselben Sessions bedienen koennen, z. B.:
+# SESSION_STORE=sqlite:///sessions.sqlite3 uvicorn advisory_api:app --workers 4
+
+
+def _log_warmup_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        error = future.exception()
+        telemetry.log_event("warmup_fehler", logging.ERROR, fehler=f"{type(error).__name__}: {error}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Modelle, Graph und Vektordatenbank im Hintergrund initialisieren, der Worker nimmt sofort Anfragen an. Fehler
+    # der Initialisierung werden protokolliert, die Initialisierung wiederholt sich dann bei der ersten Anfrage
+    app.state.warmup = asyncio.get_running_loop().run_in_executor(None, warmup)
+    app.state.warmup.add_done_callback(_log_warmup_error)
+    yield
+
+
+app = FastAPI(title="AnlageberaterGPT", lifespan=lifespan)
+
+
+class RecommendRequest(BaseModel):
+    answers: str
+    session_id: Optional[str] = None
+    # Graph-Modus (siehe GRAPH_MODE), unbekannte Modi lehnt die Validierung mit 422 ab
+    mode: Optional[Literal["agent", "pipeline"]] = None
+
+
+class AskRequest(BaseModel):
+    question: str
+
+
+class SessionResponse(BaseModel):
+    session_id: str
+    empty_product: bool
+    produktnummer: Optional[int] = None
+    document_path: str = ""
+    message: Optional[str] = None
+
+
+def _session_response(session_id: str, session: dict, message: str = None) -> SessionResponse:
+    return SessionResponse(session_id=session_id,
+                           empty_product=session["empty_product"],
+                           produktnummer=session["produktnummer"],
+                           document_path=session["document_path"] or "",
+                           message=message)
+
+
+@app.post("/recommend", response_model=SessionResponse)
+async def recommend(request: RecommendRequest):
+    """Ermittelt aus den Antworten des Fragebogens ein passendes Produkt und stellt es vor"""
+    session_id = request.session_id or new_session_id()
+    session = await acall_graph(request.answers, session_id, request.mode)
+    message = None if session["empty_product"] else session["messages"][-1]["content"]
+    return _session_response(session_id, session, message)
+
+
+@app.post("/sessions/{session_id}/ask", response_model=SessionResponse)
+async def ask(session_id: str, request: AskRequest):
+    """Beantwortet eine Frage zum empfohlenen Produkt der Session"""
+    if not session_store.exists(session_id):
+        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+    if session_store.get(session_id)["empty_product"]:
+        raise HTTPException(status_code=409, detail="Fuer diese Session wurde kein Produkt empfohlen")
+    answer = await aanswer_with_rag(request.question, session_id)
+    return _session_response(session_id, session_store.get(session_id), answer)
+
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    if not session_store.exists(session_id):
+        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+    return _session_response(session_id, session_store.get(session_id))
+
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    session_store.delete(session_id)
+
+
+@app.get("/products/{produktnummer}/sheet")
+async def product_sheet(produktnummer: int, if_none_match: Optional[str] = Header(None)):
+    """Produktinformationsblatt als PDF. Der Inhalt kommt aus dem gemeinsamen Cache, mit If-None-Match und
+    passendem ETag antwortet der Endpunkt ohne Inhalt (304)"""
+    produktblatt = await asyncio.to_thread(produktblaetter.get, produktnummer)
+    if produktblatt is None:
+        raise HTTPException(status_code=404, detail="Produktinformationsblatt nicht gefunden")
+    etag = f'"{produktblatt.etag}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{produktblatt.dateiname}"'
+    return Response(content=produktblatt.data, media_type="application/pdf", headers=headers)
+
+
+@app.get("/stats")
+async def stats():
+    """Trefferquoten der Caches (Metadaten-Extraktion, Antworten auf Produktfragen, Produktinformationsblaetter),
+    Prompt-Tokens der Chat-Historie und Anfragen an den Modellanbieter (Wiederholungen, Hedging)"""
+    return {"metadaten_cache": metadaten_cache.stats(), "antwort_cache": antwort_cache.stats(),
+            "produktblatt_cache": produktblaetter.stats(), "chat_historie": get_chat_historie().stats(),
+            "modell": model_provider.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Kennzahlen im Prometheus-Textformat (Dauer je Node, LLM-Tokens und -Kosten, Embedding-Aufrufe, Suche, Caches)"""
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
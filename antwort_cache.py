@@ -0,0 +1,123 @@
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+from ingest_manifest import FingerprintCache
+
+# Semantischer Cache fuer Antworten auf Kundenfragen je Produkt. Eine neue Frage wird aus dem Cache beantwortet, wenn
+# ihr Embedding einer bereits beantworteten Frage zum selben Produkt ausreichend aehnlich ist (Kosinus-Aehnlichkeit).
+# Die Eintraege eines Produkts werden verworfen, sobald sich dessen Produktinformationen bei der Ingestion aendern
+# (Inhalts-Hash im Ingestion-Manifest).
+# Fragen nach Fachbegriffen bzw. ISIN/WKN beantwortet die Suche ohne Embedding (siehe kontext_retriever.py). Sie werden
+# ueber den normalisierten Text der Frage nachgeschlagen.
+
+
+class AntwortCache:
+    """Frage-Antwort-Paare je Produktnummer mit Aehnlichkeitssuche ueber die Embeddings der Fragen"""
+
+    def __init__(self, persist_directory: str, threshold: float = 0.95, max_entries: int = 256):
+        self.persist_directory = persist_directory
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Produktnummer -> {"fingerprint", "vectors" (normierte Matrix), "entries" [(Frage, Antwort, Dauer)],
+        # "texts" {normalisierte Frage: (Antwort, Dauer)}}
+        self._products = {}
+        self._fingerprints = FingerprintCache(persist_directory)
+        self._counter = {"hits": 0, "misses": 0, "invalidations": 0, "saved_seconds": 0.0}
+
+    def _product(self, produktnummer: int) -> dict:
+        fingerprint = self._fingerprints.get(produktnummer)
+        product = self._products.get(produktnummer)
+        if product is not None and product["fingerprint"] != fingerprint:
+            # Produktinformationen wurden neu eingelesen: gespeicherte Antworten sind veraltet
+            self._counter["invalidations"] += 1
+            product = None
+        if product is None:
+            product = {"fingerprint": fingerprint, "vectors": None, "entries": [], "texts": {}}
+            self._products[produktnummer] = product
+        return product
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def normalize_text(question: str) -> str:
+        """Kleinschreibung, ohne Satzzeichen und mehrfache Leerzeichen"""
+        return " ".join(re.findall(r"\w+", unicodedata.normalize("NFKC", question).lower()))
+
+    def _hit(self, seconds: float):
+        self._counter["hits"] += 1
+        self._counter["saved_seconds"] += seconds
+
+    def lookup_text(self, produktnummer: int, question: str):
+        """Liefert die gespeicherte Antwort auf dieselbe Frage (normalisierter Text) oder None. Eine Schwelle ueber 1
+        (z. B. ANSWER_CACHE_THRESHOLD=2 fuer Benchmarks) deaktiviert auch diesen Teil des Caches"""
+        key = self.normalize_text(question)
+        with self._lock:
+            entry = self._product(produktnummer)["texts"].get(key)
+            if entry is not None and self.threshold <= 1.0:
+                answer, seconds = entry
+                self._hit(seconds)
+                return answer
+            self._counter["misses"] += 1
+            return None
+
+    def store_text(self, produktnummer: int, question: str, answer: str, seconds: float):
+        """Speichert eine Antwort unter dem normalisierten Text der Frage"""
+        key = self.normalize_text(question)
+        with self._lock:
+            texts = self._product(produktnummer)["texts"]
+            texts.pop(key, None)
+            texts[key] = (answer, seconds)
+            # Aeltesten Eintrag entfernen
+            if len(texts) > self.max_entries:
+                del texts[next(iter(texts))]
+
+    def lookup(self, produktnummer: int, question_vector):
+        """Liefert die gespeicherte Antwort auf die aehnlichste Frage oder None"""
+        query = self._normalize(question_vector)
+        with self._lock:
+            product = self._product(produktnummer)
+            if product["vectors"] is not None:
+                similarities = product["vectors"] @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    _, answer, seconds = product["entries"][best]
+                    self._hit(seconds)
+                    return answer
+            self._counter["misses"] += 1
+            return None
+
+    def store(self, produktnummer: int, question: str, question_vector, answer: str, seconds: float):
+        """Speichert eine Antwort mit der Dauer ihrer Erzeugung (fuer die eingesparte Latenz)"""
+        vector = self._normalize(question_vector)[np.newaxis, :]
+        with self._lock:
+            product = self._product(produktnummer)
+            if product["vectors"] is None:
+                product["vectors"] = vector
+            else:
+                product["vectors"] = np.vstack([product["vectors"], vector])
+            product["entries"].append((question, answer, seconds))
+            # Aelteste Eintraege entfernen
+            if len(product["entries"]) > self.max_entries:
+                product["vectors"] = product["vectors"][-self.max_entries:]
+                product["entries"] = product["entries"][-self.max_entries:]
+
+    def stats(self) -> dict:
+        """Trefferquote und eingesparte Latenz"""
+        with self._lock:
+            stats = dict(self._counter)
+            stats["size"] = sum(len(product["entries"]) + len(product["texts"]) for product in self._products.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._products.clear()
@@ -0,0 +1,349 @@
+import re
+import unicodedata
+
+from fragebogen import questions
+
+# Regelbasierter Parser fuer die Antworten des Fragebogens. Die Fragen haben ein geschlossenes Vokabular (Betrag,
+# kurz-/mittel-/langfristig, kein/mittleres/hohes Risiko, ja/nein), sodass sich die Metadaten in den meisten Faellen
+# ohne LLM ermitteln lassen. Jedes Feld erhaelt eine Konfidenz. Nur Felder unterhalb der Schwelle werden vom LLM
+# ermittelt.
+
+# Ab dieser Konfidenz gilt ein Feld als sicher erkannt
+konfidenz_schwelle = 0.75
+
+_einer = {
+    "null": 0, "ein": 1, "eins": 1, "eine": 1, "einen": 1, "zwei": 2, "drei": 3, "vier": 4, "fuenf": 5, "sechs": 6,
+    "sieben": 7, "acht": 8, "neun": 9, "zehn": 10, "elf": 11, "zwoelf": 12, "dreizehn": 13, "vierzehn": 14,
+    "fuenfzehn": 15, "sechzehn": 16, "siebzehn": 17, "achtzehn": 18, "neunzehn": 19,
+}
+_zehner = {
+    "zwanzig": 20, "dreissig": 30, "vierzig": 40, "fuenfzig": 50, "sechzig": 60, "siebzig": 70, "achtzig": 80,
+    "neunzig": 90,
+}
+_multiplikator = {
+    "k": 1000, "tsd": 1000, "tausend": 1000, "mio": 1000000, "million": 1000000, "millionen": 1000000,
+}
+# Unbestimmte Mengen ("ein paar tausend", "einige tausend") ergeben nur einen Schaetzwert, den das LLM pruefen soll
+_vage_menge = {"paar": 2, "einige": 3, "einigen": 3, "mehrere": 3, "mehreren": 3}
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    return (text.replace("ä", "ae").replace("ö", "oe").replace("ü", "ue").replace("ß", "ss")
+            .replace("€", " euro "))
+
+
+def _parse_unter_tausend(word: str):
+    if not word:
+        return 0
+    if "hundert" in word:
+        links, _, rechts = word.partition("hundert")
+        faktor = _parse_unter_tausend(links) if links else 1
+        rest = _parse_unter_tausend(rechts)
+        if faktor is None or rest is None:
+            return None
+        return faktor * 100 + rest
+    if word in _einer:
+        return _einer[word]
+    if word in _zehner:
+        return _zehner[word]
+    if "und" in word:
+        einer, _, zehner = word.partition("und")
+        if einer in _einer and zehner in _zehner:
+            return _einer[einer] + _zehner[zehner]
+    return None
+
+
+def _parse_bruch(word: str):
+    """Halbe Zahlen: "halbe" (0,5), "anderthalb" (1,5), "zweieinhalb" (2,5), sonst None"""
+    if word in ("halb", "halbe", "halben"):
+        return 0.5
+    if word == "anderthalb":
+        return 1.5
+    if word.endswith("einhalb"):
+        ganz = _parse_unter_tausend(word[:-len("einhalb")])
+        return ganz + 0.5 if ganz is not None else None
+    return None
+
+
+def parse_zahlwort(word: str):
+    """Wandelt ein deutsches Zahlwort (z. B. fuenftausendfuenfhundert, zweieinhalbtausend) in eine Zahl um, sonst
+    None"""
+    word = _normalize(word)
+    if "tausend" in word:
+        links, _, rechts = word.partition("tausend")
+        faktor = (_parse_bruch(links) or _parse_unter_tausend(links)) if links else 1
+        rest = _parse_unter_tausend(rechts)
+        if faktor is None or rest is None:
+            return None
+        return faktor * 1000 + rest
+    bruch = _parse_bruch(word)
+    return bruch if bruch is not None else _parse_unter_tausend(word)
+
+
+def _zahl(text: str) -> float:
+    # Tausendertrennzeichen entfernen und Dezimalkomma umwandeln
+    text = re.sub(r"[.\s'](?=\d{3}(?!\d))", "", text)
+    return float(text.replace(",", "."))
+
+
+_betrag_muster = r"(\d+(?:[.\s']\d{3})*(?:,\d+)?|\d+(?:\.\d+)?)\s*(k|tsd|tausend|mio|millionen|million)?\b"
+
+
+def parse_betrag(answer: str):
+    """Ermittelt den Anlagebetrag aus der Antwort. Rueckgabe: (Betrag, Konfidenz)"""
+    text = _normalize(answer)
+
+    if re.search(r"keine (ahnung|vorstellung|idee)|weiss (ich )?(noch )?nicht|unklar|unsicher", text):
+        return 0, 0.9
+
+    betraege = []
+    for match in re.finditer(_betrag_muster, text):
+        betrag = _zahl(match.group(1)) * _multiplikator.get(match.group(2), 1)
+        betraege.append(betrag)
+
+    # Zahlwoerter, z. B. "fuenftausend", "fuenf tausend" oder "eine halbe million". Bereits erkannte Ziffern samt
+    # Einheit werden entfernt
+    woerter = re.findall(r"[a-z]+", re.sub(_betrag_muster, " ", text))
+    for index, word in enumerate(woerter):
+        if word in ("tausend", "million", "millionen", "mio") and index > 0:
+            vorher = woerter[index - 1]
+            faktor = _vage_menge.get(vorher) or parse_zahlwort(vorher)
+            betraege.append((faktor or 1) * _multiplikator[word])
+        elif word not in ("ein", "eine", "einen", "eins") and len(word) > 3:
+            zahl = parse_zahlwort(word)
+            if zahl and zahl >= 1 and not (index + 1 < len(woerter)
+                                           and woerter[index + 1] in ("tausend", "million", "millionen", "mio")):
+                betraege.append(zahl)
+
+    vage = re.search(r"\b(" + "|".join(_vage_menge) + r")\b", text)
+    if len(betraege) == 1:
+        return int(betraege[0]), 0.3 if vage else 1.0
+    if len(betraege) > 1:
+        # Mehrere Betraege (z. B. "zwischen 5000 und 10000") sind mehrdeutig
+        return int(betraege[0]), 0.3 if vage else 0.5
+    if re.search(r"\b(nichts|gar nichts|kein geld)\b", text):
+        return 0, 0.8
+    return 0, 0.0
+
+
+_laufzeit_exakt = {
+    "kurzfristig": r"\bkurzfristig",
+    "mittelfristig": r"\bmittelfristig",
+    "langfristig": r"\blangfristig",
+}
+_laufzeit_synonyme = {
+    "kurzfristig": r"\bkurz\b|\bwochen?\b|\btage?n?\b|jederzeit|sofort|taeglich|flexibel|nicht (so |sehr )?lange?\b",
+    "mittelfristig": r"\bmittel\b|\bmonate?n?\b|\bein paar jahre|\b(ein|zwei|drei|1|2|3) jahre?n?\b",
+    "langfristig": r"\blange?\b|laenger|viele jahre|jahrzehnt|rente|ruhestand|altersvorsorge|dauerhaft",
+}
+
+
+# Verneinte Laufzeit, z. B. "nicht langfristig", "eher nicht kurzfristig" oder "langfristig eher nicht"
+_laufzeit_verneint = (r"\b(?:nicht|keine?n?)\s+(?:so\s+|zu\s+|sehr\s+|allzu\s+|unbedingt\s+)?"
+                      r"(kurz|mittel|lang)fristig\w*|\b(kurz|mittel|lang)fristig\w*\s+(?:eher\s+|lieber\s+)?nicht\b")
+
+
+def parse_laufzeit(answer: str):
+    """Ermittelt die Laufzeit aus der Antwort. Rueckgabe: (Laufzeit, Konfidenz)"""
+    text = _normalize(answer)
+
+    # Eine verneinte Laufzeit legt die gewuenschte nicht fest. Nur eine zusaetzlich genannte Laufzeit (z. B. "nicht
+    # langfristig, eher mittelfristig") gilt als erkannt, sonst entscheidet das LLM
+    verneint = {match.group(1) or match.group(2) for match in re.finditer(_laufzeit_verneint, text)}
+    if verneint:
+        rest = re.sub(_laufzeit_verneint, " ", text)
+        treffer = {laufzeit for laufzeit, muster in _laufzeit_exakt.items()
+                   if re.search(muster, rest) and laufzeit[:-len("fristig")] not in verneint}
+        if len(treffer) == 1:
+            return treffer.pop(), 0.8
+        return ("kurzfristig" if "mittel" in verneint else "mittelfristig"), 0.3
+
+    treffer = {laufzeit for laufzeit, muster in _laufzeit_exakt.items() if re.search(muster, text)}
+    if len(treffer) == 1:
+        return treffer.pop(), 1.0
+    if len(treffer) > 1:
+        return sorted(treffer)[0], 0.3
+
+    # Explizite Anzahl Jahre: bis 3 Jahre mittelfristig, ab 5 Jahren langfristig
+    jahre = re.search(r"(\d+)\s*jahre?n?", text)
+    if jahre:
+        anzahl = int(jahre.group(1))
+        if anzahl <= 3:
+            return "mittelfristig", 0.8
+        if anzahl >= 5:
+            return "langfristig", 0.8
+        return "mittelfristig", 0.5
+
+    # "nicht lange" darf nicht als langfristig erkannt werden
+    if re.search(_laufzeit_synonyme["kurzfristig"], text):
+        return "kurzfristig", 0.8
+    treffer = {laufzeit for laufzeit, muster in _laufzeit_synonyme.items() if re.search(muster, text)}
+    if len(treffer) == 1:
+        return treffer.pop(), 0.8
+    if len(treffer) > 1:
+        return sorted(treffer)[0], 0.3
+    return "mittelfristig", 0.0
+
+
+_risiko_exakt = {
+    "kein Risiko": r"\bkein(e|en)? risiko|\bohne risiko",
+    "mittleres Risiko": r"\bmittlere(s|n)? risiko",
+    "hohes Risiko": r"\bhohe(s|n)? risiko",
+}
+_risiko_synonyme = {
+    "kein Risiko": (r"^\s*keins?\s*$|\bkeine?n? (verlust|schwankung|risiken)|\bnichts verlieren|\bsicher|vorsichtig"
+                    r"|risikoscheu|risikoavers|\bnull\b"),
+    "mittleres Risiko": r"\bmittel|\bmoderat|ausgewogen|\betwas\b|bisschen|\bbegrenzt",
+    "hohes Risiko": r"\bhoch|\bhohe|risikofreudig|risikobereit|spekulativ|aggressiv|\bviel risiko",
+}
+
+
+# Verneintes Wort vor bzw. nach der Verneinung, z. B. "nicht risikobereit", "risikobereit eher nicht" oder "hohes
+# Risiko eher nicht"
+_risiko_verneint = (r"\b(?:nicht|keine?n?)\s+(?:so\s+|zu\s+|sehr\s+|besonders\s+|allzu\s+|wirklich\s+)?(\w+)"
+                    r"|\b(\w+)(?:\s+risiko)?\s+(?:eher\s+|wirklich\s+|gar\s+|lieber\s+)?nicht\b")
+
+
+def _risiko_wort_verneint(text: str) -> bool:
+    """Prueft, ob eine Risikoklasse oder ein Synonym (ausser Synonymen, die selbst verneint sind, z. B. "keine
+    Verluste") verneint wird"""
+    for match in re.finditer(_risiko_verneint, text):
+        word = match.group(1) or match.group(2)
+        if re.match(r"hohe|hoch|mittlere", word) or any(re.search(muster, word)
+                                                        for muster in _risiko_synonyme.values()):
+            return True
+    return False
+
+
+def parse_risiko(answer: str):
+    """Ermittelt die Risikobereitschaft aus der Antwort. Rueckgabe: (Risiko, Konfidenz)"""
+    text = _normalize(answer)
+
+    # Verneinte Kategorien und Synonyme (z. B. "kein hohes Risiko", "nicht risikobereit") sind mehrdeutig
+    if _risiko_wort_verneint(text):
+        return "kein Risiko", 0.3
+
+    treffer = {risiko for risiko, muster in _risiko_exakt.items() if re.search(muster, text)}
+    if len(treffer) == 1:
+        return treffer.pop(), 1.0
+    if len(treffer) > 1:
+        return sorted(treffer)[0], 0.3
+
+    # Geringes Risiko liegt zwischen den Kategorien und wird dem LLM ueberlassen
+    if re.search(r"\b(gering|niedrig|wenig)", text):
+        return "kein Risiko", 0.5
+
+    treffer = {risiko for risiko, muster in _risiko_synonyme.items() if re.search(muster, text)}
+    if len(treffer) == 1:
+        return treffer.pop(), 0.8
+    if len(treffer) > 1:
+        return sorted(treffer)[0], 0.3
+    return "kein Risiko", 0.0
+
+
+# Erfahrung mit riskanten Investments (Frage 4): keine Erfahrung, schlechtes bzw. gutes Gefuehl dabei
+_erfahrung_keine = r"^\s*(nein|nie|noch nie)\b|\bkeine erfahrung|\bnoch nie\b"
+_erfahrung_negativ = r"nervoes|unangenehm|unwohl|schlecht|angst|verlust|verloren|bereut|stress|schlaflos"
+_erfahrung_positiv = r"spass|spannend|aufregend|begeistert|mehr davon|gerne wieder"
+
+
+def parse_erfahrung(answer: str):
+    """Ermittelt aus der Antwort zu den riskanten Investments, ob sie gegen eine Risikoklasse spricht. Rueckgabe:
+    "keine", "negativ", "positiv" oder None (neutral bzw. nicht erkannt)"""
+    text = _normalize(answer)
+    if re.search(_erfahrung_negativ, text):
+        return "negativ"
+    if re.search(_erfahrung_positiv, text):
+        return "positiv"
+    if re.search(_erfahrung_keine, text):
+        return "keine"
+    return None
+
+
+# Risikoklassen, denen die Erfahrung widerspricht (bzw. die sie in eine Richtung verschiebt). Das LLM leitet das Risiko
+# aus beiden Fragen ab, in diesen Faellen entscheidet daher das LLM
+_erfahrung_widerspricht = {
+    "keine": {"hohes Risiko"},
+    "negativ": {"hohes Risiko", "mittleres Risiko"},
+    "positiv": {"kein Risiko", "mittleres Risiko"},
+}
+
+
+def parse_nachhaltigkeit(answer: str):
+    """Ermittelt das Interesse an nachhaltigen Produkten. Rueckgabe: ("ja"/"nein", Konfidenz)"""
+    text = _normalize(answer)
+
+    if re.search(r"warum nicht|nicht abgeneigt|wieso nicht|nicht uninteressiert", text):
+        return "ja", 0.8
+    # Zustimmende Floskeln mit Verneinung ("keine Frage", "kein Problem") sind keine Ablehnung
+    text = re.sub(r"\b(keine frage|ohne frage|kein problem|kein thema|keine zweifel)\b", " klar ", text)
+
+    zustimmung = re.search(r"\bja\b", text)
+    ablehnung = re.search(r"\bnein\b", text)
+    verneinung = re.search(r"\b(nicht|kein|keine|keinen|eher weniger|weniger)\b", text)
+    # Zustimmung ohne "ja", sofern nicht selbst verneint (z. B. "nicht so wichtig", "nicht unbedingt")
+    positiv = re.search(r"gerne?\b|unbedingt|auf jeden fall|sehr\b|wichtig|interessiert|natuerlich|klar\b|absolut",
+                        re.sub(r"\b(nicht|kein|keine)\s+(so\s+|besonders\s+|sehr\s+|wirklich\s+)?\w+", " ", text))
+    # Widerspruechliche Antworten (z. B. "ja, aber nicht zwingend", "gerne, solange es nicht teurer ist") werden dem
+    # LLM ueberlassen
+    if (zustimmung or positiv) and (ablehnung or verneinung):
+        return "ja", 0.5
+    if ablehnung:
+        return "nein", 1.0
+    if verneinung:
+        return "nein", 0.9
+    if re.search(r"\begal\b|keine praeferenz|gleichgueltig|spielt keine rolle", text):
+        return "nein", 0.8
+    if zustimmung:
+        return "ja", 1.0
+    if positiv:
+        return "ja", 0.8
+    return "nein", 0.0
+
+
+def split_answers(customer_input: str) -> list[str]:
+    """Zerlegt den Text aus Fragen und Antworten in die einzelnen Antworten"""
+    positionen = []
+    start = 0
+    for question in questions:
+        index = customer_input.find(question, start)
+        if index < 0:
+            return []
+        positionen.append((index, index + len(question)))
+        start = index + len(question)
+
+    answers = []
+    for i, (_, ende) in enumerate(positionen):
+        naechste = positionen[i + 1][0] if i + 1 < len(positionen) else len(customer_input)
+        answers.append(customer_input[ende:naechste].strip().rstrip(",").strip())
+    return answers
+
+
+def parse_answers(customer_input: str):
+    """Ermittelt die Metadaten regelbasiert. Rueckgabe: (InvestmentMetadata-Dict, Konfidenz je Feld)"""
+    answers = split_answers(customer_input)
+    if answers:
+        betrag, risikobereitschaft, nachhaltigkeit = answers[0], answers[2], answers[4]
+        laufzeit, erfahrung = answers[1], answers[3]
+    else:
+        # Freitext ohne Fragen: alle Felder werden aus dem gesamten Text ermittelt
+        betrag = laufzeit = risikobereitschaft = nachhaltigkeit = customer_input
+
+    metadata, konfidenz = {}, {}
+    metadata["mindestanlagebetrag"], konfidenz["mindestanlagebetrag"] = parse_betrag(betrag)
+    metadata["laufzeit"], konfidenz["laufzeit"] = parse_laufzeit(laufzeit)
+    metadata["risiko"], konfidenz["risiko"] = parse_risiko(risikobereitschaft)
+    if answers and metadata["risiko"] in _erfahrung_widerspricht.get(parse_erfahrung(erfahrung), ()):
+        konfidenz["risiko"] = min(konfidenz["risiko"], 0.5)
+    metadata["nachhaltigkeit"], konfidenz["nachhaltigkeit"] = parse_nachhaltigkeit(nachhaltigkeit)
+
+    if not answers:
+        # Ohne Zuordnung zu den Fragen ist das Ergebnis weniger verlaesslich
+        konfidenz = {feld: wert * 0.5 for feld, wert in konfidenz.items()}
+    return metadata, konfidenz
+
+
+def unsichere_felder(konfidenz: dict) -> list[str]:
+    """Felder, deren Konfidenz unter der Schwelle liegt und die vom LLM ermittelt werden muessen"""
+    return [feld for feld, wert in konfidenz.items() if wert < konfidenz_schwelle]
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import telemetry
+import vectorstore_registry
+from fragebogen import format_answers
+from metadaten_cache import normalize_answers
+from produktkatalog import katalog
+
+# Batch-Empfehlung fuer viele Kundenprofile ohne Oberflaeche und ohne Session, z. B. fuer die Kampagnenplanung.
+# Eingabe ist ein Export der Fragebogen-Antworten (CSV oder Parquet), entweder mit dem vollstaendigen Text in der
+# Spalte answers oder mit einer Spalte je Antwort (--answer-columns). Die Eingabe wird in Bloecken verarbeitet:
+# - Metadaten-Extraktion je eindeutigem Antworttext (normalisiert wie im Metadaten-Cache) mit begrenzter Parallelitaet
+# - Aufloesung der Produkte fuer den ganzen Block per Join gegen den Produktkatalog (pandas), nicht je Kunde
+# - optional Produktvorstellungen (--pitches) je eindeutigem Antworttext
+# Jeder Block wird sofort an die Ausgabe (CSV) angehaengt. Der Checkpoint (<ausgabe>.checkpoint.json) haelt die Anzahl
+# verarbeiteter Zeilen und die Groesse der Ausgabe fest, ein abgebrochener Lauf setzt dort wieder auf.
+# Ausfuehrung: python batch_empfehlung.py antworten.csv --output empfehlungen.csv [--pitches] [--concurrency 16]
+
+ausgabe_spalten = ["id", "mindestanlagebetrag", "laufzeit", "risiko", "nachhaltigkeit", "produktnummer",
+                   "produktname", "pitch", "fehler"]
+
+
+def _normalize(values: pd.Series) -> pd.Series:
+    return values.astype("string").str.strip().str.lower()
+
+
+def katalog_frame() -> pd.DataFrame:
+    """Produktkatalog als DataFrame mit normalisierten Schluesseln fuer den Join"""
+    if not katalog.products():
+        raise FileNotFoundError(f"Produktkatalog {katalog.path} fehlt oder ist leer")
+    produkte = pd.DataFrame(katalog.products())
+    produkte = produkte.assign(laufzeit=_normalize(produkte["laufzeit"]), risiko=_normalize(produkte["risiko"]),
+                               nachhaltigkeit=_normalize(produkte["nachhaltigkeit"]))
+    # Wie im Katalog-Index werden nur Produkte mit Nachhaltigkeit ja/nein beruecksichtigt
+    return produkte[produkte["nachhaltigkeit"].isin(["ja", "nein"])]
+
+
+def resolve_products(profile: pd.DataFrame, produkte: pd.DataFrame) -> pd.Series:
+    """Ermittelt fuer alle Anlageprofile (Spalten mindestanlagebetrag, laufzeit, risiko, nachhaltigkeit) die
+    Produktnummer mit denselben Regeln wie ProduktKatalog.resolve: passende Laufzeit und Risiko, Mindestanlagebetrag
+    hoechstens der Anlagebetrag, nachhaltige Produkte zuerst, falls gewuenscht, dann der hoechste Mindestanlagebetrag.
+    Rueckgabe: Produktnummer je Zeile (<NA> ohne passendes Produkt)"""
+    kunden = pd.DataFrame({"zeile": np.arange(len(profile)),
+                           "betrag": pd.to_numeric(profile["mindestanlagebetrag"], errors="coerce").to_numpy(),
+                           "laufzeit": _normalize(profile["laufzeit"]).to_numpy(),
+                           "risiko": _normalize(profile["risiko"]).to_numpy(),
+                           "nachhaltig": (_normalize(profile["nachhaltigkeit"]) == "ja").fillna(False).to_numpy()})
+    paare = kunden.merge(produkte[["laufzeit", "risiko", "nachhaltigkeit", "mindestanlagebetrag", "produktnummer"]],
+                         on=["laufzeit", "risiko"])
+    paare = paare[paare["mindestanlagebetrag"] <= paare["betrag"]]
+    paare = paare.assign(nachrangig=~(paare["nachhaltig"] & (paare["nachhaltigkeit"] == "ja")))
+    # Bei gleichem Mindestanlagebetrag gewinnt die kleinere Produktnummer, wie im Katalog
+    beste = (paare.sort_values(["zeile", "nachrangig", "mindestanlagebetrag", "produktnummer"],
+                               ascending=[True, True, False, True])
+             .drop_duplicates("zeile"))
+    return beste.set_index("zeile")["produktnummer"].reindex(np.arange(len(profile))).astype("Int64")
+
+
+def read_blocks(path: str, block_size: int, skip: int = 0):
+    """Liest die Eingabe blockweise, die ersten skip Zeilen werden uebersprungen (Wiederaufnahme)"""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        gelesen = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=block_size):
+            block = batch.to_pandas()
+            if gelesen + len(block) > skip:
+                yield block.iloc[max(skip - gelesen, 0):]
+            gelesen += len(block)
+    else:
+        yield from pd.read_csv(path, chunksize=block_size, dtype=str, keep_default_na=False,
+                               skiprows=range(1, skip + 1))
+
+
+def customer_inputs(block: pd.DataFrame, answer_columns: list[str]) -> pd.Series:
+    """Text aus Fragen und Antworten je Zeile, wie ihn die Oberflaeche an das Backend uebergibt"""
+    if "answers" in block.columns:
+        return block["answers"].astype(str)
+    return pd.Series([format_answers(list(answers)) for answers in block[answer_columns].astype(str).itertuples(
+        index=False)], index=block.index)
+
+
+class BatchEmpfehlung:
+    """Verarbeitet Bloecke von Antworten: Extraktion, Produktaufloesung und optional Produktvorstellungen"""
+
+    def __init__(self, backend, concurrency: int = 16, pitches: bool = False):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.pitches = pitches
+        self.produkte = katalog_frame()
+        self._dokumente = {}
+        self.counter = {"zeilen": 0, "eindeutig": 0, "fehler": 0}
+
+    async def _extract(self, texte: list[str]) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def extract(text: str):
+            async with semaphore:
+                try:
+                    return await self.backend.aextract_metadata(text)
+                except Exception as error:
+                    return error
+
+        return await asyncio.gather(*[extract(text) for text in texte])
+
+    async def _pitch(self, auftraege: list[tuple]) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def pitch(text: str, produktnummer: int):
+            if produktnummer not in self._dokumente:
+                self._dokumente[produktnummer] = vectorstore_registry.get_dokument_store().by_product(produktnummer)
+            if not self._dokumente[produktnummer]:
+                return None
+            async with semaphore:
+                try:
+                    return await self.backend.apitch(text, self._dokumente[produktnummer])
+                except Exception as error:
+                    return error
+
+        return await asyncio.gather(*[pitch(text, produktnummer) for text, produktnummer in auftraege])
+
+    async def arun(self, block: pd.DataFrame, ids: pd.Series, texte: pd.Series) -> pd.DataFrame:
+        # Gleiche Antworten (nach Normalisierung) werden nur einmal extrahiert und vorgestellt
+        schluessel = texte.map(normalize_answers)
+        eindeutig = texte.groupby(schluessel, sort=False).first()
+        ergebnisse = await self._extract(eindeutig.tolist())
+
+        profile = pd.DataFrame([{} if isinstance(ergebnis, Exception) else ergebnis for ergebnis in ergebnisse],
+                               columns=["mindestanlagebetrag", "laufzeit", "risiko", "nachhaltigkeit"],
+                               index=eindeutig.index)
+        profile["fehler"] = [f"{type(ergebnis).__name__}: {ergebnis}" if isinstance(ergebnis, Exception) else ""
+                             for ergebnis in ergebnisse]
+        profile["produktnummer"] = resolve_products(profile, self.produkte).set_axis(profile.index)
+        namen = self.produkte.set_index("produktnummer")["produktname"]
+        profile["produktname"] = profile["produktnummer"].map(namen)
+
+        profile["pitch"] = ""
+        if self.pitches:
+            mit_produkt = profile[profile["produktnummer"].notna()]
+            pitches = await self._pitch([(eindeutig[key], int(nummer))
+                                         for key, nummer in mit_produkt["produktnummer"].items()])
+            for key, pitch in zip(mit_produkt.index, pitches):
+                if isinstance(pitch, Exception):
+                    profile.loc[key, "fehler"] = f"{type(pitch).__name__}: {pitch}"
+                elif pitch:
+                    profile.loc[key, "pitch"] = pitch
+
+        ergebnis = profile.loc[schluessel.to_numpy()].reset_index(drop=True)
+        ergebnis.insert(0, "id", ids.to_numpy())
+        self.counter["zeilen"] += len(block)
+        self.counter["eindeutig"] += len(eindeutig)
+        self.counter["fehler"] += int((profile["fehler"] != "").sum())
+        return ergebnis[ausgabe_spalten]
+
+
+def recommend_batch(answers: pd.DataFrame, backend=None, answer_columns: list[str] = None, id_column: str = "id",
+                    concurrency: int = 16, pitches: bool = False) -> pd.DataFrame:
+    """Empfehlungen fuer alle Zeilen eines DataFrames (ohne Checkpoint), z. B. aus einem Notebook"""
+    if backend is None:
+        import investmentadvisor_be as backend
+    batch = BatchEmpfehlung(backend, concurrency, pitches)
+    ids = answers[id_column] if id_column in answers.columns else pd.Series(answers.index)
+    return asyncio.run(batch.arun(answers, ids, customer_inputs(answers, answer_columns)))
+
+
+def _load_checkpoint(path: str, input_path: str) -> dict:
+    if not os.path.exists(path):
+        return {"input": os.path.abspath(input_path), "zeilen": 0, "offset": 0}
+    with open(path, encoding="utf-8") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint["input"] != os.path.abspath(input_path):
+        raise ValueError(f"Checkpoint {path} gehoert zu {checkpoint['input']}, nicht zu {input_path}")
+    return checkpoint
+
+
+def _save_checkpoint(path: str, checkpoint: dict):
+    """Schreibt den Checkpoint atomar (temporaere Datei und anschliessendes Umbenennen)"""
+    with open(path + ".tmp", "w", encoding="utf-8") as tmp:
+        json.dump(checkpoint, tmp)
+    os.replace(path + ".tmp", path)
+
+
+async def arun(input_path: str, output_path: str, answer_columns: list[str] = None, id_column: str = "id",
+               block_size: int = 1000, concurrency: int = 16, pitches: bool = False, neu: bool = False) -> dict:
+    """Verarbeitet die Eingabe blockweise und haengt die Ergebnisse an die Ausgabe an. Alle Bloecke laufen in einem
+    Event-Loop, damit die Verbindungen des LLM-Clients erhalten bleiben. Rueckgabe: Zaehler"""
+    import investmentadvisor_be as backend
+
+    checkpoint_path = output_path + ".checkpoint.json"
+    if neu:
+        for path in (output_path, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+    checkpoint = _load_checkpoint(checkpoint_path, input_path)
+
+    batch = BatchEmpfehlung(backend, concurrency, pitches)
+    start = time.perf_counter()
+    with open(output_path, "a+b") as output_file:
+        # Zeilen nach dem letzten Checkpoint stammen aus einem abgebrochenen Block und werden verworfen
+        output_file.truncate(checkpoint["offset"])
+        output_file.seek(checkpoint["offset"])
+        for block in read_blocks(input_path, block_size, checkpoint["zeilen"]):
+            ids = block[id_column] if id_column in block.columns else pd.Series(
+                np.arange(checkpoint["zeilen"], checkpoint["zeilen"] + len(block)))
+            ergebnis = await batch.arun(block, ids, customer_inputs(block, answer_columns))
+            ergebnis.to_csv(output_file, header=checkpoint["offset"] == 0, index=False, encoding="utf-8")
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+            checkpoint["zeilen"] += len(block)
+            checkpoint["offset"] = output_file.tell()
+            _save_checkpoint(checkpoint_path, checkpoint)
+            telemetry.log_event("batch_block", zeilen=checkpoint["zeilen"], eindeutig=batch.counter["eindeutig"],
+                                fehler=batch.counter["fehler"],
+                                zeilen_pro_minute=round(batch.counter["zeilen"] / (time.perf_counter() - start) * 60))
+    return {**batch.counter, "gesamt": checkpoint["zeilen"], "dauer_s": time.perf_counter() - start}
+
+
+def run(*args, **kwargs) -> dict:
+    return asyncio.run(arun(*args, **kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Produktempfehlungen fuer einen Export von Fragebogen-Antworten")
+    parser.add_argument("input", help="CSV- oder Parquet-Datei mit den Antworten")
+    parser.add_argument("--output", required=True, help="CSV-Datei fuer die Empfehlungen")
+    parser.add_argument("--answer-columns", nargs=5, metavar="SPALTE",
+                        help="Spalten mit den fuenf Antworten (ohne Spalte answers mit dem vollstaendigen Text)")
+    parser.add_argument("--id-column", default="id", help="Spalte mit der Kunden-ID (sonst Zeilennummer)")
+    parser.add_argument("--block-size", type=int, default=1000, help="Zeilen je Block bzw. Checkpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="Anzahl gleichzeitiger LLM-Aufrufe")
+    parser.add_argument("--pitches", action="store_true", help="Produktvorstellungen erzeugen")
+    parser.add_argument("--neu", action="store_true", help="Ausgabe und Checkpoint verwerfen und neu beginnen")
+    args = parser.parse_args()
+
+    ergebnis = run(args.input, args.output, args.answer_columns, args.id_column, args.block_size, args.concurrency,
+                   args.pitches, args.neu)
+    print(f"{ergebnis['gesamt']} Zeilen verarbeitet ({ergebnis['zeilen']} in diesem Lauf, {ergebnis['eindeutig']} "
+          f"eindeutige Antworten, {ergebnis['fehler']} Fehler) in {ergebnis['dauer_s']:.1f}s")
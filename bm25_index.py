@@ -0,0 +1,125 @@
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from langchain_core.documents import Document
+
+# Lokaler BM25-Index (invertierter Index) ueber die Chunks der Produktinformationsblaetter. Fachbegriffe wie
+# "Ausgabeaufschlag", "Mindestanlage" oder ISINs werden lexikalisch oft besser gefunden als ueber Embeddings. Der Index
+# wird bei der Ingestion erstellt und liegt als JSON-Datei im Persist-Verzeichnis.
+
+index_file = "bm25_index.json"
+
+# Haeufige Woerter ohne Bedeutung fuer die Suche
+_stoppwoerter = {
+    "der", "die", "das", "den", "dem", "des", "ein", "eine", "einen", "einem", "einer", "eines", "und", "oder", "ist",
+    "sind", "wie", "was", "wer", "wann", "wo", "welche", "welcher", "welches", "ich", "mein", "meine", "mir", "mich",
+    "sie", "es", "bei", "beim", "mit", "von", "vom", "zu", "zum", "zur", "in", "im", "an", "am", "auf", "fuer", "ueber",
+    "hoch", "gibt", "kann", "koennen", "wird", "werden", "hat", "haben", "nicht", "auch", "noch", "dieses",
+}
+
+# ISIN (z. B. DE0008491002) und WKN (z. B. 849100) werden immer exakt gesucht
+_kennung = re.compile(r"\b([a-z]{2}[a-z0-9]{9}\d|[a-z0-9]{6})\b")
+
+
+def index_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, index_file)
+
+
+def tokenize(text: str) -> list[str]:
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = text.replace("ä", "ae").replace("ö", "oe").replace("ü", "ue").replace("ß", "ss")
+    return [token for token in re.findall(r"\w+", text) if token not in _stoppwoerter and len(token) > 1]
+
+
+def build_index(ids: list[str], documents: list[str], metadatas: list[dict], k1: float = 1.5, b: float = 0.75) -> dict:
+    """Erstellt den Index aus den Chunks der Vektordatenbank"""
+    postings = {}
+    docs = {}
+    for doc_id, content, metadata in zip(ids, documents, metadatas):
+        tokens = tokenize(content)
+        docs[doc_id] = {"length": len(tokens), "content": content, "metadata": metadata}
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append([doc_id, tf])
+    avgdl = sum(doc["length"] for doc in docs.values()) / len(docs) if docs else 0.0
+    return {"k1": k1, "b": b, "avgdl": avgdl, "docs": docs, "postings": postings}
+
+
+def save_index(persist_directory: str, index: dict):
+    """Schreibt den Index atomar (temporaere Datei und anschliessendes Umbenennen)"""
+    path = index_path(persist_directory)
+    with open(path + ".tmp", "w", encoding="utf-8") as tmp:
+        json.dump(index, tmp, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+class BM25Index:
+    """Lesezugriff auf den BM25-Index. Die Datei wird nur neu gelesen, wenn sie sich geaendert hat"""
+
+    def __init__(self, persist_directory: str):
+        self.persist_directory = persist_directory
+        self._lock = threading.Lock()
+        self._signature = None
+        self._index = build_index([], [], [])
+
+    def _current(self) -> dict:
+        path = index_path(self.persist_directory)
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature != self._signature:
+                if signature:
+                    with open(path, encoding="utf-8") as index_file_handle:
+                        self._index = json.load(index_file_handle)
+                else:
+                    self._index = build_index([], [], [])
+                self._signature = signature
+            return self._index
+
+    def _idf(self, index: dict, term: str) -> float:
+        n = len(index["docs"])
+        df = len(index["postings"].get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, produktnummer: int = None, k: int = 6) -> list[tuple[Document, float]]:
+        """BM25-Suche, optional gefiltert nach Produktnummer. Rueckgabe: [(Chunk, Score)] absteigend"""
+        index = self._current()
+        k1, b, avgdl = index["k1"], index["b"], index["avgdl"] or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self._idf(index, term)
+            for doc_id, tf in index["postings"].get(term, ()):
+                doc = index["docs"][doc_id]
+                if produktnummer is not None and doc["metadata"].get("produktnummer") != produktnummer:
+                    continue
+                norm = tf + k1 * (1 - b + b * doc["length"] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(Document(page_content=index["docs"][doc_id]["content"], metadata=index["docs"][doc_id]["metadata"],
+                          id=doc_id), score) for doc_id, score in ranked]
+
+    def rare_terms(self, query: str, max_df: float = 0.05) -> list[str]:
+        """Begriffe der Frage, die nur in wenigen Chunks vorkommen (Fachbegriffe), sowie ISINs und WKNs"""
+        index = self._current()
+        n = len(index["docs"]) or 1
+        terms = []
+        for term in set(tokenize(query)):
+            df = len(index["postings"].get(term, ()))
+            if df and (df / n <= max_df or _kennung.fullmatch(term) and any(c.isdigit() for c in term)):
+                terms.append(term)
+        return terms
+
+    def unknown_terms(self, query: str) -> list[str]:
+        """Begriffe der Frage, die in keinem Chunk vorkommen"""
+        postings = self._current()["postings"]
+        return [term for term in set(tokenize(query)) if term not in postings]
+
+    def idf(self, term: str) -> float:
+        return self._idf(self._current(), term)
@@ -0,0 +1,153 @@
+import logging
+import threading
+
+import tiktoken
+from langchain_core.prompts import ChatPromptTemplate
+
+import telemetry
+from antwort_parser import split_answers
+
+# Chat-Historie fuer die RAG-Chain mit Token-Budget. Die letzten Gespraechsrunden bleiben woertlich erhalten, aeltere
+# Runden werden in einer fortlaufenden Zusammenfassung verdichtet, die in der Session liegt und nur um die jeweils neu
+# herausfallenden Runden ergaenzt wird. Die Fragen des Fragebogens werden aus der Historie entfernt, nur die Antworten
+# des Kunden bleiben als Anlageprofil erhalten.
+
+# Bezeichnungen der Antworten des Fragebogens (Reihenfolge wie fragebogen.questions)
+_profil_felder = ["Anlagebetrag", "Laufzeit", "Risikobereitschaft", "Erfahrung mit riskanten Investments",
+                  "Nachhaltigkeit"]
+
+summary_system_prompt = """Du fasst den bisherigen Verlauf einer Anlageberatung knapp auf Deutsch zusammen. Behalte
+    das Anlageprofil des Kunden, das empfohlene Produkt, gestellte Fragen und gegebene Antworten mit allen Zahlen.
+    Lasse Begruessungen und Floskeln weg. Antworte nur mit der Zusammenfassung."""
+
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", summary_system_prompt),
+    ("human", "Bisherige Zusammenfassung:\n{summary}\n\nNeue Nachrichten:\n{messages}"),
+])
+
+
+class SchaetzEncoding:
+    """Grobe Token-Schaetzung (ca. 4 Zeichen pro Token), wenn tiktoken die Encoding-Datei nicht laden kann"""
+
+    def encode(self, text: str) -> list[int]:
+        return [0] * (max(len(text) // 4, 1) if text else 0)
+
+
+def token_encoding(model: str):
+    """Tokenizer des Modells (Fallback auf o200k_base fuer unbekannte Modelle). tiktoken laedt die Encoding-Datei beim
+    ersten Aufruf aus dem Netz, ohne Netzwerk (z. B. Benchmark oder Lasttest mit Mock-Server) wird geschaetzt"""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as error:
+        telemetry.log_event("tokenizer_schaetzung", logging.WARNING, model=model, error=repr(error))
+        return SchaetzEncoding()
+
+
+def clean_message(message: dict) -> dict:
+    """Ersetzt die Antworten des Fragebogens (inkl. Fragetexte) durch ein kompaktes Anlageprofil"""
+    answers = split_answers(message["content"]) if message["role"] == "user" else []
+    if not answers:
+        return message
+    profil = "; ".join(f"{feld}: {answer}" for feld, answer in zip(_profil_felder, answers))
+    return {"role": "user", "content": f"Mein Anlageprofil: {profil}"}
+
+
+def split_turns(messages: list[dict]) -> list[list[dict]]:
+    """Teilt die Nachrichten in Gespraechsrunden (eine Runde beginnt mit einer Nachricht des Kunden)"""
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class ChatHistorie:
+    """Baut die Chat-Historie fuer die RAG-Chain innerhalb eines Token-Budgets"""
+
+    def __init__(self, llm, model: str, max_tokens: int = 1500, keep_turns: int = 3):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_chain = summary_prompt | llm
+        self._encoding = token_encoding(model)
+        self._lock = threading.Lock()
+        self._counter = {"turns": 0, "prompt_tokens": 0, "full_prompt_tokens": 0, "summaries": 0}
+
+    def count_tokens(self, messages: list[dict]) -> int:
+        # Pro Nachricht ca. 4 Tokens fuer Rolle und Trennzeichen
+        return sum(len(self._encoding.encode(message["content"])) + 4 for message in messages)
+
+    def _split(self, session: dict):
+        """Aufteilung in neu zusammenzufassende und woertlich uebernommene Runden sowie die Anzahl der Runden, die
+        nach dem Zusammenfassen abgedeckt sind"""
+        turns = split_turns(session["messages"])
+        recent = max(len(turns) - self.keep_turns, 0)
+        covered = min(session.get("summary_turns", 0), recent)
+        return turns[covered:recent], turns[recent:], recent
+
+    def build(self, session: dict, question: str) -> list[dict]:
+        """Chat-Historie aus Zusammenfassung und den letzten Runden. Aeltere der letzten Runden fallen weg, solange
+        das Budget ueberschritten ist (die letzte Runde bleibt immer erhalten)."""
+        pending, recent, _ = self._split(session)
+        recent = [[clean_message(message) for message in turn] for turn in pending + recent]
+        summary = session.get("summary", "")
+        prefix = [{"role": "system", "content": f"Zusammenfassung des bisherigen Gespraechs: {summary}"}] \
+            if summary else []
+
+        budget = self.max_tokens - self.count_tokens(prefix + [{"role": "user", "content": question}])
+        while len(recent) > 1 and self.count_tokens([m for turn in recent for m in turn]) > budget:
+            recent.pop(0)
+        history = prefix + [message for turn in recent for message in turn]
+
+        self._report(session, question, history)
+        return history
+
+    def _report(self, session: dict, question: str, history: list[dict]):
+        frage = [{"role": "user", "content": question}]
+        tokens = self.count_tokens(history + frage)
+        full_tokens = self.count_tokens(session["messages"] + frage)
+        with self._lock:
+            self._counter["turns"] += 1
+            self._counter["prompt_tokens"] += tokens
+            self._counter["full_prompt_tokens"] += full_tokens
+        telemetry.log_event("chat_historie", tokens=tokens, ungekuerzt=full_tokens, nachrichten=len(history))
+
+    def _summary_input(self, session: dict):
+        pending, _, summary_turns = self._split(session)
+        if not pending:
+            return None, summary_turns
+        messages = "\n".join(f"{message['role']}: {clean_message(message)['content']}"
+                             for turn in pending for message in turn)
+        return {"summary": session.get("summary", "") or "-", "messages": messages}, summary_turns
+
+    def refresh(self, session: dict):
+        """Ergaenzt die Zusammenfassung um die Runden, die aus dem Fenster der letzten Runden herausgefallen sind.
+        Rueckgabe: zu speichernde Felder der Session oder None"""
+        inputs, summary_turns = self._summary_input(session)
+        if inputs is None:
+            return None
+        summary = self.summary_chain.invoke(inputs).content
+        self._count_summary()
+        return {"summary": summary, "summary_turns": summary_turns}
+
+    async def arefresh(self, session: dict):
+        inputs, summary_turns = self._summary_input(session)
+        if inputs is None:
+            return None
+        summary = (await self.summary_chain.ainvoke(inputs)).content
+        self._count_summary()
+        return {"summary": summary, "summary_turns": summary_turns}
+
+    def _count_summary(self):
+        with self._lock:
+            self._counter["summaries"] += 1
+
+    def stats(self) -> dict:
+        """Prompt-Tokens der Chat-Historie im Vergleich zur ungekuerzten Historie"""
+        with self._lock:
+            stats = dict(self._counter)
+        stats["saved_tokens"] = stats["full_prompt_tokens"] - stats["prompt_tokens"]
+        return stats
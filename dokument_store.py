@@ -0,0 +1,71 @@
+import json
+import os
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+
+# Docstore fuer die vollstaendigen Seiten der Produktinformationsblaetter (Parent-Dokumente). Eingebettet werden nur
+# die Chunks in der Vektordatenbank, jeder Chunk verweist ueber parent_id auf seine Seite. Die Produktempfehlung liest
+# die Seiten eines Produkts direkt, die RAG-Chain erweitert gefundene Chunks um ihre Seiten.
+
+store_file = "parent_documents.sqlite3"
+
+
+def store_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, store_file)
+
+
+def _document(doc_id: str, content: str, metadata: str) -> Document:
+    return Document(page_content=content, metadata=json.loads(metadata), id=doc_id)
+
+
+class DokumentStore:
+    """Seiten je ID und Produktnummer in einer SQLite-Datei im Persist-Verzeichnis"""
+
+    def __init__(self, persist_directory: str):
+        os.makedirs(persist_directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(store_path(persist_directory), timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, produktnummer INTEGER, "
+                         "source TEXT, page INTEGER, content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_produkt ON documents (produktnummer, source, page)")
+        self._db.commit()
+
+    def ids(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT id FROM documents")}
+
+    def add(self, ids: list[str], documents: list[Document]):
+        rows = [(doc_id, doc.metadata.get("produktnummer"), doc.metadata.get("source"), doc.metadata.get("page", 0),
+                 doc.page_content, json.dumps(doc.metadata, default=str))
+                for doc_id, doc in zip(ids, documents)]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def delete(self, ids: list[str]):
+        with self._lock:
+            self._db.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self._db.commit()
+
+    def get(self, ids: list[str]) -> dict:
+        """Seiten je ID"""
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._db.execute(f"SELECT id, content, metadata FROM documents WHERE id IN ({placeholders})",
+                                    list(ids)).fetchall()
+        return {row[0]: _document(*row) for row in rows}
+
+    def by_product(self, produktnummer: int) -> list[Document]:
+        """Alle Seiten eines Produkts in Dokumentreihenfolge"""
+        with self._lock:
+            rows = self._db.execute("SELECT id, content, metadata FROM documents WHERE produktnummer = ? "
+                                    "ORDER BY source, page", (produktnummer,)).fetchall()
+        return [_document(*row) for row in rows]
+
+    def products(self) -> list[int]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT produktnummer FROM documents")]
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# Persistenter Embedding-Cache fuer Ingestion und Abfragen. Schluessel ist der Hash aus Modell und Text, die Vektoren
+# liegen kompakt als float32 in einer SQLite-Datei. Bereits berechnete Vektoren (erneute Ingestion, andere
+# Chunk-Groessen mit identischen Chunks, wiederholte Kundenfragen) werden nicht erneut beim Anbieter angefragt.
+
+# Standard-Ablage des Caches (ueberschreibbar mit EMBEDDING_CACHE_DB)
+default_db_path = "embedding_cache/embeddings.sqlite3"
+
+# Maximale Anzahl Parameter pro SQL-Abfrage
+_batch_lookup = 500
+
+
+def _pack(vector: list[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> list[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrapper um ein Embedding-Modell mit persistentem Cache. Ueberschreitet der Cache max_bytes, werden die am
+    laengsten nicht verwendeten Eintraege entfernt."""
+
+    def __init__(self, embeddings: Embeddings, model: str, db_path: str = default_db_path,
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counter = {"hits": 0, "misses": 0, "evictions": 0}
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                         "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+        self._db.commit()
+        self._size = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{text}".encode("utf-8")).hexdigest()
+
+    def lookup(self, texts: list[str]) -> dict:
+        """Liefert die vorhandenen Vektoren je Schluessel (gebuendelte Abfrage)"""
+        keys = list(dict.fromkeys(self.key(text) for text in texts))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _batch_lookup):
+                batch = keys[start:start + _batch_lookup]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                                        batch).fetchall()
+                found.update({key: _unpack(blob) for key, blob in rows})
+                if rows:
+                    now = time.time()
+                    self._db.executemany("UPDATE embeddings SET used = ? WHERE key = ?",
+                                         [(now, key) for key, _ in rows])
+            self._db.commit()
+        return found
+
+    def store(self, texts: list[str], vectors: list[list[float]]):
+        now = time.time()
+        rows = {self.key(text): _pack(vector) for text, vector in zip(texts, vectors)}
+        with self._lock:
+            for key, blob in rows.items():
+                previous = self._db.execute("SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)).fetchone()
+                self._size += len(blob) - (previous[0] if previous else 0)
+                self._db.execute("INSERT OR REPLACE INTO embeddings (key, vector, used) VALUES (?, ?, ?)",
+                                 (key, blob, now))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # Entfernt die am laengsten nicht verwendeten Eintraege, bis der Cache unter 90 % von max_bytes liegt
+        if self._size <= self.max_bytes:
+            return
+        grenze = self.max_bytes * 0.9
+        rows = self._db.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY used").fetchall()
+        removed = []
+        for key, length in rows:
+            if self._size <= grenze:
+                break
+            removed.append((key,))
+            self._size -= length
+        self._db.executemany("DELETE FROM embeddings WHERE key = ?", removed)
+        self._counter["evictions"] += len(removed)
+
+    def _split(self, texts: list[str]):
+        found = self.lookup(texts)
+        missing = list(dict.fromkeys(text for text in texts if self.key(text) not in found))
+        with self._lock:
+            self._counter["hits"] += len(texts) - len(missing)
+            self._counter["misses"] += len(missing)
+        return found, missing
+
+    def _merge(self, texts: list[str], found: dict, missing: list[str], vectors: list[list[float]]):
+        if missing:
+            self.store(missing, vectors)
+            found.update({self.key(text): vector for text, vector in zip(missing, vectors)})
+        return [found[self.key(text)] for text in texts]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        found, missing = self._split(texts)
+        vectors = self.embeddings.embed_documents(missing) if missing else []
+        return self._merge(texts, found, missing, vectors)
+
+    def embed_query(self, text: str) -> list[float]:
+        found, missing = self._split([text])
+        vectors = [self.embeddings.embed_query(text)] if missing else []
+        return self._merge([text], found, missing, vectors)[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        found, missing = self._split(texts)
+        vectors = await self.embeddings.aembed_documents(missing) if missing else []
+        return self._merge(texts, found, missing, vectors)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        found, missing = self._split([text])
+        vectors = [await self.embeddings.aembed_query(text)] if missing else []
+        return self._merge([text], found, missing, vectors)[0]
+
+    def stats(self) -> dict:
+        """Trefferzaehler und Groesse des Caches"""
+        with self._lock:
+            stats = dict(self._counter)
+            stats["entries"] = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            stats["bytes"] = self._size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM embeddings")
+            self._db.commit()
+            self._size = 0
+
+
+def cached_embeddings(embeddings: Embeddings, model: str) -> Embeddings:
+    """Wrappt das Embedding-Modell mit dem Cache (Konfiguration ueber EMBEDDING_CACHE_DB und EMBEDDING_CACHE_MAX_MB,
+    EMBEDDING_CACHE_DB=off deaktiviert den Cache)"""
+    db_path = os.getenv("EMBEDDING_CACHE_DB", default_db_path)
+    if db_path.lower() in ("", "off", "none"):
+        return embeddings
+    max_bytes = int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024)
+    return CachedEmbeddings(embeddings, model, db_path=db_path, max_bytes=max_bytes)
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import typing
+from typing import Any, Callable, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from antwort_parser import parse_answers
+
+# Lokale Stand-ins fuer die Modell-Backends, um Ingestion und Abfragen ohne OpenAI-Zugang reproduzierbar zu messen.
+
+
+class RateLimitError(Exception):
+    """Simulierter Rate-Limit-Fehler (HTTP 429)"""
+    status_code = 429
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministische Embeddings per Feature-Hashing der Woerter. Gleiche Texte ergeben gleiche Vektoren, Texte mit
+    gemeinsamen Woertern aehnliche Vektoren. Latenz pro Aufruf und Rate-Limits lassen sich simulieren."""
+
+    def __init__(self, size: int = 3072, latency: float = 0.0, latency_per_text: float = 0.0,
+                 rate_limit_probability: float = 0.0, seed: int = 0):
+        self.size = size
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.rate_limit_probability = rate_limit_probability
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.texts = 0
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.size
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _simulate(self, count: int) -> float:
+        """Zaehlt den Aufruf, simuliert Rate-Limits und liefert die simulierte Latenz"""
+        self.calls += 1
+        self.texts += count
+        if self.rate_limit_probability and self._random.random() < self.rate_limit_probability:
+            raise RateLimitError("Rate limit reached (simuliert)")
+        return self.latency + self.latency_per_text * count
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self._simulate(len(texts)))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self._simulate(1))
+        return self._embed(text)
+
+    # Asynchron ohne Thread-Pool, die Latenz blockiert den Event-Loop nicht (wie ein echter HTTP-Aufruf)
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self._simulate(len(texts)))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self._simulate(1))
+        return self._embed(text)
+
+
+def _schema_fields(schema) -> dict:
+    return typing.get_type_hints(schema) if isinstance(schema, type) else dict(schema.get("properties", {}))
+
+
+def default_structured_responder(schema, text: str) -> dict:
+    """Antwort fuer Structured Output: Die Metadaten-Extraktion nutzt den regelbasierten Parser, alle anderen Felder
+    werden mit dem Anfang des Textes bzw. 0 gefuellt"""
+    fields = _schema_fields(schema)
+    metadata, _ = parse_answers(text)
+    if set(fields) <= set(metadata):
+        return {field: metadata[field] for field in fields}
+    return {field: 0 if fields[field] is int else " ".join(text.split()[:40]) for field in fields}
+
+
+def count_tokens(text: str) -> int:
+    """Grobe Token-Schaetzung (ca. 4 Zeichen pro Token), unabhaengig vom Tokenizer des Modells"""
+    return max(len(text) // 4, 1) if text else 0
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministisches Chat-Modell ohne Netzwerk. Antwortet mit dem Anfang der letzten Nachricht, erzeugt bei
+    gebundenen Tools einen Tool-Call (solange noch kein Tool-Ergebnis vorliegt) und liefert Structured Output ueber
+    structured_responder. Latenz pro Aufruf und pro Token sowie die Token-Nutzung werden simuliert."""
+
+    model_name: str = "fake-chat"
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_words: int = 60
+    tool_names: list[str] = []
+    # Schema fuer Structured Output (gesetzt von with_structured_output)
+    output_schema_: Any = None
+    structured_responder: Optional[Callable] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: list[BaseMessage]) -> AIMessage:
+        text = messages[-1].content if messages else ""
+        input_tokens = sum(count_tokens(str(message.content)) for message in messages)
+        if self.output_schema_ is not None:
+            responder = self.structured_responder or default_structured_responder
+            content = json.dumps(responder(self.output_schema_, text))
+        elif self.tool_names and not any(isinstance(message, ToolMessage) for message in messages):
+            call_id = "call_" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+            return AIMessage(content="", tool_calls=[{"name": self.tool_names[0], "args": {"customer_input": text},
+                                                      "id": call_id}],
+                             usage_metadata={"input_tokens": input_tokens, "output_tokens": 10,
+                                             "total_tokens": input_tokens + 10},
+                             response_metadata={"model_name": self.model_name})
+        else:
+            content = " ".join(str(text).split()[:self.answer_words])
+        output_tokens = count_tokens(content)
+        return AIMessage(content=content, usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                                          "total_tokens": input_tokens + output_tokens},
+                         response_metadata={"model_name": self.model_name})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._reply(messages)
+        time.sleep(self.latency + self.token_latency * message.usage_metadata["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._reply(messages)
+        await asyncio.sleep(self.latency + self.token_latency * message.usage_metadata["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage):
+        """Chunks der gestreamten Antwort: (Latenz vor dem Chunk, Chunk, ist Token)"""
+        if message.tool_calls:
+            yield self.latency, ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+                for call in message.tool_calls])), False
+        else:
+            for index, word in enumerate(message.content.split(" ")):
+                latency = self.token_latency + (self.latency if index == 0 else 0.0)
+                yield latency, ChatGenerationChunk(message=AIMessageChunk(content=word + " ")), True
+        yield 0.0, ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata,
+                                                              response_metadata=message.response_metadata)), False
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for latency, chunk, token in self._chunks(self._reply(messages)):
+            time.sleep(latency)
+            if token and run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for latency, chunk, token in self._chunks(self._reply(messages)):
+            await asyncio.sleep(latency)
+            if token and run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(tool, "name", None) or getattr(tool, "__name__", str(tool)) for tool in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    def with_structured_output(self, schema, **kwargs):
+        structured = self.model_copy(update={"output_schema_": schema})
+        return structured | RunnableLambda(lambda message: json.loads(message.content))
@@ -0,0 +1,15 @@
+# Liste der Fragen, die dem Kunden nacheinander gestellt werden. Wird von der Oberflaeche und vom regelbasierten
+# Parser der Antworten verwendet
+questions = [
+    "Wie viel möchten Sie anlegen?",
+    "Für wie lange möchten Sie das Geld anlegen (kurzfristig, mittelfristig, langfristig)?",
+    "Wie würden Sie Ihre Risikobereitschaft einschätzen (z. B. kein Risiko, mittleres Risiko, hohes Risiko)?",
+    "Haben Sie in der Vergangenheit bereits riskante Investments getätigt (z. B. Aktien, Derivate) und wie haben Sie "
+    "sich dabei gefühlt?",
+    "Interessieren Sie sich für nachhaltige Anlageprodukte?"
+]
+
+
+def format_answers(answers: list[str]) -> str:
+    """Baut aus den einzelnen Antworten den Text, den die Oberflaeche an das Backend uebergibt"""
+    return "".join(question + " " + answer + ", " for question, answer in zip(questions, answers))
@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+
+# Manifest der Ingestion: haelt pro PDF-Datei den Inhalts-Hash, die Produktnummer, die Chunk-Einstellungen und die
+# IDs der eingebetteten Chunks sowie der Seiten im Docstore fest. Liegt im Persist-Verzeichnis der Vektordatenbank.
+
+manifest_file = "ingest_manifest.json"
+
+
+def manifest_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, manifest_file)
+
+
+def load_manifest(persist_directory: str) -> dict:
+    path = manifest_path(persist_directory)
+    if not os.path.exists(path):
+        # Ohne Manifest wird wie bei einer Ablage im alten Format vollstaendig neu eingelesen
+        return {"version": 1, "files": {}}
+    with open(path, encoding="utf-8") as manifest:
+        return json.load(manifest)
+
+
+def save_manifest(persist_directory: str, manifest: dict):
+    """Schreibt das Manifest atomar (temporaere Datei und anschliessendes Umbenennen)"""
+    os.makedirs(persist_directory, exist_ok=True)
+    path = manifest_path(persist_directory)
+    with open(path + ".tmp", "w", encoding="utf-8") as tmp:
+        json.dump(manifest, tmp, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def product_fingerprints(persist_directory: str) -> dict:
+    """Inhalts-Hash der indexierten Datei je Produktnummer"""
+    files = load_manifest(persist_directory)["files"]
+    return {entry["produktnummer"]: entry["hash"] for entry in files.values()}
+
+
+class FingerprintCache:
+    """Inhalts-Hashes je Produktnummer. Das Manifest wird nur neu gelesen, wenn sich die Datei geaendert hat"""
+
+    def __init__(self, persist_directory: str):
+        self.persist_directory = persist_directory
+        self._lock = threading.Lock()
+        self._signature = None
+        self._fingerprints = {}
+
+    def get(self, produktnummer: int):
+        path = manifest_path(self.persist_directory)
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature != self._signature:
+                self._fingerprints = product_fingerprints(self.persist_directory) if signature else {}
+                self._signature = signature
+            return self._fingerprints.get(produktnummer)
@@ -1,20 +1,34 @@
+import asyncio
+import functools
+import hashlib
 import json
+import logging
+import os
+import threading
+import time
 from typing import TypedDict, Annotated, Sequence
-from PIL import Image
-import streamlit as st
 from dotenv import load_dotenv
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain_chroma import Chroma
-from langchain_core.messages import ToolMessage, BaseMessage
+from langchain_core.messages import ToolMessage, BaseMessage, AIMessageChunk, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.runnables import RunnableLambda, RunnableConfig
+from langchain_core.tools import StructuredTool
 from langgraph.constants import END
 from langgraph.graph import StateGraph, add_messages
-from langchain_core.documents import Document
-import io
+
+import telemetry
+import vectorstore_registry
+from session_store import create_session_store
+from antwort_parser import parse_answers, unsichere_felder
+from metadaten_cache import MetadatenCache
+from embedding_cache import cached_embeddings
+from antwort_cache import AntwortCache
+from chat_historie import ChatHistorie, clean_message
+from kontext_retriever import KontextRetriever
+from bm25_index import BM25Index
+from ingest_manifest import FingerprintCache
+from produkt_pitches import ProduktPitches, personalize_messages
+from produktkatalog import katalog
+from produktblaetter import produktblaetter
 
 load_dotenv()
 
@@ -22,17 +36,62 @@ load_dotenv()
 llm_model = "gpt-4o"
 embedding_model = "text-embedding-3-large"
 
-llm = ChatOpenAI(model=llm_model)
+# Modell-Backend (MODEL_BACKEND): OpenAI bzw. ein OpenAI-kompatibler Endpunkt, lokaler Stand-in-Server oder
+# Stand-ins ohne HTTP, siehe model_provider.py
+model_backend = os.getenv("MODEL_BACKEND", "openai")
+
+
+# Modelle, Graph und Retriever werden erst bei der ersten Verwendung erzeugt und danach pro Prozess wiederverwendet.
+# Streamlit fuehrt das Skript der Oberflaeche bei jeder Interaktion erneut aus, das Backend-Modul bleibt dabei geladen,
+# sodass jede Ressource nur einmal entsteht. Der Import des Backends laedt weder langchain_openai, httpx noch Chroma.
+_init_lock = threading.RLock()
+
+
+def _einmalig(factory):
+    """Cacht das Ergebnis einer Factory pro Prozess. Die Sperre verhindert, dass der Warm-up im Hintergrund und eine
+    gleichzeitige erste Anfrage dieselbe Ressource doppelt erzeugen"""
+    cached = functools.lru_cache(maxsize=None)(factory)
+
+    @functools.wraps(factory)
+    def wrapper(*args):
+        with _init_lock:
+            return cached(*args)
+
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
+@_einmalig
+def get_llm():
+    import model_provider
+
+    # Dauer und Tokens jedes LLM-Aufrufs erfasst der Telemetrie-Callback (auch in Kopien wie bind_tools)
+    return model_provider.chat_model(llm_model, callbacks=[telemetry.callback], stream_usage=True)
 
-# Initialisiere Vektordatenbank (Chroma) mit gespeicherten, vektorisierten Produktinformationen
-embeddings = OpenAIEmbeddings(
-    model=embedding_model)
+
+@_einmalig
+def get_embeddings():
+    """Embedding-Modell fuer die Kundenfragen. Die Embeddings werden im persistenten Embedding-Cache abgelegt, gezaehlt
+    werden nur Aufrufe beim Anbieter"""
+    import model_provider
+
+    name = model_provider.embedding_cache_name(embedding_model)
+    embeddings = cached_embeddings(telemetry.InstrumentedEmbeddings(model_provider.embeddings(embedding_model), name),
+                                   name)
+    if hasattr(embeddings, "stats"):
+        telemetry.register_cache("embedding", embeddings.stats)
+    return embeddings
+
+
+# Zustand der Beratungen, adressiert ueber die Session-ID (Konfiguration ueber SESSION_STORE)
+session_store = create_session_store()
 
 
 class AgentState(TypedDict):
     """Initialisiere AgentState fuer Kommunikation im Graph"""
     messages: Annotated[Sequence[BaseMessage], add_messages]
     documents: Annotated[list[str], "Liste mit Dokumenten"]
+    metadata: Annotated[dict, "Extrahierte Metadaten (nur im Pipeline-Modus)"]
 
 
 # TypedDict
@@ -48,14 +107,8 @@ class InvestmentMetadata(TypedDict):
         str, ..., "Die Interesse des Kunden, ob er an nachhaltige Produkte interessiert ist (ja, nein)"]
 
 
-# Definiere Tool um Metadaten aus den Antworten des Anwenders zu ermitteln
-# Verwendung eines Few-Shot-Prompt für bessere Ermittlung der Metadaten
-# Structured LLM: Ausgabe des LLM in Form von vordefinierter TypedDict
-@tool
-def retrieve_metadata(customer_input: str):
-    """Extrahiert mithilfe GPT-Modell Metadaten aus den Antworten"""
-
-    retrieve_metadata_system = """Du bist ein spezialisierter Anlageberater von einer Bank. Du ermittelst anhand der 
+# System-Prompt (Few-Shot) fuer die Ermittlung der Metadaten
+retrieve_metadata_system = """Du bist ein spezialisierter Anlageberater von einer Bank. Du ermittelst anhand der 
     gegebenen Fragen und den dazugehörigen Antworten die folgende Metadaten: Mindestanlagebetrag, Laufzeit, Risiko und 
     Nachhaltigkeit.
     \n 
@@ -88,70 +141,146 @@ def retrieve_metadata(customer_input: str):
     Geld für ein paar Monate anlegen 
     example_assistant: laufzeit: "mittelfristig" """
 
-    prompt = ChatPromptTemplate.from_messages([("system", retrieve_metadata_system), ("human", "{input}")])
-    structured_llm = llm.with_structured_output(InvestmentMetadata)
-    few_shot_structured_llm = prompt | structured_llm
+# Version von Prompt und Modell als Teil des Cache-Schluessels. Aendert sich der Prompt oder das Modell, werden
+# bestehende Cache-Eintraege nicht mehr verwendet
+metadata_prompt_version = hashlib.sha256(f"{llm_model}\n{retrieve_metadata_system}".encode("utf-8")).hexdigest()[:16]
 
-    answer = few_shot_structured_llm.invoke(customer_input)
-    return {"messages": answer}
+# Cache fuer die extrahierten Metadaten (SQLite-Stufe optional ueber METADATA_CACHE_DB)
+metadaten_cache = MetadatenCache(max_entries=int(os.getenv("METADATA_CACHE_SIZE", "1024")),
+                                 ttl=float(os.getenv("METADATA_CACHE_TTL", str(24 * 3600))),
+                                 db_path=os.getenv("METADATA_CACHE_DB"))
 
 
-# Funktion, die das passende Dokument zurückgibt
-def finde_passendes_dokument(nachhaltigkeit_gewünscht: str, dokumente: Document):
-    # Zuerst filtern wir die nachhaltigen Produkte, falls der Kunde das möchte
-    if nachhaltigkeit_gewünscht == "ja":
-        nachhaltige_dokumente = [doc for doc in dokumente if doc.metadata.get("nachhaltigkeit") == "ja"]
+# Few-Shot-Prompt mit Structured LLM: Ausgabe des LLM in Form von vordefinierter TypedDict
+metadata_prompt = ChatPromptTemplate.from_messages([("system", retrieve_metadata_system), ("human", "{input}")])
 
-        # Wenn ein nachhaltiges Dokument vorhanden ist, geben wir es zurück
-        if nachhaltige_dokumente:
-            return nachhaltige_dokumente[0]
 
-    # Wenn kein nachhaltiges Produkt gefunden wurde oder der Kunde keine Präferenz hat,
-    # nehmen wir das erste verfügbare Produkt
-    return dokumente[0]
+@_einmalig
+def get_metadata_chain():
+    return metadata_prompt | get_llm().with_structured_output(InvestmentMetadata)
 
 
-# Definiere Tool um Metadaten aus den Antworten des Anwenders zu extrahieren
-def get_productdata(state: AgentState):
-    """Filtert mithilfe der extrahierten Metadaten die passenden Produktinformationen"""
+def _parse_metadata(customer_input: str):
+    """Ergebnis des Parsers, die unsicheren Felder und die Antwort des LLM aus dem Metadaten-Cache (oder None)"""
+    answer, konfidenz = parse_answers(customer_input)
+    felder_fuer_llm = unsichere_felder(konfidenz)
+    llm_answer = metadaten_cache.get(customer_input, metadata_prompt_version) if felder_fuer_llm else None
+    return answer, felder_fuer_llm, llm_answer
+
+
+def _merge_metadata(customer_input: str, answer: dict, felder_fuer_llm: list, llm_answer, neu: bool) -> dict:
+    """Uebernimmt die unsicheren Felder aus der Antwort des LLM, neue Antworten kommen in den Metadaten-Cache"""
+    if neu:
+        metadaten_cache.set(customer_input, metadata_prompt_version, llm_answer)
+    # Sicher erkannte Felder des Parsers bleiben erhalten, unsichere Felder liefert das LLM
+    answer.update({feld: llm_answer[feld] for feld in felder_fuer_llm})
+    return answer
+
+
+# Ermittlung der Metadaten: zuerst regelbasierter Parser, nur bei unsicheren Feldern Verwendung des Few-Shot-Prompt.
+# Bei einem Cache-Treffer entfaellt der Aufruf des LLM
+def extract_metadata(customer_input: str) -> dict:
+    answer, felder_fuer_llm, llm_answer = _parse_metadata(customer_input)
+    neu = bool(felder_fuer_llm) and llm_answer is None
+    if neu:
+        llm_answer = get_metadata_chain().invoke(customer_input)
+    return _merge_metadata(customer_input, answer, felder_fuer_llm, llm_answer, neu)
+
+
+async def aextract_metadata(customer_input: str) -> dict:
+    answer, felder_fuer_llm, llm_answer = _parse_metadata(customer_input)
+    neu = bool(felder_fuer_llm) and llm_answer is None
+    if neu:
+        llm_answer = await get_metadata_chain().ainvoke(customer_input)
+    return _merge_metadata(customer_input, answer, felder_fuer_llm, llm_answer, neu)
+
+
+def _retrieve_metadata(customer_input: str):
+    """Extrahiert mithilfe GPT-Modell Metadaten aus den Antworten"""
+    return {"messages": extract_metadata(customer_input)}
+
+
+async def _aretrieve_metadata(customer_input: str):
+    """Extrahiert mithilfe GPT-Modell Metadaten aus den Antworten"""
+    return {"messages": await aextract_metadata(customer_input)}
+
+
+# Definiere Tool um Metadaten aus den Antworten des Anwenders zu ermitteln (synchron und asynchron aufrufbar)
+retrieve_metadata = StructuredTool.from_function(func=_retrieve_metadata, coroutine=_aretrieve_metadata,
+                                                 name="retrieve_metadata")
+
+
+def _metadata_from_state(state: AgentState) -> dict:
+    if state.get("metadata"):
+        return state["metadata"]
     context = state["messages"][-1]
     metadata_json = json.loads(context.content)
-    metadata_value = metadata_json["messages"]
-    print(metadata_value)
+    return metadata_json["messages"]
+
+
+def find_product(metadata_value: dict):
+    """Ermittelt das passende Produkt und dessen Produktinformationen. Rueckgabe: (Produkt, Dokumente)"""
     mindestanlagebetrag = metadata_value["mindestanlagebetrag"]
     laufzeit = metadata_value["laufzeit"]
     risiko = metadata_value["risiko"]
     nachhaltigkeit = metadata_value["nachhaltigkeit"]
 
-    vectordb_full_documents = Chroma(persist_directory="./chroma_langchain_db",
-                                     collection_name="pdf_collection_documents",
-                                     embedding_function=embeddings)
+    # Aufloesung des Anlageprofils ueber den In-Memory-Produktkatalog
+    produkt = katalog.resolve(mindestanlagebetrag, laufzeit, risiko, nachhaltigkeit)
+
+    retrieved_documents = []
+    if produkt:
+        # Seiten des gefundenen Produkts direkt aus dem Docstore laden (ohne Embedding-Aufruf)
+        retrieved_documents = vectorstore_registry.get_dokument_store().by_product(produkt["produktnummer"])
+    return produkt, retrieved_documents
+
 
-    # Filterung der Dokumente nach Metadaten
-    retriever = vectordb_full_documents.as_retriever(
-        search_kwargs={"filter": {
-            '$and': [{'mindestanlagebetrag': {'$lte': mindestanlagebetrag}}, {'laufzeit': {'$eq': laufzeit}},
-                     {'risiko': {'$eq': risiko}}]},
-        })
+def _session_id(config: RunnableConfig) -> str:
+    return config["configurable"]["session_id"]
 
-    # Abfrage Daten aus Vektordatenbank
-    retrieved_documents = retriever.invoke("")
 
+def session_config(session_id: str) -> RunnableConfig:
+    """Konfiguration fuer den Graph-Aufruf einer Beratung (inkl. Messung der Dauer je Node)"""
+    return {"configurable": {"session_id": session_id}, "metadata": {"session_id": session_id},
+            "callbacks": [telemetry.callback]}
+
+
+def _store_product(session_id: str, produkt: dict, retrieved_documents: list):
     if retrieved_documents:
-        filtered_document = finde_passendes_dokument(nachhaltigkeit, retrieved_documents)
-        document_metadata = filtered_document.metadata
-        st.session_state.produktnummer = document_metadata.get("produktnummer")
-        st.session_state.document_path = document_metadata.get("source")
-        st.session_state.empty_product = False
-    print(retrieved_documents)
+        session_store.update(session_id,
+                             produktnummer=produkt["produktnummer"],
+                             document_path=retrieved_documents[0].metadata.get("source"),
+                             empty_product=False)
+    telemetry.log_event("produkt", session_id=session_id, produktnummer=produkt["produktnummer"] if produkt else None,
+                        seiten=len(retrieved_documents))
+
+
+# Definiere Tool um Metadaten aus den Antworten des Anwenders zu extrahieren
+def get_productdata(state: AgentState, config: RunnableConfig):
+    """Filtert mithilfe der extrahierten Metadaten die passenden Produktinformationen"""
+    metadata_value = _metadata_from_state(state)
+    telemetry.log_event("metadaten", session_id=_session_id(config), **metadata_value)
+    produkt, retrieved_documents = find_product(metadata_value)
+    _store_product(_session_id(config), produkt, retrieved_documents)
+    return {"documents": retrieved_documents}
+
 
+async def aget_productdata(state: AgentState, config: RunnableConfig):
+    metadata_value = _metadata_from_state(state)
+    telemetry.log_event("metadaten", session_id=_session_id(config), **metadata_value)
+    # Chroma bietet keinen asynchronen Metadaten-Zugriff, daher Ausfuehrung im Thread-Pool
+    produkt, retrieved_documents = await asyncio.to_thread(find_product, metadata_value)
+    _store_product(_session_id(config), produkt, retrieved_documents)
     return {"documents": retrieved_documents}
 
 
 # Liste mit allen Tools die verwendet werden sollen, um passendes Produkt zu finden
 tools = [retrieve_metadata]
 
-tool_llm = llm.bind_tools(tools)
+@_einmalig
+def get_tool_llm():
+    return get_llm().bind_tools(tools)
+
 
 tools_by_name = {tool.name: tool for tool in tools}
 
@@ -171,15 +300,27 @@ def tool_node(state: AgentState):
     return {"messages": outputs}
 
 
+async def atool_node(state: AgentState):
+    tool_calls = state["messages"][-1].tool_calls
+    tool_results = await asyncio.gather(*[tools_by_name[tool_call["name"]].ainvoke(tool_call["args"])
+                                          for tool_call in tool_calls])
+    outputs = [
+        ToolMessage(
+            content=json.dumps(tool_result),
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+        )
+        for tool_call, tool_result in zip(tool_calls, tool_results)
+    ]
+    return {"messages": outputs}
+
+
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
 
-def agent_product_node(
-        state: AgentState
-):
-    # Erstelle Prompt fuer Tool-Calling Agent
-    system_prompt = """Du bist ein digitaler Anlageberater von der Musterbank eG und berätst Kunden zum Thema 
+# Erstelle Prompt fuer Tool-Calling Agent
+product_system_prompt = """Du bist ein digitaler Anlageberater von der Musterbank eG und berätst Kunden zum Thema 
     Vermögensanlage. Der Kunde beantwortet mehrere Fragen, mit dem sich ein Anlageprofil erstellen lässt. Zu den 
     folgenden Fragen erhälst du von dem Kunden Antworten:
 
@@ -195,19 +336,94 @@ def agent_product_node(
     dass ein Produkt von der Bank bewirbt. Stell das gefundene Produkt kurz vor und bewirb es auf Basis der Antworten 
     als passendes Anlageprodukt für den Kunden."""
 
-    print(state["messages"])
 
-    if "documents" in state and st.session_state.empty_product is False:
-        documents = state["documents"]
-        response = tool_llm.invoke([system_prompt] + state["messages"] + [format_docs(documents)])
-        st.session_state.messages.append({"role": "assistant", "content": response.content})
-    elif "documents" in state and st.session_state.empty_product:
+# Vorberechnete Produktvorstellungen (PITCH_MODE=precomputed). Fehlt die Vorstellung eines Produkts oder passt sie
+# nicht zum aktuellen Stand der Produktinformationen, wird die Vorstellung wie bisher aus den Dokumenten erzeugt
+pitch_mode = os.getenv("PITCH_MODE", "full")
+produkt_pitches = ProduktPitches()
+produkt_fingerprints = FingerprintCache(vectorstore_registry.persist_directory)
+
+
+def _pitch_messages(state: AgentState, model):
+    """Nachrichten und Modell fuer die Produktvorstellung. Verwendet werden nur die Antworten des Kunden, nicht der
+    Tool-Call und die Tool-Ergebnisse des Agenten, damit beide Graph-Modi die gleiche Vorstellung erzeugen"""
+    documents = state["documents"]
+    kunde = [message for message in state["messages"] if message.type == "human"]
+    if pitch_mode == "precomputed":
+        produktnummer = documents[0].metadata.get("produktnummer")
+        entry = produkt_pitches.get(produktnummer, produkt_fingerprints.get(produktnummer))
+        if entry:
+            profil = clean_message({"role": "user", "content": kunde[0].content})["content"]
+            return personalize_messages(entry, profil), get_llm()
+    return [product_system_prompt] + kunde + [format_docs(documents)], model
+
+
+def create_pitch(state: AgentState, model, session_id: str):
+    """Stellt das gefundene Produkt auf Basis der Antworten und Produktinformationen vor"""
+    if state["documents"]:
+        messages, model = _pitch_messages(state, model)
+        response = model.invoke(messages)
+        session_store.append_messages(session_id, [{"role": "assistant", "content": response.content}])
+    else:
         response = {"role": "assistant", "content": "Kein passendes Produkt gefunden!"}
+    return {"messages": [response]}
+
+
+async def acreate_pitch(state: AgentState, model, session_id: str):
+    if state["documents"]:
+        messages, model = _pitch_messages(state, model)
+        response = await model.ainvoke(messages)
+        session_store.append_messages(session_id, [{"role": "assistant", "content": response.content}])
     else:
-        response = tool_llm.invoke([system_prompt] + state["messages"])
+        response = {"role": "assistant", "content": "Kein passendes Produkt gefunden!"}
+    return {"messages": [response]}
+
+
+async def apitch(customer_input: str, documents: list) -> str:
+    """Produktvorstellung ohne Session und Graph, z. B. fuer die Batch-Empfehlung (batch_empfehlung.py)"""
+    messages, model = _pitch_messages({"messages": [HumanMessage(content=customer_input)], "documents": documents},
+                                      get_llm())
+    response = await model.ainvoke(messages)
+    return response.content
+
+
+def agent_product_node(
+        state: AgentState, config: RunnableConfig
+):
+    if "documents" in state:
+        # Die Vorstellung erzeugt das Modell ohne Tools, wie im Pipeline-Modus
+        return create_pitch(state, get_llm(), _session_id(config))
+    response = get_tool_llm().invoke([product_system_prompt] + state["messages"])
     return {"messages": [response]}
 
 
+async def aagent_product_node(state: AgentState, config: RunnableConfig):
+    if "documents" in state:
+        return await acreate_pitch(state, get_llm(), _session_id(config))
+    response = await get_tool_llm().ainvoke([product_system_prompt] + state["messages"])
+    return {"messages": [response]}
+
+
+# Nodes fuer den Pipeline-Modus: Extraktion und Produktsuche laufen direkt, ohne dass das LLM zuvor einen Tool-Call
+# erzeugen muss. Pro Empfehlung wird damit nur noch das LLM fuer die Produktvorstellung aufgerufen
+def metadata_node(state: AgentState):
+    """Ermittelt die Metadaten direkt aus den Antworten des Kunden"""
+    customer_input = state["messages"][-1].content
+    return {"metadata": extract_metadata(customer_input)}
+
+
+async def ametadata_node(state: AgentState):
+    return {"metadata": await aextract_metadata(state["messages"][-1].content)}
+
+
+def pitch_node(state: AgentState, config: RunnableConfig):
+    return create_pitch(state, get_llm(), _session_id(config))
+
+
+async def apitch_node(state: AgentState, config: RunnableConfig):
+    return await acreate_pitch(state, get_llm(), _session_id(config))
+
+
 # Definiere Funktion die das naechste vorgehen (ja nach Kondition) dynamisch bestimmt
 def should_continue(state: AgentState):
     messages = state["messages"]
@@ -220,85 +436,341 @@ def should_continue(state: AgentState):
         return "continue"
 
 
-# Definiere einen neuen Graph
-workflow = StateGraph(AgentState)
+def _build_graphs() -> dict:
+    # Definiere einen neuen Graph
+    workflow = StateGraph(AgentState)
 
-# Definiere alle Nodes, zwischen denen kommuniziert wird
-workflow.add_node("agent", agent_product_node)
-workflow.add_node("tools", tool_node)
-workflow.add_node("product", get_productdata)
+    # Definiere alle Nodes, zwischen denen kommuniziert wird
+    # Jede Node ist synchron (invoke/stream) und asynchron (ainvoke/astream) ausfuehrbar
+    workflow.add_node("agent", RunnableLambda(agent_product_node, afunc=aagent_product_node))
+    workflow.add_node("tools", RunnableLambda(tool_node, afunc=atool_node))
+    workflow.add_node("product", RunnableLambda(get_productdata, afunc=aget_productdata))
 
-# Setze Einstieg auf `agent`. Der Graph bzw. Prozess startet dementsprechend beim Agent
-workflow.set_entry_point("agent")
+    # Setze Einstieg auf `agent`. Der Graph bzw. Prozess startet dementsprechend beim Agent
+    workflow.set_entry_point("agent")
 
-# Bestimme dynamische Kante im Graph. Der Graph ruft entweder ein Tool auf oder beendet den Prozess
-workflow.add_conditional_edges(
-    "agent",
-    should_continue,
-    {
-        "continue": "tools",
-        "end": END,
-    },
-)
+    # Bestimme dynamische Kante im Graph. Der Graph ruft entweder ein Tool auf oder beendet den Prozess
+    workflow.add_conditional_edges(
+        "agent",
+        should_continue,
+        {
+            "continue": "tools",
+            "end": END,
+        },
+    )
+
+    # Setzen einer Kante von `tools` zur `product` node, um mithilfe der Metadaten passende Dokumente zu suchen
+    workflow.add_edge("tools", "product")
+
+    # Setzen einer Kante von `product` zur `agent` node, um gefundenes Dokument/Produkt an Agent zu uebergeben
+    workflow.add_edge("product", "agent")
+
+    # Compile Graph
+    agent_graph = workflow.compile()
 
-# Setzen einer Kante von `tools` zur `product` node, um mithilfe der Metadaten passende Dokumente zu suchen
-workflow.add_edge("tools", "product")
+    # Alternativer Graph (Pipeline): metadata -> product -> agent, ohne Tool-Routing ueber das LLM
+    pipeline_workflow = StateGraph(AgentState)
+    pipeline_workflow.add_node("metadata", RunnableLambda(metadata_node, afunc=ametadata_node))
+    pipeline_workflow.add_node("product", RunnableLambda(get_productdata, afunc=aget_productdata))
+    pipeline_workflow.add_node("agent", RunnableLambda(pitch_node, afunc=apitch_node))
+    pipeline_workflow.set_entry_point("metadata")
+    pipeline_workflow.add_edge("metadata", "product")
+    pipeline_workflow.add_edge("product", "agent")
+    pipeline_workflow.add_edge("agent", END)
+    pipeline_graph = pipeline_workflow.compile()
+    return {"agent": agent_graph, "pipeline": pipeline_graph}
 
-# Setzen einer Kante von `product` zur `agent` node, um gefundenes Dokument/Produkt an Agent zu uebergeben
-workflow.add_edge("product", "agent")
 
-# Compile Graph
-graph = workflow.compile()
+# Auswahl des Graphen ueber GRAPH_MODE (agent oder pipeline). Beide Graphen bleiben fuer Vergleiche verfuegbar
+graph_mode = os.getenv("GRAPH_MODE", "agent")
 
 
-# Erstelle Graph
-# testimg = graph.get_graph().draw_mermaid_png()
-# img = Image.open(io.BytesIO(testimg))
-# img.show()
+@_einmalig
+def get_graphs() -> dict:
+    """Kompilierte Graphen, einmal pro Prozess"""
+    return _build_graphs()
+
+
+def get_graph(mode: str = None):
+    return get_graphs()[mode or graph_mode]
+
+
+# Protokolliert die Nachrichten des Graphen (LOG_LEVEL=DEBUG)
+def _log_message(message):
+    if isinstance(message, tuple):
+        telemetry.log_event("nachricht", logging.DEBUG, typ=message[0], zeichen=len(message[1]))
+    else:
+        telemetry.log_event("nachricht", logging.DEBUG, typ=message.type, zeichen=len(str(message.content)),
+                            tool_calls=[call["name"] for call in getattr(message, "tool_calls", [])])
 
-def print_stream(stream):
+
+def log_stream(stream):
     for s in stream:
-        message = s["messages"][-1]
-        if isinstance(message, tuple):
-            print(message)
-        else:
-            message.pretty_print()
+        _log_message(s["messages"][-1])
 
 
-# Methode um Graph aufzurufen
-def call_graph(answers: str):
-    inputs = {"messages": [("user", answers)]}
+async def alog_stream(stream):
+    async for s in stream:
+        _log_message(s["messages"][-1])
 
-    print_stream(graph.stream(inputs, stream_mode="values"))
 
+def _start_recommendation(answers: str, session_id: str):
+    """Setzt das Produkt der Session zurueck und uebernimmt die Antworten in die Chat-Historie"""
+    telemetry.set_session(session_id)
+    session_store.update(session_id, produktnummer=None, document_path="", empty_product=True)
+    session_store.append_messages(session_id, [{"role": "user", "content": answers}])
+    return {"messages": [("user", answers)]}
 
-# RAG-Funktion um fuer Kundenfragen eine Antwort auf Basis der Produktinformationen zu dokumentieren
-def answer_with_rag(user_query: str):
-    vectordb_chunks = Chroma(persist_directory="./chroma_langchain_db",
-                             collection_name="pdf_collection_chunks",
-                             embedding_function=embeddings)
 
-    retriever = vectordb_chunks.as_retriever(
-        search_kwargs={"filter": {"produktnummer": st.session_state.produktnummer}})
+# Methode um Graph asynchron aufzurufen. Mehrere Beratungen koennen so in einem Event-Loop laufen
+async def acall_graph(answers: str, session_id: str, mode: str = None) -> dict:
+    inputs = _start_recommendation(answers, session_id)
+
+    await alog_stream(get_graph(mode).astream(inputs, session_config(session_id), stream_mode="values"))
+    return session_store.get(session_id)
+
+
+# Methode um Graph aufzurufen. Rueckgabe ist der Zustand der Session (Produkt, Chat-Historie). Synchron ueber
+# graph.stream, damit der Aufruf auch aus einem laufenden Event-Loop heraus (z.B. Streamlit, Jupyter) funktioniert
+def call_graph(answers: str, session_id: str, mode: str = None) -> dict:
+    inputs = _start_recommendation(answers, session_id)
+
+    log_stream(get_graph(mode).stream(inputs, session_config(session_id), stream_mode="values"))
+    return session_store.get(session_id)
+
+
+# Fortschrittsmeldungen der Nodes fuer die Oberflaeche
+node_status = {"tools": "Profil erkannt", "metadata": "Profil erkannt"}
+
 
-    system_prompt = """Du bist ein Anlageberater von der Musterbank eG und beantwortest die Fragen von Kunden.
+def _progress(node: str, update: dict):
+    """Fortschrittsmeldung zu einem abgeschlossenen Node oder None"""
+    if node in node_status:
+        return node_status[node]
+    if node == "product":
+        return "Produkt gefunden" if update["documents"] else "Kein passendes Produkt gefunden"
+    return None
+
+
+def _graph_events(stream_mode: str, chunk, zustand: dict):
+    """Uebersetzt ein Ereignis des Graph-Streams in Fortschrittsmeldungen und Tokens der Produktvorstellung"""
+    if stream_mode == "updates":
+        for node, update in chunk.items():
+            zustand["produkt_gefunden"] |= node == "product" and bool(update["documents"])
+            if status := _progress(node, update):
+                yield "status", status
+    else:
+        message, metadata = chunk
+        # Nur die Produktvorstellung wird gestreamt, nicht der Tool-Call bzw. die Metadaten-Extraktion
+        if (zustand["produkt_gefunden"] and metadata.get("langgraph_node") == "agent"
+                and isinstance(message, AIMessageChunk) and message.content):
+            yield "token", message.content
+
+
+def stream_graph(answers: str, session_id: str, mode: str = None):
+    """Ruft den Graph auf und liefert Fortschrittsmeldungen ("status", Text) sowie die Tokens der Produktvorstellung
+    ("token", Text), sobald sie erzeugt werden"""
+    inputs = _start_recommendation(answers, session_id)
+    zustand = {"produkt_gefunden": False}
+
+    for stream_mode, chunk in get_graph(mode).stream(inputs, session_config(session_id),
+                                                     stream_mode=["updates", "messages"]):
+        yield from _graph_events(stream_mode, chunk, zustand)
+
+
+async def astream_graph(answers: str, session_id: str, mode: str = None):
+    inputs = _start_recommendation(answers, session_id)
+    zustand = {"produkt_gefunden": False}
+
+    async for stream_mode, chunk in get_graph(mode).astream(inputs, session_config(session_id),
+                                                            stream_mode=["updates", "messages"]):
+        for event in _graph_events(stream_mode, chunk, zustand):
+            yield event
+
+
+# Prompt fuer die Beantwortung der Kundenfragen auf Basis der Produktinformationen
+rag_system_prompt = """Du bist ein Anlageberater von der Musterbank eG und beantwortest die Fragen von Kunden.
     Verwende die Chat Historie als auch den retrieved context um die Fragen des Bankkunden zu beantworten. Wenn du
     die Antwort nicht weißt, sag dem Kunden, dass du die Informationen nachlieferst. Halte die Antwort so knapp wie
     möglich.
     Context: {context}"""
 
-    qa_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", system_prompt),
-            MessagesPlaceholder("chat_history"),
-            ("human", "{input}"),
-        ]
-    )
+qa_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", rag_system_prompt),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}"),
+    ]
+)
+
+
+# Chat-Historie der RAG-Chain mit Token-Budget und fortlaufender Zusammenfassung aelterer Runden
+@_einmalig
+def get_chat_historie() -> ChatHistorie:
+    return ChatHistorie(get_llm(), llm_model,
+                        max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "1500")),
+                        keep_turns=int(os.getenv("HISTORY_KEEP_TURNS", "3")))
+
+
+# Semantischer Cache fuer Antworten auf Kundenfragen je Produkt (Schwelle ueber ANSWER_CACHE_THRESHOLD)
+antwort_cache = AntwortCache(vectorstore_registry.persist_directory,
+                             threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+                             max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "256")))
+
+
+# Hybride Chunk-Suche (BM25 und Vektorsuche) mit Erweiterung auf die Seiten der Produktinformationsblaetter
+# (Token-Budget ueber RAG_CONTEXT_TOKENS, Latenzbudget der Suche ueber RAG_LATENCY_BUDGET, Re-Ranking ueber RAG_RERANK,
+# Schwelle fuer Fachbegriffe ueber RAG_EXACT_MAX_DF)
+@_einmalig
+def get_kontext_retriever() -> KontextRetriever:
+    return KontextRetriever(get_embeddings(), llm_model,
+                            k=int(os.getenv("RAG_K", "6")),
+                            max_tokens=int(os.getenv("RAG_CONTEXT_TOKENS", "2000")),
+                            bm25=BM25Index(vectorstore_registry.persist_directory),
+                            rerank=os.getenv("RAG_RERANK", "false").lower() in ("1", "true", "ja"),
+                            latency_budget=float(os.getenv("RAG_LATENCY_BUDGET", "0.5")),
+                            exact_max_df=float(os.getenv("RAG_EXACT_MAX_DF", "0.1")))
+
+
+# Trefferquoten der Caches fuer die Kennzahlen (telemetry.py)
+telemetry.register_cache("metadaten", metadaten_cache.stats)
+telemetry.register_cache("antwort", antwort_cache.stats)
+telemetry.register_cache("produktblatt", produktblaetter.stats)
+
+
+def create_rag_chain(produktnummer: int, question_vector=None, lexical_result=None):
+    """Erstellt die RAG-Chain fuer die Produktinformationen des empfohlenen Produkts"""
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain.chains.retrieval import create_retrieval_chain
+
+    retriever = get_kontext_retriever().as_runnable(produktnummer, question_vector, lexical_result)
+
+    question_answer_chain = create_stuff_documents_chain(get_llm(), qa_prompt)
+
+    return create_retrieval_chain(retriever, question_answer_chain)
+
+
+def _append_answer(session_id: str, user_query: str, answer: str) -> dict:
+    session_store.append_messages(session_id, [{"role": "user", "content": user_query},
+                                               {"role": "assistant", "content": answer}])
+    return session_store.get(session_id)
+
+
+# Nach der Antwort wird die Zusammenfassung der Chat-Historie um herausgefallene Runden ergaenzt
+def _finish_answer(session_id: str, user_query: str, answer: str):
+    summary = get_chat_historie().refresh(_append_answer(session_id, user_query, answer))
+    if summary:
+        session_store.update(session_id, **summary)
+
+
+async def _afinish_answer(session_id: str, user_query: str, answer: str):
+    summary = await get_chat_historie().arefresh(_append_answer(session_id, user_query, answer))
+    if summary:
+        session_store.update(session_id, **summary)
+
+
+def _store_answer(produktnummer: int, user_query: str, question_vector, answer: str, seconds: float):
+    """Speichert die Antwort im Antwort-Cache, ueber das Embedding oder bei exakten Fragen ueber den Text"""
+    if question_vector is None:
+        antwort_cache.store_text(produktnummer, user_query, answer, seconds)
+    else:
+        antwort_cache.store(produktnummer, user_query, question_vector, answer, seconds)
+
+
+def _start_question(user_query: str, session_id: str):
+    """Session, Produktnummer und Ergebnis der BM25-Suche zu einer Kundenfrage"""
+    telemetry.set_session(session_id)
+    session = session_store.get(session_id)
+    produktnummer = session["produktnummer"]
+    return session, produktnummer, get_kontext_retriever().lexical(user_query, produktnummer)
+
+
+def _cached_answer(produktnummer: int, user_query: str, question_vector):
+    """Antwort aus dem Antwort-Cache, ueber das Embedding oder bei exakten Fragen ueber den Text"""
+    if question_vector is None:
+        return antwort_cache.lookup_text(produktnummer, user_query)
+    return antwort_cache.lookup(produktnummer, question_vector)
+
+
+def _rag_input(session: dict, user_query: str) -> dict:
+    return {"input": user_query, "chat_history": get_chat_historie().build(session, user_query)}
+
+
+# RAG-Funktion, die die Antwort auf eine Kundenfrage Token fuer Token liefert.
+# Bei einer aehnlichen, bereits beantworteten Frage zum selben Produkt entfallen Retrieval und LLM-Aufruf. Fragen nach
+# Fachbegriffen beantwortet die BM25-Suche ohne Embedding-Aufruf, im Cache wird dann der Text nachgeschlagen. Das
+# Ergebnis der BM25-Suche verwendet der Retriever weiter
+def stream_with_rag(user_query: str, session_id: str):
+    start = time.perf_counter()
+    session, produktnummer, lexical_result = _start_question(user_query, session_id)
+    question_vector = None if lexical_result[1] else get_embeddings().embed_query(user_query)
+    answer = _cached_answer(produktnummer, user_query, question_vector)
+    if answer is not None:
+        yield answer
+        _finish_answer(session_id, user_query, answer)
+        return
+
+    rag_chain = create_rag_chain(produktnummer, question_vector, lexical_result)
+
+    answer = ""
+    for chunk in rag_chain.stream(_rag_input(session, user_query)):
+        if "answer" in chunk:
+            answer += chunk["answer"]
+            yield chunk["answer"]
+    _store_answer(produktnummer, user_query, question_vector, answer, time.perf_counter() - start)
+    _finish_answer(session_id, user_query, answer)
+
+
+async def astream_with_rag(user_query: str, session_id: str):
+    start = time.perf_counter()
+    session, produktnummer, lexical_result = _start_question(user_query, session_id)
+    question_vector = None if lexical_result[1] else await get_embeddings().aembed_query(user_query)
+    answer = _cached_answer(produktnummer, user_query, question_vector)
+    if answer is not None:
+        yield answer
+        await _afinish_answer(session_id, user_query, answer)
+        return
+
+    rag_chain = create_rag_chain(produktnummer, question_vector, lexical_result)
+
+    answer = ""
+    async for chunk in rag_chain.astream(_rag_input(session, user_query)):
+        if "answer" in chunk:
+            answer += chunk["answer"]
+            yield chunk["answer"]
+    _store_answer(produktnummer, user_query, question_vector, answer, time.perf_counter() - start)
+    await _afinish_answer(session_id, user_query, answer)
+
+
+async def aanswer_with_rag(user_query: str, session_id: str):
+    return "".join([token async for token in astream_with_rag(user_query, session_id)])
+
+
+# RAG-Funktion um fuer Kundenfragen eine Antwort auf Basis der Produktinformationen zu dokumentieren
+def answer_with_rag(user_query: str, session_id: str):
+    return "".join(stream_with_rag(user_query, session_id))
+
+
+def warmup():
+    """Erzeugt Modelle, Graphen, Retriever und die Verbindung zur Vektordatenbank vorab, damit die erste Beratung nicht
+    auf die Initialisierung wartet"""
+    start = time.perf_counter()
+    get_graphs()
+    get_chat_historie()
+    get_kontext_retriever()
+    vectorstore_registry.get_collection(vectorstore_registry.chunks_collection, get_embeddings())
+    telemetry.log_event("warmup", dauer_ms=round((time.perf_counter() - start) * 1000))
+
 
-    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+# Kompatibilitaet: die bisherigen Modulattribute (z.B. backend.llm, from investmentadvisor_be import chat_historie)
+# werden beim ersten Zugriff ueber die Factories erzeugt
+_lazy_attributes = {"llm": get_llm, "embeddings": get_embeddings, "tool_llm": get_tool_llm,
+                    "few_shot_structured_llm": get_metadata_chain, "chat_historie": get_chat_historie,
+                    "kontext_retriever": get_kontext_retriever, "graphs": get_graphs, "graph": get_graph,
+                    "agent_graph": lambda: get_graph("agent"), "pipeline_graph": lambda: get_graph("pipeline")}
 
-    rag_chain = create_retrieval_chain(retriever, question_answer_chain)
-    response_qa = rag_chain.invoke({"input": user_query, "chat_history": st.session_state.messages})
-    st.session_state.messages.append({"role": "assistant", "content": response_qa["answer"]})
 
-    return response_qa["answer"]
+def __getattr__(name: str):
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
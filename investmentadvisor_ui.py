@@ -1,4 +1,29 @@
-from investmentadvisor_be import *
+import os
+import threading
+
+import streamlit as st
+
+from investmentadvisor_be import session_store, stream_graph, stream_with_rag, warmup
+from fragebogen import questions
+from produktblaetter import produktblaetter
+from session_store import new_session_id
+import telemetry
+
+# Kennzahlen der Oberflaeche auf einem eigenen Port (z. B. METRICS_PORT=9100, Abruf ueber /metrics)
+if os.getenv("METRICS_PORT"):
+    telemetry.start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+
+# Modelle, Graph und Vektordatenbank werden einmal pro Prozess im Hintergrund initialisiert, waehrend der Kunde die
+# ersten Fragen beantwortet. Die erste Seite wird ohne Warten auf die Initialisierung ausgeliefert
+@st.cache_resource
+def start_warmup():
+    thread = threading.Thread(target=warmup, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+start_warmup()
 
 st.title("Investi AI - Digitale Anlageberatung")
 
@@ -16,7 +41,10 @@ if "messages" not in st.session_state:
         nach Produkt können anschließend Gebühren anfallen, die in der Produktvorstellung und im 
         Produktinformationsblatt aufzufinden sind. Fangen wir nun mit den Fragen an... 🙂"""}]
 
-# Initialisiere Session-State
+# Initialisiere Session-State. Das Backend verwaltet den Zustand der Beratung ueber die Session-ID
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = new_session_id()
+
 if 'questionCounter' not in st.session_state:
     st.session_state.questionCounter = 0
 
@@ -36,16 +64,6 @@ for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.write(message["content"])
 
-# Liste der Fragen
-questions = [
-    "Wie viel möchten Sie anlegen?",
-    "Für wie lange möchten Sie das Geld anlegen (kurzfristig, mittelfristig, langfristig)?",
-    "Wie würden Sie Ihre Risikobereitschaft einschätzen (z. B. kein Risiko, mittleres Risiko, hohes Risiko)?",
-    "Haben Sie in der Vergangenheit bereits riskante Investments getätigt (z. B. Aktien, Derivate) und wie haben Sie "
-    "sich dabei gefühlt?",
-    "Interessieren Sie sich für nachhaltige Anlageprodukte?"
-]
-
 
 def increment(key):
     st.session_state.questionCounter += 1
@@ -54,17 +72,17 @@ def increment(key):
         st.session_state.answers += questions[st.session_state.questionCounter - 1] + " " + st.session_state[key] + ", "
 
 
+# Das PDF kommt aus dem gemeinsamen Cache der Produktinformationsblaetter, nicht bei jedem Rerun von der Festplatte
 @st.fragment
 def provide_productinformation_sheet():
-    path = st.session_state.document_path
-    new_path = path.replace('\\', '/')
-    with open(new_path, "rb") as pdf_file:
-        pdfbyte = pdf_file.read()
-        st.download_button(label="Download Produktinformationsblatt",
-                           icon=":material/download:",
-                           data=pdfbyte,
-                           file_name="produktinformationsblatt.pdf",
-                           mime='application/octet-stream')
+    produktblatt = produktblaetter.get(st.session_state.produktnummer)
+    if produktblatt is None:
+        return
+    st.download_button(label="Download Produktinformationsblatt",
+                       icon=":material/download:",
+                       data=produktblatt.data,
+                       file_name="produktinformationsblatt.pdf",
+                       mime='application/octet-stream')
 
 
 # Stelle dem Kunden nacheinander Fragen. Inkrementiere den Counter nach jeder Kundenantwort
@@ -80,22 +98,39 @@ if st.session_state.questionCounter < len(questions):
 # Nachdem alle Fragen vom Kunden beantwortet wurden, soll ein passendes Produkt auf Basis der Antworten gefunden werden
 # Ruft die entsprechend Backend-Funktion auf und bietet Produktinformationsblatt zum Download bereit
 elif st.session_state.questionCounter == len(questions):
-    with st.spinner("Bitte warten... Ich suche Ihr passendes Anlageprodukt"):
-        call_graph(st.session_state.answers)
-        produktempfehlung = st.session_state.messages[-1]
+    with st.chat_message("assistant"):
+        status = st.status("Bitte warten... Ich suche Ihr passendes Anlageprodukt")
+
+        # Fortschrittsmeldungen im Status anzeigen, Tokens der Produktvorstellung direkt ausgeben
+        def produktempfehlung():
+            for art, text in stream_graph(st.session_state.answers, st.session_state.session_id):
+                if art == "status":
+                    status.update(label=text)
+                    status.write(text)
+                else:
+                    yield text
+
+        pitch = st.write_stream(produktempfehlung())
+        status.update(state="complete")
+
+        # Ergebnis der Beratung aus dem Session-Store uebernehmen
+        session = session_store.get(st.session_state.session_id)
+        st.session_state.produktnummer = session["produktnummer"]
+        st.session_state.document_path = session["document_path"]
+        st.session_state.empty_product = session["empty_product"]
         if st.session_state.empty_product is False:
-            with st.chat_message(produktempfehlung["role"]):
-                st.write(produktempfehlung["content"])
-                # Stelle Produktinformationsblatt bereit
-                provide_productinformation_sheet()
-            with st.chat_message("assistant"):
-                intro_rag_questions = """Wir hoffen, dass wir Ihr Interesse geweckt haben. Sehr gerne 
-                möchte ich nun Ihre offenen Fragen zum Produkt beantworten. Wenn Sie fertig sind, können Sie die 
-                Seite einfach verlassen. Das empfohlene Produkt habe ich Ihnen in der Übersicht im Online-Banking 
-                hinterlegt."""
-                st.write(intro_rag_questions)
-                st.session_state.messages.append({"role": "assistant", "content": intro_rag_questions})
-        increment("chat_key")
+            st.session_state.messages.append({"role": "assistant", "content": pitch})
+            # Stelle Produktinformationsblatt bereit
+            provide_productinformation_sheet()
+    if st.session_state.empty_product is False:
+        with st.chat_message("assistant"):
+            intro_rag_questions = """Wir hoffen, dass wir Ihr Interesse geweckt haben. Sehr gerne 
+            möchte ich nun Ihre offenen Fragen zum Produkt beantworten. Wenn Sie fertig sind, können Sie die 
+            Seite einfach verlassen. Das empfohlene Produkt habe ich Ihnen in der Übersicht im Online-Banking 
+            hinterlegt."""
+            st.write(intro_rag_questions)
+            st.session_state.messages.append({"role": "assistant", "content": intro_rag_questions})
+    increment("chat_key")
 
 # Nachdem Produktempfehlung ausgegeben wurde, kann der Kunde ueber Oberflaeche Fragen stellen
 if st.session_state.questionCounter > len(questions) and st.session_state.empty_product is False:
@@ -104,7 +139,8 @@ if st.session_state.questionCounter > len(questions) and st.session_state.empty_
             response = st.write(prompt)
             st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("assistant"):
-            st.write(answer_with_rag(prompt))
+            antwort = st.write_stream(stream_with_rag(prompt, st.session_state.session_id))
+            st.session_state.messages.append({"role": "assistant", "content": antwort})
 
 if st.session_state.questionCounter > len(questions) and st.session_state.empty_product is True:
     no_product_message = """Leider konnten wir zu Ihren Angaben kein passendes Produkt finden. Besuchen Sie uns zu einem 
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+import telemetry
+import vectorstore_registry
+from bm25_index import tokenize
+from chat_historie import token_encoding
+
+# Retrieval fuer die Fragen zum empfohlenen Produkt: Gesucht wird ueber die Chunks, lexikalisch (BM25) und ueber die
+# Embeddings. Fragen mit Fachbegriffen bzw. ISIN/WKN, die der BM25-Index eindeutig findet, kommen ohne Vektorsuche und
+# ohne Embedding-Aufruf aus. Der Kontext fuer das LLM besteht aus den zugehoerigen Seiten (Parent-Dokumente), solange
+# sie in das Token-Budget passen. Passt eine Seite nicht mehr hinein, wird nur der gefundene Chunk uebernommen.
+
+# Threads fuer die Vektorsuche, damit die synchrone Suche das Latenzbudget einhalten kann
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vektorsuche")
+
+
+class KontextRetriever:
+    """Hybride Chunk-Suche (BM25 und Vektorsuche, Reciprocal Rank Fusion) mit Erweiterung auf die Parent-Seiten
+    innerhalb eines Token-Budgets"""
+
+    def __init__(self, embeddings, model: str, k: int = 6, max_tokens: int = 2000, vectordb=None, bm25=None,
+                 rrf_k: int = 60, rerank: bool = False, latency_budget: float = 0.5, exact_max_df: float = 0.1):
+        self.embeddings = embeddings
+        self.k = k
+        self.max_tokens = max_tokens
+        self.bm25 = bm25
+        self.rrf_k = rrf_k
+        self.use_rerank = rerank
+        # Maximale Dauer der Suche in Sekunden. Die Vektorsuche wird danach nicht mehr abgewartet, sofern es
+        # BM25-Treffer gibt
+        self.latency_budget = latency_budget
+        # Anteil der Chunks, in denen ein Begriff hoechstens vorkommt, um als Fachbegriff zu gelten (abgestimmt mit
+        # test_functions/exakt_tuning.py). Begriffe wie ISIN oder Ausgabeaufschlag stehen in den Stammdaten jedes Fonds
+        self.exact_max_df = exact_max_df
+        # Feste Collection (z. B. fuer das Tuning der Chunk-Groesse), sonst die Collection aus der Registry
+        self.vectordb = vectordb
+        self._encoding = token_encoding(model)
+
+    def _vectordb(self):
+        if self.vectordb is not None:
+            return self.vectordb
+        return vectorstore_registry.get_collection(vectorstore_registry.chunks_collection, self.embeddings)
+
+    def _tokens(self, document: Document) -> int:
+        return len(self._encoding.encode(document.page_content))
+
+    def expand(self, chunks: list[Document]) -> list[Document]:
+        """Ersetzt die Chunks (in Reihenfolge der Relevanz) durch ihre Seiten, solange das Budget reicht"""
+        with telemetry.timed(telemetry.retrieval_seconds, stage="expand"):
+            return self._expand(chunks)
+
+    def _expand(self, chunks: list[Document]) -> list[Document]:
+        parent_ids = list(dict.fromkeys(chunk.metadata.get("parent_id") for chunk in chunks
+                                        if chunk.metadata.get("parent_id")))
+        parents = vectorstore_registry.get_dokument_store().get(parent_ids)
+
+        context, seen, used = [], set(), 0
+        for chunk in chunks:
+            parent_id = chunk.metadata.get("parent_id")
+            if parent_id in seen:
+                continue
+            parent = parents.get(parent_id)
+            if parent is not None and used + self._tokens(parent) <= self.max_tokens:
+                context.append(parent)
+                seen.add(parent_id)
+                used += self._tokens(parent)
+            elif used + self._tokens(chunk) <= self.max_tokens:
+                context.append(chunk)
+                used += self._tokens(chunk)
+        return context
+
+    def lexical(self, query: str, produktnummer: int) -> tuple[list[Document], bool]:
+        """BM25-Suche. Rueckgabe: (Chunks, exakt), exakt ist eine Frage mit Fachbegriffen bzw. ISIN/WKN, die im
+        besten Treffer vorkommen. Dann entfaellt die Vektorsuche. Begriffe, die der Index nicht kennt (z. B.
+        Umschreibungen), kann die BM25-Suche nicht abdecken, solche Fragen sind nicht exakt."""
+        if self.bm25 is None:
+            return [], False
+        with telemetry.timed(telemetry.retrieval_seconds, stage="bm25"):
+            chunks = [doc for doc, _ in self.bm25.search(query, produktnummer, self.k)]
+        rare = set(self.bm25.rare_terms(query, self.exact_max_df))
+        exact = bool(chunks and rare and rare <= set(tokenize(chunks[0].page_content))
+                     and not self.bm25.unknown_terms(query))
+        return chunks, exact
+
+    @staticmethod
+    def _key(document: Document) -> str:
+        return document.id or document.page_content
+
+    def fuse(self, *rankings: list[Document]) -> list[Document]:
+        """Reciprocal Rank Fusion der Rankings"""
+        scores, documents = {}, {}
+        for ranking in rankings:
+            for rank, document in enumerate(ranking):
+                key = self._key(document)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                documents.setdefault(key, document)
+        return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+    def rerank(self, query: str, chunks: list[Document]) -> list[Document]:
+        """Lokales Re-Ranking: Anteil der (nach IDF gewichteten) Begriffe der Frage im Chunk, Bonus fuer direkt
+        aufeinanderfolgende Begriffe. Bei Gleichstand bleibt die Reihenfolge der Fusion erhalten."""
+        terms = tokenize(query)
+        if not terms or self.bm25 is None:
+            return chunks
+        weights = {term: self.bm25.idf(term) for term in terms}
+        total = sum(weights.values()) or 1.0
+        bigrams = set(zip(terms, terms[1:]))
+
+        def score(chunk: Document) -> float:
+            tokens = tokenize(chunk.page_content)
+            coverage = sum(weight for term, weight in weights.items() if term in tokens) / total
+            proximity = len(bigrams & set(zip(tokens, tokens[1:]))) / len(bigrams) if bigrams else 0.0
+            return coverage + 0.5 * proximity
+
+        return sorted(chunks, key=score, reverse=True)
+
+    def _combine(self, query: str, lexical: list[Document], semantic: list[Document], start: float):
+        ranked = self.fuse(lexical, semantic) if semantic else lexical
+        if self.use_rerank and time.perf_counter() - start < self.latency_budget:
+            ranked = self.rerank(query, ranked)
+        return ranked[:self.k]
+
+    def _semantic_search(self, query: str, produktnummer: int, question_vector=None) -> list[Document]:
+        search_filter = {"produktnummer": produktnummer}
+        with telemetry.timed(telemetry.retrieval_seconds, stage="vector"):
+            if question_vector is not None:
+                return self._vectordb().similarity_search_by_vector(question_vector, k=self.k, filter=search_filter)
+            return self._vectordb().similarity_search(query, k=self.k, filter=search_filter)
+
+    async def _asemantic_search(self, query: str, produktnummer: int, question_vector=None) -> list[Document]:
+        search_filter = {"produktnummer": produktnummer}
+        with telemetry.timed(telemetry.retrieval_seconds, stage="vector"):
+            if question_vector is not None:
+                return await self._vectordb().asimilarity_search_by_vector(question_vector, k=self.k,
+                                                                           filter=search_filter)
+            return await self._vectordb().asimilarity_search(query, k=self.k, filter=search_filter)
+
+    def retrieve_chunks(self, query: str, produktnummer: int, question_vector=None,
+                        lexical_result=None) -> list[Document]:
+        """Hybride Suche (BM25 und Vektorsuche), Rueckgabe sind die k besten Chunks ohne Erweiterung. Liefert die
+        Vektorsuche nicht innerhalb des Latenzbudgets, werden nur die Treffer der BM25-Suche verwendet. Ein bereits
+        berechnetes Ergebnis von lexical() wird nicht erneut gesucht."""
+        start = time.perf_counter()
+        lexical, exact = lexical_result or self.lexical(query, produktnummer)
+        if exact:
+            return self._combine(query, lexical, [], start)
+
+        future = _executor.submit(self._semantic_search, query, produktnummer, question_vector)
+        try:
+            semantic = future.result(timeout=self._remaining(start) if lexical else None)
+        except TimeoutError:
+            telemetry.log_event("latenzbudget_ueberschritten", logging.WARNING, latency_budget=self.latency_budget)
+            semantic = []
+        return self._combine(query, lexical, semantic, start)
+
+    async def aretrieve_chunks(self, query: str, produktnummer: int, question_vector=None,
+                               lexical_result=None) -> list[Document]:
+        start = time.perf_counter()
+        lexical, exact = lexical_result or self.lexical(query, produktnummer)
+        if exact:
+            return self._combine(query, lexical, [], start)
+
+        try:
+            semantic = await asyncio.wait_for(self._asemantic_search(query, produktnummer, question_vector),
+                                              timeout=self._remaining(start) if lexical else None)
+        except asyncio.TimeoutError:
+            telemetry.log_event("latenzbudget_ueberschritten", logging.WARNING, latency_budget=self.latency_budget)
+            semantic = []
+        return self._combine(query, lexical, semantic, start)
+
+    def search(self, query: str, produktnummer: int, question_vector=None, lexical_result=None) -> list[Document]:
+        """Kontext fuer das LLM: gefundene Chunks, erweitert auf ihre Seiten"""
+        return self.expand(self.retrieve_chunks(query, produktnummer, question_vector, lexical_result))
+
+    async def asearch(self, query: str, produktnummer: int, question_vector=None,
+                      lexical_result=None) -> list[Document]:
+        return self.expand(await self.aretrieve_chunks(query, produktnummer, question_vector, lexical_result))
+
+    def _remaining(self, start: float) -> float:
+        return max(self.latency_budget - (time.perf_counter() - start), 0.0)
+
+    def as_runnable(self, produktnummer: int, question_vector=None, lexical_result=None) -> RunnableLambda:
+        """Retriever fuer create_retrieval_chain (Eingabe ist das Dict mit der Frage unter "input"). Ein bereits
+        berechnetes Embedding der Frage bzw. Ergebnis der BM25-Suche wird wiederverwendet."""
+        async def asearch(inputs: dict):
+            return await self.asearch(inputs["input"], produktnummer, question_vector, lexical_result)
+
+        return RunnableLambda(lambda inputs: self.search(inputs["input"], produktnummer, question_vector,
+                                                         lexical_result),
+                              afunc=asearch)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Cache fuer die strukturierte Metadaten-Extraktion. Die Antworten des Kunden werden normalisiert, sodass nahezu
+# identische Eingaben (Gross-/Kleinschreibung, Leerzeichen, Tausendertrennzeichen, Euro-Schreibweise) denselben
+# Eintrag treffen. Stufe 1 ist ein LRU-Cache mit TTL im Speicher, Stufe 2 optional eine SQLite-Datei auf der Festplatte.
+
+
+def normalize_answers(text: str) -> str:
+    """Normalisiert die Antworten des Kunden fuer den Cache-Schluessel"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    # Tausendertrennzeichen entfernen (5.000 -> 5000, 5 000 -> 5000)
+    text = re.sub(r"(?<=\d)[.\s'](?=\d{3}(?!\d))", "", text)
+    # Einheitliche Schreibweise fuer Euro
+    text = re.sub(r"\s*(€|eur\b|euro\b)", " euro", text)
+    # Satzzeichen ohne Bedeutung fuer die Extraktion entfernen
+    text = re.sub(r"[!?;:\"“”„'()]", " ", text)
+    text = re.sub(r"\.(?!\d)", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class MetadatenCache:
+    """LRU-Cache mit TTL im Speicher und optionaler SQLite-Stufe auf der Festplatte"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 24 * 3600, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counter = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS metadata_cache "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(customer_input: str, version: str) -> str:
+        return hashlib.sha256(f"{version}\n{normalize_answers(customer_input)}".encode("utf-8")).hexdigest()
+
+    def get(self, customer_input: str, version: str):
+        """Liefert die zwischengespeicherten Metadaten oder None"""
+        key = self.key(customer_input, version)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counter["hits"] += 1
+                    self._counter["memory_hits"] += 1
+                    return value
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM metadata_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] < self.ttl:
+                    value = json.loads(row[0])
+                    self._store(key, value, row[1])
+                    self._counter["hits"] += 1
+                    self._counter["disk_hits"] += 1
+                    return value
+
+            self._counter["misses"] += 1
+            return None
+
+    def set(self, customer_input: str, version: str, value: dict):
+        key = self.key(customer_input, version)
+        created = time.time()
+        with self._lock:
+            self._store(key, value, created)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO metadata_cache (key, value, created) VALUES (?, ?, ?)",
+                                 (key, json.dumps(value), created))
+                self._db.execute("DELETE FROM metadata_cache WHERE created < ?", (created - self.ttl,))
+                self._db.commit()
+
+    def _store(self, key: str, value: dict, created: float):
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Trefferzaehler des Caches"""
+        with self._lock:
+            stats = dict(self._counter)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM metadata_cache")
+                self._db.commit()
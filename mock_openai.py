@@ -0,0 +1,282 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from antwort_parser import parse_answers
+
+# Lokaler, OpenAI-kompatibler Stand-in-Server fuer den Betrieb und Lasttests ohne Netzwerk und ohne Kosten:
+# - POST /v1/chat/completions: Antworten mit dem Anfang der letzten Nachricht, Tool-Calls (solange noch kein
+#   Tool-Ergebnis vorliegt), Structured Output (response_format json_schema bzw. erzwungener Tool-Call), Streaming per
+#   Server-Sent Events inkl. Token-Nutzung
+# - POST /v1/embeddings: deterministische Vektoren aus dem Hash des Textes (float oder base64)
+# Latenz pro Aufruf und pro Token, Ausreisser, Fehlerquote und maximale Anzahl gleichzeitiger Anfragen sind
+# konfigurierbar.
+# Mit MODEL_BACKEND=local startet model_provider.py den Server im eigenen Prozess. Als eigener Prozess (z. B. fuer
+# Lasttests) nutzt das Backend ihn ueber MODEL_BASE_URL=http://127.0.0.1:8765/v1 (OPENAI_API_KEY beliebig).
+# Ausfuehrung aus dem Projektverzeichnis: python -m mock_openai --port 8765 --latency 0.5
+
+
+def count_tokens(text: str) -> int:
+    return max(len(text) // 4, 1) if text else 0
+
+
+def _text(content) -> str:
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def structured_response(schema: dict, text: str) -> dict:
+    """Antwort passend zum JSON-Schema: Felder der Metadaten-Extraktion ueber den regelbasierten Parser, Texte mit dem
+    Text der letzten Nachricht, alle anderen Felder mit leeren Werten"""
+    properties = schema.get("properties", {})
+    metadata, _ = parse_answers(text)
+    if properties and set(properties) <= set(metadata):
+        return {field: metadata[field] for field in properties}
+    leer = {"integer": 0, "number": 0, "boolean": False, "array": [], "object": {}}
+    return {field: text if spec.get("type", "string") == "string" else leer.get(spec.get("type"))
+            for field, spec in properties.items()}
+
+
+def embedding(text, dimensions: int) -> list[float]:
+    """Deterministischer, normierter Vektor (Text oder Token-IDs)"""
+    seed = hashlib.sha256(json.dumps(text).encode("utf-8")).digest()
+    generator = random.Random(seed)
+    vector = [generator.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
+
+
+class MockOpenAI:
+    """Konfiguration und Zaehler des Mock-Servers"""
+
+    def __init__(self, latency: float = 0.0, token_latency: float = 0.0, embedding_latency: float = 0.0,
+                 error_rate: float = 0.0, max_concurrency: int = 0, answer_words: int = 60, dimensions: int = 3072,
+                 tail_rate: float = 0.0, tail_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.embedding_latency = embedding_latency
+        self.error_rate = error_rate
+        # Ausreisser: Anteil der Anfragen mit zusaetzlicher Latenz (z. B. fuer Messungen mit Hedging)
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.max_concurrency = max_concurrency
+        self.answer_words = answer_words
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.counter = {"chat": 0, "embeddings": 0, "rejected": 0, "errors": 0}
+
+    def admit(self) -> bool:
+        with self._lock:
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                self.counter["rejected"] += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def delay(self, seconds: float) -> float:
+        return seconds + (self.tail_latency if random.random() < self.tail_rate else 0.0)
+
+    def count(self, name: str):
+        with self._lock:
+            self.counter[name] += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def completion(self, request: dict) -> dict:
+        """Ergebnis eines Chat-Aufrufs: Nachricht (content bzw. tool_calls) und Token-Nutzung"""
+        messages = request.get("messages", [])
+        text = _text(messages[-1].get("content")) if messages else ""
+        prompt_tokens = sum(count_tokens(_text(message.get("content"))) for message in messages)
+        tools = request.get("tools") or []
+        tool_choice = request.get("tool_choice")
+        response_format = request.get("response_format") or {}
+
+        message = {"role": "assistant", "content": None}
+        if response_format.get("type") == "json_schema":
+            message["content"] = json.dumps(structured_response(response_format["json_schema"].get("schema", {}),
+                                                                text), ensure_ascii=False)
+        elif tools and (isinstance(tool_choice, dict) or not any(m.get("role") == "tool" for m in messages)):
+            # Erzwungener Tool-Call (Structured Output ueber function_calling) oder Aufruf des ersten Tools
+            name = tool_choice["function"]["name"] if isinstance(tool_choice, dict) else tools[0]["function"]["name"]
+            tool = next(tool for tool in tools if tool["function"]["name"] == name)
+            arguments = structured_response(tool["function"].get("parameters", {}), text)
+            message["tool_calls"] = [{"id": "call_" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+                                      "type": "function",
+                                      "function": {"name": name, "arguments": json.dumps(arguments,
+                                                                                          ensure_ascii=False)}}]
+        else:
+            message["content"] = " ".join(text.split()[:self.answer_words])
+
+        completion_tokens = count_tokens(message["content"] or json.dumps(message.get("tool_calls", "")))
+        return {"message": message, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens}}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock: MockOpenAI = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, error_type: str):
+        self._json(status, {"error": {"message": message, "type": error_type, "code": None}})
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        else:
+            self._error(404, f"Unbekannter Pfad {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        if not path.endswith(("/chat/completions", "/embeddings")):
+            self._error(404, f"Unbekannter Pfad {self.path}", "invalid_request_error")
+            return
+        if not self.mock.admit():
+            self._error(429, "Zu viele gleichzeitige Anfragen", "rate_limit_error")
+            return
+        try:
+            if random.random() < self.mock.error_rate:
+                self.mock.count("errors")
+                self._error(500, "Simulierter Fehler", "server_error")
+            elif path.endswith("/embeddings"):
+                self._embeddings(request)
+            elif request.get("stream"):
+                self._stream(request)
+            else:
+                self._chat(request)
+        finally:
+            self.mock.release()
+
+    def _chat(self, request: dict):
+        self.mock.count("chat")
+        result = self.mock.completion(request)
+        time.sleep(self.mock.delay(self.mock.latency + self.mock.token_latency * result["usage"]["completion_tokens"]))
+        self._json(200, {"id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                         "model": request.get("model", "mock"),
+                         "choices": [{"index": 0, "message": result["message"],
+                                      "finish_reason": result["finish_reason"], "logprobs": None}],
+                         "usage": result["usage"]})
+
+    def _event(self, model: str, delta: dict = None, finish_reason: str = None, usage: dict = None):
+        chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": model, "choices": [] if usage else [{"index": 0, "delta": delta or {},
+                                                               "finish_reason": finish_reason, "logprobs": None}]}
+        if usage:
+            chunk["usage"] = usage
+        self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, request: dict):
+        self.mock.count("chat")
+        result = self.mock.completion(request)
+        model = request.get("model", "mock")
+        self.send_response(200)
+        # Chunked Transfer-Encoding statt Verbindungsende, damit die Verbindung im Pool des Clients bleibt
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(self.mock.delay(self.mock.latency))
+        message = result["message"]
+        self._event(model, {"role": "assistant", "content": ""})
+        if message.get("tool_calls"):
+            self._event(model, {"tool_calls": [{"index": 0, **call} for call in message["tool_calls"]]})
+        else:
+            for word in message["content"].split(" "):
+                time.sleep(self.mock.token_latency)
+                self._event(model, {"content": word + " "})
+        self._event(model, finish_reason=result["finish_reason"])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._event(model, usage=result["usage"])
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _embeddings(self, request: dict):
+        self.mock.count("embeddings")
+        inputs = request.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or self.mock.dimensions
+        time.sleep(self.mock.delay(self.mock.embedding_latency))
+        data = []
+        for index, text in enumerate(inputs):
+            vector = embedding(text, dimensions)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(text) if isinstance(text, list) else count_tokens(text) for text in inputs)
+        self._json(200, {"object": "list", "data": data, "model": request.get("model", "mock"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+class MockServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Vom Client abgebrochene Verbindungen (z. B. verworfene Hedge-Anfragen) sind kein Fehler des Servers
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def create_server(mock: MockOpenAI, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    handler = type("Handler", (MockHandler,), {"mock": mock})
+    server = MockServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-kompatibler Mock-Server fuer Lasttests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latenz pro Chat-Aufruf in Sekunden")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Latenz pro erzeugtem Token in Sekunden")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Latenz pro Embedding-Aufruf")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Anteil simulierter Serverfehler (500)")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="maximale Anzahl gleichzeitiger Anfragen, darueber 429 (0 = unbegrenzt)")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Anteil der Anfragen mit zusaetzlicher Latenz")
+    parser.add_argument("--tail-latency", type=float, default=0.0, help="zusaetzliche Latenz der Ausreisser")
+    args = parser.parse_args()
+
+    mock = MockOpenAI(latency=args.latency, token_latency=args.token_latency,
+                      embedding_latency=args.embedding_latency, error_rate=args.error_rate,
+                      max_concurrency=args.max_concurrency, tail_rate=args.tail_rate,
+                      tail_latency=args.tail_latency)
+    server = create_server(mock, args.host, args.port)
+    print(f"Mock-Server auf http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Aufrufe: {mock.counter}")
+
+
+if __name__ == "__main__":
+    main()
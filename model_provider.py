@@ -0,0 +1,397 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+import httpx
+from dotenv import load_dotenv
+
+import telemetry
+
+# Gemeinsame Anbindung der Modelle (Chat und Embeddings) fuer Backend, Ingestion und Skripte. Alle Aufrufe eines
+# Prozesses teilen sich einen HTTP-Verbindungspool mit Keep-alive und begrenzter Anzahl gleichzeitiger Verbindungen.
+# Timeouts, Wiederholungen mit Jitter und abgesicherte Anfragen (Hedging) uebernimmt der Transport des Pools, die
+# OpenAI-Clients selbst wiederholen nicht (max_retries=0). Jeder OpenAI-kompatible Endpunkt laesst sich ueber
+# MODEL_BASE_URL einbinden.
+# Backends (MODEL_BACKEND):
+# - openai: OpenAI bzw. der Endpunkt aus MODEL_BASE_URL (Standard)
+# - local: lokaler Stand-in-Server (mock_openai.py) im eigenen Prozess, deterministische Antworten und Embeddings ueber
+#   denselben HTTP-Weg wie im Betrieb, ohne Netzwerk und Kosten
+# - fake: Stand-ins ohne HTTP (fake_backends.py) fuer Benchmarks der Anwendung selbst
+
+load_dotenv()
+
+model_backend = os.getenv("MODEL_BACKEND", "openai")
+base_url = os.getenv("MODEL_BASE_URL") or os.getenv("OPENAI_BASE_URL") or None
+api_key = os.getenv("MODEL_API_KEY") or None
+
+# Verbindungspool: gleichzeitige Verbindungen (weitere Anfragen warten bis MODEL_POOL_TIMEOUT), offen gehaltene
+# Verbindungen und deren Lebensdauer ohne Verwendung in Sekunden
+max_connections = int(os.getenv("MODEL_MAX_CONNECTIONS", "32"))
+max_keepalive_connections = int(os.getenv("MODEL_MAX_KEEPALIVE", "16"))
+keepalive_expiry = float(os.getenv("MODEL_KEEPALIVE_EXPIRY", "30"))
+timeout = httpx.Timeout(float(os.getenv("MODEL_TIMEOUT", "60")), connect=float(os.getenv("MODEL_CONNECT_TIMEOUT", "5")),
+                        pool=float(os.getenv("MODEL_POOL_TIMEOUT", "30")))
+
+# Wiederholungen bei Verbindungsfehlern, Timeouts, 429 und 5xx: Wartezeit zufaellig zwischen 0 und
+# min(MODEL_RETRY_MAX, MODEL_RETRY_BASE * 2^Versuch) (Full Jitter), bei Retry-After die Vorgabe des Anbieters
+max_retries = int(os.getenv("MODEL_MAX_RETRIES", "3"))
+retry_base = float(os.getenv("MODEL_RETRY_BASE", "0.5"))
+retry_max = float(os.getenv("MODEL_RETRY_MAX", "8"))
+retry_status = {408, 409, 429, 500, 502, 503, 504}
+
+# Hedging: liegt nach MODEL_HEDGE_DELAY Sekunden noch keine Antwort vor, wird dieselbe Anfrage ein zweites Mal
+# gesendet, die erste Antwort gilt (0 = aus). Nur fuer die Endpunkte aus MODEL_HEDGE_ENDPOINTS, bei Chat-Aufrufen
+# verdoppeln sich im Fall einer zweiten Anfrage die Kosten
+hedge_delay = float(os.getenv("MODEL_HEDGE_DELAY", "0"))
+hedge_endpoints = {endpoint.strip() for endpoint in os.getenv("MODEL_HEDGE_ENDPOINTS", "embeddings").split(",")
+                   if endpoint.strip()}
+
+_lock = threading.Lock()
+_counter = {"requests": 0, "errors": 0, "retries": 0, "hedges": 0, "hedges_won": 0}
+
+
+def _count(name: str):
+    with _lock:
+        _counter[name] += 1
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                        keepalive_expiry=keepalive_expiry)
+
+
+def _endpoint(request: httpx.Request) -> str:
+    path = request.url.path.rstrip("/")
+    return "chat/completions" if path.endswith("/chat/completions") else path.rsplit("/", 1)[-1]
+
+
+def _retry_reason(response: httpx.Response = None, error: Exception = None):
+    """Grund fuer eine Wiederholung oder None"""
+    if error is not None:
+        # Ist der Pool ausgelastet, verschaerft eine Wiederholung die Last nur
+        return None if isinstance(error, httpx.PoolTimeout) else type(error).__name__
+    return str(response.status_code) if response.status_code in retry_status else None
+
+
+def _retry_delay(attempt: int, response: httpx.Response = None) -> float:
+    if response is not None:
+        for header, factor in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+            try:
+                return min(float(response.headers[header]) * factor, retry_max)
+            except (KeyError, ValueError):
+                pass
+    return random.uniform(0, min(retry_max, retry_base * 2 ** attempt))
+
+
+def _record(request: httpx.Request, response: httpx.Response = None, error: Exception = None):
+    _count("requests")
+    status = str(response.status_code) if response is not None else type(error).__name__
+    if error is not None or response.status_code >= 400:
+        _count("errors")
+    telemetry.model_requests.inc(endpoint=_endpoint(request), status=status)
+
+
+def _log_retry(request: httpx.Request, attempt: int, reason: str, delay: float):
+    _count("retries")
+    telemetry.model_retries.inc(endpoint=_endpoint(request), reason=reason)
+    telemetry.log_event("modell_retry", logging.WARNING, endpoint=_endpoint(request), attempt=attempt + 1,
+                        reason=reason, delay=round(delay, 3))
+
+
+def _log_hedge(request: httpx.Request, winner: str):
+    _count("hedges")
+    if winner == "zweite":
+        _count("hedges_won")
+    telemetry.model_hedges.inc(endpoint=_endpoint(request), winner=winner)
+
+
+def _is_event_stream(response: httpx.Response) -> bool:
+    return response.status_code == 200 and response.headers.get("content-type", "").startswith("text/event-stream")
+
+
+class EventStream(httpx.SyncByteStream):
+    """Body einer gestreamten Antwort (Server-Sent Events). Der OpenAI-Client schliesst den Stream direkt nach
+    [DONE], ohne das Ende des Bodys zu lesen, daraufhin verwirft httpcore die Verbindung. Nach [DONE] wird der Rest
+    des Bodys gelesen, die Verbindung bleibt im Pool. Bei einem Abbruch mitten im Stream wird weiterhin geschlossen"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._iterator = None
+        self._tail = b""
+
+    def __iter__(self):
+        self._iterator = iter(self._stream)
+        for chunk in self._iterator:
+            self._tail = (self._tail + chunk)[-16:]
+            yield chunk
+
+    def close(self):
+        if self._iterator is not None and b"[DONE]" in self._tail:
+            try:
+                for _ in self._iterator:
+                    pass
+            except httpx.HTTPError:
+                pass
+        self._stream.close()
+
+
+class AsyncEventStream(httpx.AsyncByteStream):
+    """Asynchrone Variante von EventStream"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._iterator = None
+        self._tail = b""
+
+    async def __aiter__(self):
+        self._iterator = self._stream.__aiter__()
+        async for chunk in self._iterator:
+            self._tail = (self._tail + chunk)[-16:]
+            yield chunk
+
+    async def aclose(self):
+        if self._iterator is not None and b"[DONE]" in self._tail:
+            try:
+                async for _ in self._iterator:
+                    pass
+            except httpx.HTTPError:
+                pass
+        await self._stream.aclose()
+
+
+def _discard(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """Transport des synchronen Clients: Pool mit Keep-alive, Wiederholungen und Hedging"""
+
+    def __init__(self):
+        self._transport = httpx.HTTPTransport(limits=_limits())
+        self._executor = None
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        if not hedge_delay or _endpoint(request) not in hedge_endpoints:
+            return self._transport.handle_request(request)
+        with _lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="modell-hedge")
+        futures = [self._executor.submit(self._transport.handle_request, request)]
+        if not wait(futures, timeout=hedge_delay).done:
+            futures.append(self._executor.submit(self._transport.handle_request, request))
+        for future in as_completed(futures):
+            if future.exception() is None:
+                if len(futures) > 1:
+                    _log_hedge(request, "erste" if future is futures[0] else "zweite")
+                # Die Antwort der langsameren Anfrage wird verworfen, sobald sie vorliegt
+                for other in futures:
+                    if other is not future:
+                        other.add_done_callback(_discard)
+                return future.result()
+        raise futures[0].exception()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                response = self._send(request)
+            except httpx.TransportError as transport_error:
+                error = transport_error
+            _record(request, response, error)
+            reason = _retry_reason(response, error)
+            if reason is None or attempt >= max_retries:
+                if error is not None:
+                    raise error
+                if _is_event_stream(response):
+                    response.stream = EventStream(response.stream)
+                return response
+            delay = _retry_delay(attempt, response)
+            if response is not None:
+                response.close()
+            _log_retry(request, attempt, reason, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self._transport.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    """Transport des asynchronen Clients. Verbindungen gehoeren zur Event-Loop, in der sie geoeffnet wurden, daher
+    ein Pool je Event-Loop (z. B. mehrere asyncio.run in Skripten)"""
+
+    def __init__(self):
+        self._transports = weakref.WeakKeyDictionary()
+
+    def _transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with _lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(limits=_limits())
+        return transport
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        transport = self._transport()
+        if not hedge_delay or _endpoint(request) not in hedge_endpoints:
+            return await transport.handle_async_request(request)
+        tasks = [asyncio.ensure_future(transport.handle_async_request(request))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                tasks.append(asyncio.ensure_future(transport.handle_async_request(request)))
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in tasks if task in done and task.exception() is None), None)
+            if winner is None:
+                raise tasks[0].exception()
+            if len(tasks) > 1:
+                _log_hedge(request, "erste" if winner is tasks[0] else "zweite")
+            return winner.result()
+        finally:
+            # Die langsamere Anfrage wird abgebrochen bzw. ihre Antwort verworfen
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    await task.result().aclose()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                response = await self._send(request)
+            except httpx.TransportError as transport_error:
+                error = transport_error
+            _record(request, response, error)
+            reason = _retry_reason(response, error)
+            if reason is None or attempt >= max_retries:
+                if error is not None:
+                    raise error
+                if _is_event_stream(response):
+                    response.stream = AsyncEventStream(response.stream)
+                return response
+            delay = _retry_delay(attempt, response)
+            if response is not None:
+                await response.aclose()
+            _log_retry(request, attempt, reason, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        with _lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+_clients = {}
+_local_server = None
+
+
+def http_client() -> httpx.Client:
+    """Synchroner Client mit dem gemeinsamen Verbindungspool (einmal pro Prozess)"""
+    with _lock:
+        if "sync" not in _clients:
+            _clients["sync"] = httpx.Client(transport=ResilientTransport(), timeout=timeout)
+        return _clients["sync"]
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """Asynchroner Client mit einem Verbindungspool je Event-Loop (einmal pro Prozess)"""
+    with _lock:
+        if "async" not in _clients:
+            _clients["async"] = httpx.AsyncClient(transport=AsyncResilientTransport(), timeout=timeout)
+        return _clients["async"]
+
+
+def start_local_server() -> str:
+    """Startet den Stand-in-Server (mock_openai.py) in einem Hintergrund-Thread, Rueckgabe: Basis-URL. Latenzen wie
+    bei den Stand-ins ohne HTTP ueber FAKE_LLM_LATENCY, FAKE_LLM_TOKEN_LATENCY und FAKE_EMBEDDING_LATENCY"""
+    global _local_server
+    with _lock:
+        if _local_server is None:
+            from mock_openai import MockOpenAI, create_server
+
+            mock = MockOpenAI(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+                              token_latency=float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0")),
+                              embedding_latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")))
+            _local_server = create_server(mock, "127.0.0.1", int(os.getenv("LOCAL_MODEL_PORT", "0")))
+            threading.Thread(target=_local_server.serve_forever, name="modell-stand-in", daemon=True).start()
+            telemetry.log_event("modell_stand_in", port=_local_server.server_address[1])
+        host, port = _local_server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def endpoint() -> str:
+    """Basis-URL des Modellanbieters, None fuer die Standard-URL von OpenAI"""
+    return start_local_server() if model_backend == "local" else base_url
+
+
+def _client_kwargs() -> dict:
+    kwargs = {"http_client": http_client(), "http_async_client": async_http_client(), "timeout": timeout,
+              "max_retries": 0}
+    if endpoint() is not None:
+        kwargs["base_url"] = endpoint()
+    if model_backend == "local":
+        kwargs["api_key"] = "local"
+    elif api_key is not None:
+        kwargs["api_key"] = api_key
+    return kwargs
+
+
+def chat_model(model: str, callbacks: list = None, **kwargs):
+    """Chat-Modell des konfigurierten Backends. Weitere Argumente (z. B. stream_usage) gehen an ChatOpenAI"""
+    if model_backend == "fake":
+        from fake_backends import FakeChatModel
+
+        return FakeChatModel(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+                             token_latency=float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0")), callbacks=callbacks)
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(**{"model": model, "callbacks": callbacks, **_client_kwargs(), **kwargs})
+
+
+def embeddings(model: str, **kwargs):
+    """Embedding-Modell des konfigurierten Backends. Texte werden nur fuer die Standard-URL von OpenAI vorab in Tokens
+    zerlegt, andere Endpunkte erhalten die Texte (ohne tiktoken)"""
+    if model_backend == "fake":
+        from fake_backends import HashEmbeddings
+
+        return HashEmbeddings(latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")))
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(**{"model": model, "check_embedding_ctx_length": endpoint() is None, **_client_kwargs(),
+                               **kwargs})
+
+
+def embedding_cache_name(model: str) -> str:
+    """Name des Modells im Embedding-Cache. Vektoren anderer Endpunkte oder der Stand-ins landen unter eigenem Namen
+    und vermischen sich nicht mit denen von OpenAI"""
+    if model_backend == "fake":
+        return "hash-embeddings"
+    if model_backend == "local":
+        return f"{model}@local"
+    return model if base_url is None else f"{model}@{base_url}"
+
+
+def stats() -> dict:
+    with _lock:
+        stats = dict(_counter)
+    stats.update(backend=model_backend, endpoint=endpoint() or "https://api.openai.com/v1",
+                 max_connections=max_connections, hedge_delay=hedge_delay)
+    return stats
@@ -1,87 +1,387 @@
+import argparse
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+import model_provider
+import vectorstore_registry
+import vektor_index
+from bm25_index import build_index, save_index
+from dokument_store import DokumentStore
+from embedding_cache import CachedEmbeddings, cached_embeddings
+from fake_backends import HashEmbeddings
+from ingest_manifest import load_manifest, product_fingerprints, save_manifest
+from produkt_pitches import generate_pitches
+
 load_dotenv()
 
 # Auswahl Modell
+llm_model = "gpt-4o"
 embedding_model = "text-embedding-3-large"
 
-folder_path = "testdaten"
+folder_path = "Testdaten"
 csv_path = "produkteinstufung/ProduktMetadaten.csv"
+persist_directory = vectorstore_registry.persist_directory
+
+# Eingebettet werden nur die Chunks. Jeder Chunk verweist ueber parent_id auf seine Seite im Docstore
+chunks_collection = vectorstore_registry.chunks_collection
+# Collection der frueheren Ablage mit vollstaendig eingebetteten Seiten, wird bei der ersten Ingestion entfernt
+legacy_documents_collection = "pdf_collection_documents"
+
+# Parameter fuer das Splitten der Dokumente in Chunks (bisherige Werte). test_functions/chunk_tuning.py bestaetigt
+# 800/100 nur mit den Stand-in-Embeddings, fuer die OpenAI-Embeddings steht der Lauf noch aus
+chunk_size = 800
+chunk_overlap = 100
+
+# Exportierter Vektorindex fuer VECTOR_BACKEND=index: Dimensionen (leer = alle) und Format (float32, float16, int8)
+index_dimensions = int(os.getenv("INDEX_DIMENSIONS", "0")) or None
+index_dtype = os.getenv("INDEX_DTYPE", "float16")
+
+
+# CSV-Datei einlesen (mit pandas) fuer Metadaten
+def load_metadata_from_csv(path):
+    return pd.read_csv(path, sep=';')
+
+
+# Mapper Metadaten pro Dokument
+def map_metadata(doc, metadaten):
+    doc.metadata["produktname"] = metadaten["Produktname"].item()
+    doc.metadata["produktnummer"] = metadaten["Produktnummer"].item()
+    doc.metadata["mindestanlagebetrag"] = int(metadaten["Mindestanlagebetrag"].item())
+    doc.metadata["laufzeit"] = metadaten["Laufzeit"].item()
+    doc.metadata["kosten"] = metadaten["Kosten"].item()
+    doc.metadata["risiko"] = metadaten["Risiko"].item()
+    doc.metadata["nachhaltigkeit"] = metadaten["Nachhaltigkeit"].item()
+
+
+def file_hash(path, metadaten) -> str:
+    """Inhalts-Hash einer PDF-Datei inkl. der zugehoerigen Zeile aus der CSV-Datei"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as pdf_file:
+        for block in iter(lambda: pdf_file.read(1 << 20), b""):
+            sha.update(block)
+    sha.update(metadaten.to_json(orient="records").encode("utf-8"))
+    return sha.hexdigest()
+
+
+def collection_settings(embedding_name: str) -> dict:
+    """Einstellungen, von denen der Inhalt der Chunk-Collection abhaengt, einschliesslich des Embedding-Modells (Name
+    wie im Embedding-Cache, z.B. hash-embeddings fuer die Stand-ins)"""
+    return {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "embedding": embedding_name}
+
+
+def split_pages(pages: list, page_ids: list[str]):
+    """Splittet die Seiten in Chunks, jeder Chunk erhaelt die ID seiner Seite als parent_id"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    for page_id, page in zip(page_ids, pages):
+        for chunk in text_splitter.split_documents([page]):
+            chunk.metadata["parent_id"] = page_id
+            chunks.append(chunk)
+    return chunks
+
+
+def stable_ids(documents: list) -> list[str]:
+    """Stabile IDs aus Inhalt und Metadaten. Unveraenderte Seiten bzw. Chunks behalten ihre ID"""
+    ids = []
+    seen = {}
+    for doc in documents:
+        key = json.dumps({"metadata": doc.metadata, "content": doc.page_content}, sort_keys=True, default=str)
+        # Identische Chunks innerhalb einer Seite werden ueber ihr Vorkommen unterschieden
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        ids.append(hashlib.sha256(f"{key}|{occurrence}".encode("utf-8")).hexdigest()[:32])
+    return ids
+
+
+def load_pdf(path, pdf_file, produkt_metadaten):
+    full_path = os.path.join(path, pdf_file)
+    loader = PyPDFLoader(full_path)
+    document = loader.load()
+    for doc in document:
+        map_metadata(doc, produkt_metadaten)
+    return document
+
+
+def _unchanged(entry: dict, digest: str, settings: dict, chunk_ids: set, parent_ids: set) -> bool:
+    """Prueft, ob eine Datei unveraendert und vollstaendig in Chunk-Collection und Docstore indexiert ist"""
+    if not entry or entry["hash"] != digest or entry.get("settings") != settings:
+        return False
+    return set(entry["chunk_ids"]) <= chunk_ids and set(entry["parent_ids"]) <= parent_ids
+
+
+class EmbeddingQueue:
+    """Begrenzte Warteschlange: Seiten/Chunks werden in Batches mit begrenzter Parallelitaet eingebettet und
+    gesammelt in Chroma geschrieben (Embedding-Funktion der jeweiligen Collection). Ist die Warteschlange voll, wartet
+    das Einlesen (Backpressure)."""
+
+    def __init__(self, vector_stores: dict, batch_size: int, concurrency: int, max_queue: int):
+        self.vector_stores = vector_stores
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"embeddings": 0, "batches": 0}
+        self.errors = []
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(concurrency)]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, option: str, doc_id: str, doc):
+        self.queue.put((option, doc_id, doc))
+
+    def close(self):
+        """Wartet, bis alle Eintraege eingebettet und geschrieben sind"""
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def _next_batch(self):
+        item = self.queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get(timeout=0.05)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if not batch or self.errors:
+                continue
+            try:
+                # Einbetten und Schreiben je Collection in einem Aufruf (add_texts ueberschreibt vorhandene IDs).
+                # Rate-Limits und Serverfehler wiederholt der Transport (model_provider.py)
+                for option in {option for option, _, _ in batch}:
+                    items = [(doc_id, doc) for item_option, doc_id, doc in batch if item_option == option]
+                    self.vector_stores[option].add_texts([doc.page_content for _, doc in items],
+                                                         metadatas=[doc.metadata for _, doc in items],
+                                                         ids=[doc_id for doc_id, _ in items])
+                with self._lock:
+                    self.stats["embeddings"] += len(batch)
+                    self.stats["batches"] += 1
+            except Exception as exc:
+                self.errors.append(exc)
+
+
+def ingest(path=folder_path, embeddings=None, batch_size=64, concurrency=4, workers=None, max_queue=2048,
+           pitches=False, index_dimensions=index_dimensions, index_dtype=index_dtype, embedding_name=None):
+    """Inkrementelle Ingestion: nur neue oder geaenderte Chunks werden eingebettet, Chunks und Seiten entfernter oder
+    geaenderter Dateien werden geloescht. PDFs werden parallel in einem Prozess-Pool eingelesen. embedding_name
+    bezeichnet das Embedding-Modell (Standard: Name im Embedding-Cache bzw. des konfigurierten Backends)."""
+    manifest = load_manifest(persist_directory)
+    metadata_df = load_metadata_from_csv(csv_path)
+
+    # Initialisiere Embedding-Modell ueber den gemeinsamen Verbindungspool. Rate-Limits (mit Retry-After) und
+    # Serverfehler wiederholt der Transport (MODEL_MAX_RETRIES). Bereits berechnete Vektoren liefert der
+    # Embedding-Cache
+    if embeddings is None:
+        embeddings = cached_embeddings(model_provider.embeddings(embedding_model),
+                                       model_provider.embedding_cache_name(embedding_model))
+    if embedding_name is None:
+        embedding_name = (embeddings.model if isinstance(embeddings, CachedEmbeddings)
+                          else model_provider.embedding_cache_name(embedding_model))
+    settings = collection_settings(embedding_name)
+
+    if manifest.get("version", 1) < 2:
+        # Fruehere Ablage mit zwei eingebetteten Kopien des Bestands: Seiten-Collection entfernen. Die Eintraege des
+        # alten Manifests passen nicht mehr, alle Dateien werden neu eingelesen
+        Chroma(collection_name=legacy_documents_collection, embedding_function=embeddings,
+               persist_directory=persist_directory).delete_collection()
+        manifest = {"version": 2, "files": {}}
+
+    if any(entry.get("settings", {}).get("embedding") != embedding_name for entry in manifest["files"].values()):
+        # Vektoren eines anderen Embedding-Modells (oder einer Ablage ohne diese Angabe) passen nicht zu den neuen,
+        # auch nicht in der Dimension: die Chunk-Collection wird geleert und alle Dateien werden neu eingebettet
+        print(f"Embedding-Modell {embedding_name} weicht vom Bestand ab, alle Chunks werden neu eingebettet")
+        Chroma(collection_name=chunks_collection, embedding_function=embeddings,
+               persist_directory=persist_directory).delete_collection()
+
+    vector_store = Chroma(collection_name=chunks_collection,
+                          embedding_function=embeddings,
+                          persist_directory=persist_directory)
+    dokument_store = DokumentStore(persist_directory)
+    existing_chunk_ids = set(vector_store.get(include=[])["ids"])
+    existing_parent_ids = dokument_store.ids()
+
+    # Liste alle Dateien im Ordner auf
+    pdf_files = sorted(f for f in os.listdir(path) if f.endswith('.pdf'))
+
+    files = {}
+    changed = {}
+    for pdf_file in pdf_files:
+        produkt_metadaten = metadata_df[metadata_df['Dateiname'] == pdf_file]
+        if produkt_metadaten.empty:
+            print(f"{pdf_file}: keine Metadaten in {csv_path}, Datei wird nicht indexiert")
+            continue
+
+        digest = file_hash(os.path.join(path, pdf_file), produkt_metadaten)
+        entry = manifest["files"].get(pdf_file)
+        if _unchanged(entry, digest, settings, existing_chunk_ids, existing_parent_ids):
+            files[pdf_file] = entry
+        else:
+            changed[pdf_file] = (digest, produkt_metadaten)
 
-splitting_option = ["pdf_collection_chunks", "pdf_collection_documents"]
+    start = time.perf_counter()
+    pages = 0
+    retries = model_provider.stats()["retries"]
+    embedding_queue = EmbeddingQueue({chunks_collection: vector_store}, batch_size, concurrency, max_queue)
+    try:
+        # Jede neue oder geaenderte PDF wird pro Durchlauf nur einmal eingelesen
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(load_pdf, path, pdf_file, produkt_metadaten): pdf_file
+                       for pdf_file, (_, produkt_metadaten) in changed.items()}
+            for future in as_completed(futures):
+                pdf_file = futures[future]
+                documents = future.result()
+                pages += len(documents)
+                digest, produkt_metadaten = changed[pdf_file]
 
-for option in splitting_option:
-    # CSV-Datei einlesen (mit pandas) fuer Metadaten
-    def load_metadata_from_csv(path):
-        return pd.read_csv(path, sep=';')
+                # Seiten werden nicht eingebettet, sondern nur im Docstore abgelegt
+                parent_ids = stable_ids(documents)
+                dokument_store.add(parent_ids, documents)
+                existing_parent_ids.update(parent_ids)
 
+                chunks = split_pages(documents, parent_ids)
+                chunk_ids = stable_ids(chunks)
+                new_chunks = 0
+                for chunk_id, chunk in zip(chunk_ids, chunks):
+                    if chunk_id not in existing_chunk_ids:
+                        embedding_queue.put(chunks_collection, chunk_id, chunk)
+                        existing_chunk_ids.add(chunk_id)
+                        new_chunks += 1
+                print(f"{pdf_file}: {len(documents)} Seiten, {new_chunks} von {len(chunk_ids)} Chunks neu einzubetten")
+                files[pdf_file] = {"hash": digest, "produktnummer": int(produkt_metadaten["Produktnummer"].item()),
+                                   "settings": settings, "chunk_ids": chunk_ids,
+                                   "parent_ids": parent_ids}
+        parse_seconds = time.perf_counter() - start
+    finally:
+        embedding_queue.close()
+    total_seconds = time.perf_counter() - start
 
-    # Mapper Metadaten pro Dokument
-    def map_metadata(doc, metadaten):
-        doc.metadata["produktname"] = metadaten["Produktname"].item()
-        doc.metadata["produktnummer"] = metadaten["Produktnummer"].item()
-        doc.metadata["mindestanlagebetrag"] = int(metadaten["Mindestanlagebetrag"].item())
-        doc.metadata["laufzeit"] = metadaten["Laufzeit"].item()
-        doc.metadata["kosten"] = metadaten["Kosten"].item()
-        doc.metadata["risiko"] = metadaten["Risiko"].item()
-        doc.metadata["nachhaltigkeit"] = metadaten["Nachhaltigkeit"].item()
+    stats = embedding_queue.stats
+    print(f"Einlesen: {pages} Seiten aus {len(changed)} Dateien in {parse_seconds:.2f} s "
+          f"({pages / parse_seconds if parse_seconds else 0:.1f} Seiten/s)")
+    print(f"Embedding: {stats['embeddings']} Chunks in {stats['batches']} Batches, "
+          f"{model_provider.stats()['retries'] - retries} Retries, "
+          f"{total_seconds:.2f} s ({stats['embeddings'] / total_seconds if total_seconds else 0:.1f} Embeddings/s)")
+    if isinstance(embeddings, CachedEmbeddings):
+        cache_stats = embeddings.stats()
+        print(f"Embedding-Cache: {cache_stats['hits']} Treffer, {cache_stats['misses']} neu berechnet, "
+              f"{cache_stats['entries']} Eintraege ({cache_stats['bytes'] / 1024 / 1024:.1f} MB)")
 
+    # Alles, was nicht mehr zu einer aktuellen Datei gehoert, wird geloescht (entfernte oder geaenderte Dateien sowie
+    # Eintraege ohne Manifest)
+    stale_chunk_ids = existing_chunk_ids - {doc_id for entry in files.values() for doc_id in entry["chunk_ids"]}
+    if stale_chunk_ids:
+        vector_store.delete(ids=list(stale_chunk_ids))
+        print(f"{len(stale_chunk_ids)} veraltete Chunks geloescht")
+    stale_parent_ids = existing_parent_ids - {doc_id for entry in files.values() for doc_id in entry["parent_ids"]}
+    if stale_parent_ids:
+        dokument_store.delete(list(stale_parent_ids))
+        print(f"{len(stale_parent_ids)} veraltete Seiten geloescht")
 
-    def load_pdfs_from_folder(path):
-        # Liste alle Dateien im Ordner auf
-        pdf_files = [f for f in os.listdir(path) if f.endswith('.pdf')]
+    # BM25-Index ueber alle Chunks fuer die hybride Suche (vollstaendig neu aufgebaut, ohne Embedding-Aufruf)
+    result = vector_store.get(include=["documents", "metadatas"])
+    save_index(persist_directory, build_index(result["ids"], result["documents"], result["metadatas"]))
+    print(f"BM25-Index mit {len(result['ids'])} Chunks erstellt")
 
-        # CSV-Datei laden
-        metadata_df = load_metadata_from_csv(csv_path)
+    # Unveraenderlicher, per Memory-Mapping lesbarer Vektorindex (VECTOR_BACKEND=index)
+    export_vektor_index(vector_store, index_dimensions, index_dtype)
 
-        # Initialisiere Liste fuer Dokumente
-        document_list = []
+    manifest["files"] = files
+    save_manifest(persist_directory, manifest)
 
-        # Lese alle PDFs im Ordner ein
-        for pdf_file in pdf_files:
-            produkt_metadaten = metadata_df[metadata_df['Dateiname'] == pdf_file]
-            full_path = os.path.join(path, pdf_file)
-            loader = PyPDFLoader(full_path)
-            document = loader.load()
-            for doc in document:
-                map_metadata(doc, produkt_metadaten)
-            document_list.extend(document)  # Füge die Dokumente hinzu
+    if pitches:
+        precompute_pitches(dokument_store)
 
-        return document_list
 
+def export_vektor_index(vector_store=None, dimensions=index_dimensions, dtype=index_dtype):
+    """Exportiert die Chunk-Collection als Vektorindex (vektor_index.py)"""
+    if vector_store is None:
+        vector_store = Chroma(collection_name=chunks_collection, persist_directory=persist_directory)
+    start = time.perf_counter()
+    manifest = vektor_index.export_from_collection(persist_directory, vector_store, dimensions, dtype,
+                                                   embedding_model)
+    size = sum(os.path.getsize(os.path.join(vektor_index.index_directory(persist_directory), file))
+               for file in os.listdir(vektor_index.index_directory(persist_directory)))
+    print(f"Vektorindex mit {manifest['count']} Chunks exportiert ({manifest['dimensions']} Dimensionen, "
+          f"{manifest['dtype']}, {size / 1024 / 1024:.1f} MB) in {time.perf_counter() - start:.2f} s")
+    return manifest
 
-    documents = load_pdfs_from_folder(folder_path)
 
-    # Initialisiere Embedding-Modell
-    embeddings = OpenAIEmbeddings(
-        model=embedding_model)
+def precompute_pitches(dokument_store: DokumentStore):
+    """Erzeugt Zusammenfassung und Vorstellung je Produkt fuer PITCH_MODE=precomputed (nur fuer geaenderte Produkte)"""
+    documents_by_product = {produktnummer: dokument_store.by_product(produktnummer)
+                            for produktnummer in dokument_store.products()}
+    erzeugt = generate_pitches(model_provider.chat_model(llm_model), llm_model, documents_by_product,
+                               product_fingerprints(persist_directory))
+    print(f"Produktvorstellungen: {erzeugt} von {len(documents_by_product)} neu erzeugt")
 
-    # Erstelle DB-Collection mit gesplitteten und originalen Dokumente
-    if option == "pdf_collection_chunks":
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=150, chunk_overlap=50)
 
-        chunks = text_splitter.split_documents(documents)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inkrementelle Ingestion der Produktinformationsblaetter")
+    parser.add_argument("--path", default=folder_path, help="Ordner mit den PDF-Dateien")
+    parser.add_argument("--batch-size", type=int, default=64, help="Anzahl Texte pro Embedding-Aufruf")
+    parser.add_argument("--concurrency", type=int, default=4, help="Anzahl gleichzeitiger Embedding-Aufrufe")
+    parser.add_argument("--workers", type=int, default=None, help="Anzahl Prozesse fuer das Einlesen der PDFs")
+    parser.add_argument("--max-queue", type=int, default=2048, help="Maximale Laenge der Embedding-Warteschlange")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="lokale Stand-in-Embeddings statt OpenAI (fuer Benchmarks ohne Netzwerk)")
+    parser.add_argument("--persist-directory", default=None,
+                        help="Persist-Verzeichnis (Standard: CHROMA_PERSIST_DIRECTORY, mit --fake-embeddings "
+                             "./benchmark_db)")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="simulierte Latenz pro Embedding-Aufruf")
+    parser.add_argument("--pitches", action="store_true",
+                        help="Produktvorstellungen fuer PITCH_MODE=precomputed vorberechnen (Modell aus MODEL_BACKEND)")
+    parser.add_argument("--index-dimensions", type=int, default=index_dimensions,
+                        help="Dimensionen des exportierten Vektorindex (Standard: alle)")
+    parser.add_argument("--index-dtype", choices=list(vektor_index.dtypes), default=index_dtype,
+                        help="Format des exportierten Vektorindex")
+    parser.add_argument("--export-index", action="store_true",
+                        help="nur den Vektorindex aus der bestehenden Collection exportieren, ohne Ingestion")
+    args = parser.parse_args()
 
-        print(f"Split {len(documents)} documents into {len(chunks)} chunks.")
+    # Die Hash-Vektoren der Stand-ins duerfen nicht in die Vektordatenbank des Backends gelangen
+    if args.fake_embeddings:
+        persist_directory = args.persist_directory or "./benchmark_db"
+        if os.path.abspath(persist_directory) == os.path.abspath(vectorstore_registry.default_persist_directory):
+            parser.error(f"--fake-embeddings schreibt nicht in {vectorstore_registry.default_persist_directory}")
+    elif args.persist_directory:
+        persist_directory = args.persist_directory
 
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            collection_name=option,
-            embedding=embeddings,
-            persist_directory="./chroma_langchain_db"
-        )
+    if args.export_index:
+        export_vektor_index(dimensions=args.index_dimensions, dtype=args.index_dtype)
     else:
-        print("No Splitting")
-        vector_store = Chroma.from_documents(
-            documents=documents,
-            collection_name=option,
-            embedding=embeddings,
-            persist_directory="./chroma_langchain_db"
-        )
+        ingest(args.path,
+               embeddings=cached_embeddings(HashEmbeddings(latency=args.fake_latency), "hash-embeddings")
+               if args.fake_embeddings else None,
+               batch_size=args.batch_size,
+               concurrency=args.concurrency,
+               workers=args.workers,
+               max_queue=args.max_queue,
+               pitches=args.pitches,
+               index_dimensions=args.index_dimensions,
+               index_dtype=args.index_dtype,
+               embedding_name="hash-embeddings" if args.fake_embeddings else None)
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import threading
+from typing import TypedDict, Annotated
+
+from langchain_core.prompts import ChatPromptTemplate
+
+# Vorberechnete Produktvorstellungen: Bei der Ingestion werden je Produkt eine kompakte Zusammenfassung der
+# Produktinformationen und eine allgemeine Produktvorstellung erzeugt und neben dem Produktkatalog abgelegt. Zur
+# Laufzeit (PITCH_MODE=precomputed) wird nur noch die Vorstellung an die Antworten des Kunden angepasst, ohne den
+# vollstaendigen Text des Produktinformationsblatts an das LLM zu uebergeben.
+
+pitches_path = "produkteinstufung/produkt_pitches.json"
+
+pitch_system_prompt = """Du bist ein digitaler Anlageberater von der Musterbank eG. Du erhältst den Text eines
+    Produktinformationsblatts. Erstelle daraus eine kompakte Zusammenfassung mit allen für die Beratung wichtigen Fakten
+    (Produktname, Mindestanlagebetrag, Laufzeit, Kosten, Risiko, Nachhaltigkeit, Besonderheiten) sowie eine kurze,
+    allgemeine Vorstellung des Produkts, die es als Anlageprodukt bewirbt."""
+
+pitch_prompt = ChatPromptTemplate.from_messages([("system", pitch_system_prompt), ("human", "{input}")])
+
+personalize_system_prompt = """Du bist ein digitaler Anlageberater von der Musterbank eG und berätst Kunden zum Thema
+    Vermögensanlage. Du erhältst das Anlageprofil des Kunden, die Zusammenfassung des passenden Produkts und eine
+    allgemeine Vorstellung des Produkts. Stell das Produkt kurz vor und bewirb es auf Basis der Antworten des Kunden
+    als passendes Anlageprodukt für den Kunden. Verwende nur Fakten aus der Zusammenfassung."""
+
+# Version von Prompt und Modell. Aendert sich eines davon, werden die Vorstellungen neu erzeugt
+prompt_version = hashlib.sha256(pitch_system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class ProduktPitch(TypedDict):
+    """Zusammenfassung und allgemeine Vorstellung eines Produkts"""
+
+    zusammenfassung: Annotated[str, ..., "Kompakte Zusammenfassung der Fakten aus dem Produktinformationsblatt"]
+    pitch: Annotated[str, ..., "Kurze, allgemeine Vorstellung des Produkts"]
+
+
+def load_pitches(path: str = pitches_path) -> dict:
+    if not os.path.exists(path):
+        return {"version": 1, "products": {}}
+    with open(path, encoding="utf-8") as pitches_file:
+        return json.load(pitches_file)
+
+
+def save_pitches(pitches: dict, path: str = pitches_path):
+    """Schreibt die Vorstellungen atomar (temporaere Datei und anschliessendes Umbenennen)"""
+    with open(path + ".tmp", "w", encoding="utf-8") as tmp:
+        json.dump(pitches, tmp, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def generate_pitches(llm, model: str, documents_by_product: dict, fingerprints: dict, path: str = pitches_path) -> int:
+    """Erzeugt Zusammenfassung und Vorstellung fuer alle Produkte, deren Produktinformationen sich seit der letzten
+    Erzeugung geaendert haben. Rueckgabe: Anzahl neu erzeugter Vorstellungen"""
+    pitches = load_pitches(path)
+    chain = pitch_prompt | llm.with_structured_output(ProduktPitch)
+    version = f"{model}:{prompt_version}"
+
+    erzeugt = 0
+    for produktnummer, documents in documents_by_product.items():
+        entry = pitches["products"].get(str(produktnummer))
+        fingerprint = fingerprints.get(produktnummer)
+        if entry and entry["hash"] == fingerprint and entry["version"] == version:
+            continue
+        result = chain.invoke("\n\n".join(doc.page_content for doc in documents))
+        pitches["products"][str(produktnummer)] = {
+            "hash": fingerprint,
+            "version": version,
+            "produktname": documents[0].metadata.get("produktname"),
+            "source": documents[0].metadata.get("source"),
+            "zusammenfassung": result["zusammenfassung"],
+            "pitch": result["pitch"],
+        }
+        erzeugt += 1
+
+    # Produkte, die nicht mehr im Bestand sind, werden entfernt
+    pitches["products"] = {nummer: entry for nummer, entry in pitches["products"].items()
+                           if int(nummer) in documents_by_product}
+    save_pitches(pitches, path)
+    return erzeugt
+
+
+class ProduktPitches:
+    """Lesezugriff auf die vorberechneten Vorstellungen. Die Datei wird nur neu gelesen, wenn sie sich geaendert hat"""
+
+    def __init__(self, path: str = pitches_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._products = {}
+
+    def get(self, produktnummer: int, fingerprint: str = None):
+        """Vorstellung des Produkts oder None (fehlt oder passt nicht zum aktuellen Inhalts-Hash)"""
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature != self._signature:
+                self._products = load_pitches(self.path)["products"] if signature else {}
+                self._signature = signature
+            entry = self._products.get(str(produktnummer))
+        if entry is None or (fingerprint is not None and entry["hash"] != fingerprint):
+            return None
+        return entry
+
+
+def personalize_messages(entry: dict, profil: str) -> list:
+    """Nachrichten fuer die Anpassung der vorberechneten Vorstellung an das Anlageprofil"""
+    return [("system", personalize_system_prompt),
+            ("human", f"{profil}\n\nZusammenfassung des Produkts {entry['produktname']}:\n{entry['zusammenfassung']}"
+                      f"\n\nAllgemeine Vorstellung:\n{entry['pitch']}")]
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import vectorstore_registry
+from produktkatalog import katalog
+
+# Gemeinsamer Speicher fuer die Produktinformationsblaetter (PDF). Die Produktnummer wird einmal auf die Datei
+# aufgeloest, der Inhalt liegt in einem nach Bytes begrenzten LRU-Cache und wird von allen Sessions bzw. Anfragen
+# gemeinsam genutzt (keine Kopie je Session oder Rerun der Oberflaeche). Jede Datei erhaelt beim Laden einen
+# Inhalts-Hash als ETag. Aendert sich die Datei auf der Festplatte, wird sie beim naechsten Zugriff neu gelesen.
+
+# Ordner mit den Produktinformationsblaettern (Dateinamen aus produkteinstufung/ProduktMetadaten.csv)
+produktblatt_directory = os.getenv("PRODUKTBLATT_DIRECTORY", "Testdaten")
+
+
+def normalize_path(path: str) -> str:
+    """Pfad aus den Metadaten (bei der Ingestion unter Windows z. B. Testdaten\\datei.pdf) fuer das aktuelle System"""
+    return os.path.normpath(path.replace("\\", "/"))
+
+
+@dataclass(frozen=True)
+class Produktblatt:
+    produktnummer: int
+    path: str
+    dateiname: str
+    data: bytes
+    etag: str
+    signature: tuple
+
+
+class ProduktblattStore:
+    """Produktnummer -> Produktinformationsblatt, LRU-Cache mit Obergrenze in Bytes"""
+
+    def __init__(self, directory: str = produktblatt_directory, max_bytes: int = 32 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counter = {"hits": 0, "misses": 0}
+
+    def _candidates(self, produktnummer: int):
+        produkt = katalog.get(produktnummer)
+        if produkt:
+            yield os.path.join(self.directory, produkt["dateiname"])
+        # Quelle der Seiten im Docstore, falls der Katalog die Datei nicht (mehr) kennt
+        pages = vectorstore_registry.get_dokument_store().by_product(produktnummer)
+        source = pages[0].metadata.get("source") if pages else None
+        if source:
+            yield normalize_path(source)
+            yield os.path.join(self.directory, os.path.basename(normalize_path(source)))
+
+    def resolve(self, produktnummer: int):
+        """Pfad des Produktinformationsblatts oder None"""
+        produktnummer = int(produktnummer)
+        path = self._paths.get(produktnummer)
+        if path and os.path.isfile(path):
+            return path
+        path = next((candidate for candidate in self._candidates(produktnummer) if os.path.isfile(candidate)), None)
+        if path:
+            self._paths[produktnummer] = path
+        return path
+
+    def get(self, produktnummer: int):
+        """Liefert das Produktinformationsblatt (Inhalt und ETag) oder None, falls keine Datei gefunden wird"""
+        path = self.resolve(produktnummer)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(int(produktnummer))
+            if entry is not None and entry.path == path and entry.signature == signature:
+                self._entries.move_to_end(entry.produktnummer)
+                self._counter["hits"] += 1
+                return entry
+            self._counter["misses"] += 1
+
+        with open(path, "rb") as pdf_file:
+            data = pdf_file.read()
+        entry = Produktblatt(produktnummer=int(produktnummer), path=path, dateiname=os.path.basename(path), data=data,
+                             etag=hashlib.sha256(data).hexdigest()[:32], signature=signature)
+        # Dateien ueber der Obergrenze werden ausgeliefert, aber nicht gecacht
+        if len(data) <= self.max_bytes:
+            with self._lock:
+                previous = self._entries.pop(entry.produktnummer, None)
+                if previous is not None:
+                    self._bytes -= len(previous.data)
+                self._entries[entry.produktnummer] = entry
+                self._bytes += len(data)
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted.data)
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counter)
+            stats["size"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+            self._entries.clear()
+            self._bytes = 0
+
+
+produktblaetter = ProduktblattStore(max_bytes=int(os.getenv("PRODUKTBLATT_CACHE_MB", "32")) * 1024 * 1024)
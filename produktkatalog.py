@@ -0,0 +1,128 @@
+import bisect
+import csv
+import logging
+import os
+import threading
+import time
+
+import telemetry
+
+# In-Memory-Index des Produktkatalogs (produkteinstufung/ProduktMetadaten.csv). Die Produkte werden beim Start nach
+# (Laufzeit, Risiko, Nachhaltigkeit) gruppiert und je Schluessel nach Mindestanlagebetrag sortiert. Ein Anlageprofil
+# laesst sich so ueber einen Dictionary-Zugriff und eine binaere Suche auf den Betrag aufloesen, ohne Vektordatenbank.
+
+csv_path = "produkteinstufung/ProduktMetadaten.csv"
+
+# Mindestabstand in Sekunden zwischen zwei Pruefungen, ob sich die CSV-Datei geaendert hat
+check_interval = 2.0
+
+
+def _normalize(value) -> str:
+    return str(value).strip().lower()
+
+
+def _map_row(row: dict) -> dict:
+    """Mapper CSV-Zeile auf Produkt (gleiche Schluessel wie die Metadaten in der Vektordatenbank)"""
+    return {
+        "dateiname": row["Dateiname"],
+        "produktname": row["Produktname"],
+        "produktnummer": int(row["Produktnummer"]),
+        "mindestanlagebetrag": int(row["Mindestanlagebetrag"]),
+        "laufzeit": row["Laufzeit"],
+        "kosten": row["Kosten"],
+        "risiko": row["Risiko"],
+        "nachhaltigkeit": row["Nachhaltigkeit"],
+    }
+
+
+class ProduktKatalog:
+    """Index (laufzeit, risiko, nachhaltigkeit) -> nach Mindestanlagebetrag sortierte Produkte"""
+
+    def __init__(self, path: str = csv_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._last_check = 0.0
+        self._geladen = False
+        self._index = {}
+        self._products = {}
+
+    def _load(self):
+        with open(self.path, newline="", encoding="utf-8-sig") as csv_file:
+            products = [_map_row(row) for row in csv.DictReader(csv_file, delimiter=";")]
+
+        index = {}
+        for product in products:
+            key = (_normalize(product["laufzeit"]), _normalize(product["risiko"]),
+                   _normalize(product["nachhaltigkeit"]))
+            index.setdefault(key, []).append(product)
+
+        # Je Schluessel: parallele Listen (Betraege, Produkte), sortiert nach Mindestanlagebetrag. Bei gleichem Betrag
+        # steht die kleinere Produktnummer (numerisch) hinten, damit das letzte passende Produkt eindeutig ist
+        for key, entries in index.items():
+            entries.sort(key=lambda p: p["produktnummer"], reverse=True)
+            entries.sort(key=lambda p: p["mindestanlagebetrag"])
+            index[key] = ([p["mindestanlagebetrag"] for p in entries], entries)
+
+        self._index = index
+        self._products = {product["produktnummer"]: product for product in products}
+
+    def _reload_if_changed(self, force: bool = False):
+        """Liest die CSV-Datei beim ersten Zugriff und nach Aenderungen. Fehlt die Datei, ist der Katalog leer, bis sie
+        angelegt wird"""
+        now = time.monotonic()
+        if self._geladen and not force and now - self._last_check < check_interval:
+            return
+        with self._lock:
+            self._last_check = now
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                signature = None
+            if force or not self._geladen or signature != self._signature:
+                if signature:
+                    self._load()
+                else:
+                    telemetry.log_event("produktkatalog_fehlt", logging.WARNING, path=self.path)
+                    self._index, self._products = {}, {}
+                self._signature = signature
+                self._geladen = True
+
+    def _eligible(self, mindestanlagebetrag: int, laufzeit: str, risiko: str, nachhaltigkeit: str) -> list[dict]:
+        amounts, products = self._index.get((_normalize(laufzeit), _normalize(risiko), _normalize(nachhaltigkeit)),
+                                            ([], []))
+        # Alle Produkte, deren Mindestanlagebetrag kleiner oder gleich dem Anlagebetrag ist
+        return products[:bisect.bisect_right(amounts, mindestanlagebetrag)]
+
+    def candidates(self, mindestanlagebetrag: int, laufzeit: str, risiko: str) -> list[dict]:
+        """Alle passenden Produkte, hoechster passender Mindestanlagebetrag zuerst"""
+        self._reload_if_changed()
+        products = (self._eligible(mindestanlagebetrag, laufzeit, risiko, "ja")
+                    + self._eligible(mindestanlagebetrag, laufzeit, risiko, "nein"))
+        return sorted(products, key=lambda p: (-p["mindestanlagebetrag"], p["produktnummer"]))
+
+    def resolve(self, mindestanlagebetrag: int, laufzeit: str, risiko: str, nachhaltigkeit: str):
+        """Ermittelt das passende Produkt zum Anlageprofil oder None, falls kein Produkt passt"""
+        self._reload_if_changed()
+        # Nachhaltige Produkte werden bevorzugt, falls der Kunde das moechte
+        if _normalize(nachhaltigkeit) == "ja":
+            nachhaltige_produkte = self._eligible(mindestanlagebetrag, laufzeit, risiko, "ja")
+            if nachhaltige_produkte:
+                return nachhaltige_produkte[-1]
+
+        # Ansonsten das Produkt mit dem hoechsten passenden Mindestanlagebetrag
+        products = self.candidates(mindestanlagebetrag, laufzeit, risiko)
+        return products[0] if products else None
+
+    def get(self, produktnummer: int):
+        """Liefert das Produkt zur Produktnummer oder None"""
+        self._reload_if_changed()
+        return self._products.get(int(produktnummer))
+
+    def products(self) -> list[dict]:
+        self._reload_if_changed()
+        return list(self._products.values())
+
+
+katalog = ProduktKatalog()
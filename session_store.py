@@ -0,0 +1,123 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Session-Store fuer den Zustand einer Beratung (empfohlenes Produkt, Produktinformationsblatt, Chat-Historie).
+# Das Backend liest und schreibt den Zustand ausschliesslich ueber die Session-ID und ist damit unabhaengig von
+# Streamlit. Der In-Memory-Store genuegt fuer einen Prozess. Der SQLite-Store wird von mehreren Worker-Prozessen
+# gemeinsam genutzt.
+
+# Maximales Alter einer Session in Sekunden (seit der letzten Aenderung)
+session_ttl = 24 * 3600
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def default_session() -> dict:
+    return {"produktnummer": None, "document_path": "", "empty_product": True, "messages": [], "summary": "",
+            "summary_turns": 0}
+
+
+class InMemorySessionStore:
+    """Session-Store fuer einen einzelnen Prozess"""
+
+    def __init__(self, ttl: float = session_ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def get(self, session_id: str) -> dict:
+        """Liefert eine Kopie des Zustands (Standardwerte fuer unbekannte Sessions)"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return copy.deepcopy(entry[1]) if entry else default_session()
+
+    def update(self, session_id: str, **fields):
+        with self._lock:
+            self._cleanup()
+            session = self._sessions.get(session_id, (0, default_session()))[1]
+            session.update(copy.deepcopy(fields))
+            self._sessions[session_id] = (time.time(), session)
+
+    def append_messages(self, session_id: str, messages: list[dict]):
+        with self._lock:
+            session = self._sessions.get(session_id, (0, default_session()))[1]
+            session["messages"].extend(copy.deepcopy(messages))
+            self._sessions[session_id] = (time.time(), session)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _cleanup(self):
+        grenze = time.time() - self.ttl
+        for session_id in [sid for sid, (updated, _) in self._sessions.items() if updated < grenze]:
+            del self._sessions[session_id]
+
+
+class SQLiteSessionStore:
+    """Session-Store in einer SQLite-Datei, gemeinsam nutzbar von mehreren Worker-Prozessen"""
+
+    def __init__(self, path: str, ttl: float = session_ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sessions "
+                         "(session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    def get(self, session_id: str) -> dict:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else default_session()
+
+    def _modify(self, session_id: str, change):
+        # BEGIN IMMEDIATE sperrt die Datenbank fuer andere Schreiber, sodass Lesen und Schreiben atomar sind
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                session = json.loads(row[0]) if row else default_session()
+                change(session)
+                now = time.time()
+                self._db.execute("INSERT OR REPLACE INTO sessions (session_id, data, updated) VALUES (?, ?, ?)",
+                                 (session_id, json.dumps(session), now))
+                self._db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def update(self, session_id: str, **fields):
+        self._modify(session_id, lambda session: session.update(fields))
+
+    def append_messages(self, session_id: str, messages: list[dict]):
+        self._modify(session_id, lambda session: session["messages"].extend(messages))
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+def create_session_store(url: str = None):
+    """Erstellt den Session-Store aus SESSION_STORE ("memory" oder "sqlite:///pfad/zur/datei.sqlite3")"""
+    url = url or os.getenv("SESSION_STORE", "memory")
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url == "memory":
+        return InMemorySessionStore()
+    raise ValueError(f"Unbekannter Session-Store: {url}")
@@ -0,0 +1,321 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+# Lokale Instrumentierung ohne externen Tracing-Dienst: Kennzahlen im Prometheus-Textformat (Dauer je Node des
+# Graphen, Tokens und Kosten der LLM-Aufrufe, Embedding-Aufrufe, Dauer der Suche, Cache-Treffer) und strukturierte
+# JSON-Logs mit der Session-ID. Die Kennzahlen liefert GET /metrics der HTTP-Schnittstelle bzw. fuer die Oberflaeche
+# ein eigener Port (METRICS_PORT).
+
+# Obergrenzen der Histogramm-Buckets in Sekunden
+_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Preise in USD pro 1 Mio. Tokens (Eingabe, Ausgabe). Modellnamen mit Versionsdatum (z. B. gpt-4o-2024-08-06)
+# werden ueber den laengsten passenden Praefix zugeordnet
+token_preise = {"gpt-4o": (2.50, 10.00), "gpt-4o-mini": (0.15, 0.60), "text-embedding-3-large": (0.13, 0.0)}
+
+_lock = threading.Lock()
+_metrics = []
+_caches = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Counter:
+    """Zaehler je Kombination der Labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Verteilung von Dauern in Sekunden (kumulative Buckets, Summe und Anzahl)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = _buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with _lock:
+            counts, total, observations = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [count + (value <= bound) for count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, observations + 1)
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        samples = []
+        for key, (counts, total, observations) in self._values.items():
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", {**labels, "le": bound}, count))
+            samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, observations))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, observations))
+        return samples
+
+
+node_seconds = Histogram("anlageberater_node_seconds", "Dauer je Node des Graphen", ("node", "status"))
+llm_seconds = Histogram("anlageberater_llm_seconds", "Dauer je LLM-Aufruf", ("model",))
+llm_tokens = Counter("anlageberater_llm_tokens_total", "Tokens der LLM-Aufrufe", ("model", "type"))
+llm_cost = Counter("anlageberater_llm_cost_usd_total", "Geschaetzte Kosten der LLM-Aufrufe in USD", ("model",))
+embedding_calls = Counter("anlageberater_embedding_calls_total", "Aufrufe des Embedding-Modells", ("model",))
+embedding_texts = Counter("anlageberater_embedding_texts_total", "Eingebettete Texte", ("model",))
+embedding_seconds = Histogram("anlageberater_embedding_seconds", "Dauer je Aufruf des Embedding-Modells", ("model",))
+retrieval_seconds = Histogram("anlageberater_retrieval_seconds",
+                              "Dauer der Suche je Stufe (bm25, vector, expand)", ("stage",))
+model_requests = Counter("anlageberater_model_requests_total", "HTTP-Anfragen an den Modellanbieter",
+                         ("endpoint", "status"))
+model_retries = Counter("anlageberater_model_retries_total", "Wiederholte Anfragen an den Modellanbieter",
+                        ("endpoint", "reason"))
+model_hedges = Counter("anlageberater_model_hedges_total",
+                       "Abgesicherte Anfragen (zweite Anfrage nach Verzoegerung) und welche zuerst antwortete",
+                       ("endpoint", "winner"))
+
+
+def register_cache(name: str, stats):
+    """Meldet einen Cache an, dessen stats() (hits, misses) beim Abruf der Kennzahlen gelesen wird"""
+    with _lock:
+        _caches[name] = stats
+
+
+def render() -> str:
+    """Alle Kennzahlen im Textformat von Prometheus"""
+    lines = []
+    with _lock:
+        metrics = [(metric, metric.samples()) for metric in _metrics]
+        caches = dict(_caches)
+    for metric, samples in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{_format_labels(labels)} {value}" for name, labels, value in samples)
+    for result in ("hits", "misses"):
+        name = f"anlageberater_cache_{result}_total"
+        lines.append(f"# HELP {name} {'Treffer' if result == 'hits' else 'Fehlgriffe'} je Cache")
+        lines.append(f"# TYPE {name} counter")
+        for cache, stats in caches.items():
+            lines.append(f"{name}{_format_labels({'cache': cache})} {stats().get(result, 0)}")
+    return "\n".join(lines) + "\n"
+
+
+# Strukturierte Logs: eine JSON-Zeile pro Ereignis mit Zeitstempel, Ereignis, Session-ID und weiteren Feldern
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "event": record.getMessage(),
+                 "session_id": getattr(record, "session_id", None)}
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+logger = logging.getLogger("anlageberater")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+# Session-ID der laufenden Beratung (pro Thread bzw. asyncio-Task)
+_session_id = contextvars.ContextVar("session_id", default=None)
+
+
+def set_session(session_id: str):
+    _session_id.set(session_id)
+
+
+def log_event(event: str, level: int = logging.INFO, session_id: str = None, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"session_id": session_id or _session_id.get(), "fields": fields})
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def _preis(model: str):
+    matches = [name for name in token_preise if model.startswith(name)]
+    return token_preise[max(matches, key=len)] if matches else (0.0, 0.0)
+
+
+def record_llm(model: str, seconds: float, prompt_tokens: int, completion_tokens: int, session_id: str = None):
+    preis_input, preis_output = _preis(model)
+    kosten = (prompt_tokens * preis_input + completion_tokens * preis_output) / 1_000_000
+    llm_seconds.observe(seconds, model=model)
+    llm_tokens.inc(prompt_tokens, model=model, type="prompt")
+    llm_tokens.inc(completion_tokens, model=model, type="completion")
+    llm_cost.inc(kosten, model=model)
+    log_event("llm", session_id=session_id, model=model, seconds=round(seconds, 3), prompt_tokens=prompt_tokens,
+              completion_tokens=completion_tokens, cost_usd=round(kosten, 6))
+
+
+class TelemetryCallback(BaseCallbackHandler):
+    """Callback fuer Graph und LLM: misst die Dauer je Node sowie Dauer und Tokens je LLM-Aufruf"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._starts = {}
+
+    @staticmethod
+    def _session(metadata: dict):
+        return (metadata or {}).get("session_id") or _session_id.get()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # Nur der Lauf des Nodes selbst, nicht die darin aufgerufenen Runnables
+        if node and kwargs.get("name") == node:
+            with self._lock:
+                self._starts[run_id] = (node, time.perf_counter(), self._session(metadata))
+
+    def _finish_node(self, run_id, status: str):
+        with self._lock:
+            start = self._starts.pop(run_id, None)
+        if start:
+            node, begin, session_id = start
+            seconds = time.perf_counter() - begin
+            node_seconds.observe(seconds, node=node, status=status)
+            log_event("node", session_id=session_id, node=node, status=status, seconds=round(seconds, 3))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish_node(run_id, "ok")
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish_node(run_id, "error")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        with self._lock:
+            self._starts[run_id] = ("llm", time.perf_counter(), self._session(metadata))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            start = self._starts.pop(run_id, None)
+        if not start:
+            return
+        _, begin, session_id = start
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        message = getattr(generation, "message", None)
+        usage = getattr(message, "usage_metadata", None) or {}
+        model = (getattr(message, "response_metadata", None) or {}).get("model_name") \
+            or (response.llm_output or {}).get("model_name") or "unbekannt"
+        record_llm(model, time.perf_counter() - begin, usage.get("input_tokens", 0), usage.get("output_tokens", 0),
+                   session_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            start = self._starts.pop(run_id, None)
+        if start:
+            log_event("llm_fehler", logging.WARNING, session_id=start[2], error=repr(error))
+
+
+# Gemeinsamer Callback fuer alle Modelle und Graph-Aufrufe
+callback = TelemetryCallback()
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Misst die Aufrufe des Embedding-Modells. Wird innerhalb des Embedding-Caches verwendet, damit nur die
+    tatsaechlichen Aufrufe beim Anbieter gezaehlt werden"""
+
+    def __init__(self, embeddings: Embeddings, model: str):
+        self.embeddings = embeddings
+        self.model = model
+
+    def _record(self, texts: int, seconds: float):
+        embedding_calls.inc(model=self.model)
+        embedding_texts.inc(texts, model=self.model)
+        embedding_seconds.observe(seconds, model=self.model)
+        log_event("embedding", logging.DEBUG, model=self.model, texts=texts, seconds=round(seconds, 3))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        start = time.perf_counter()
+        vectors = self.embeddings.embed_documents(texts)
+        self._record(len(texts), time.perf_counter() - start)
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        self._record(1, time.perf_counter() - start)
+        return vector
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        start = time.perf_counter()
+        vectors = await self.embeddings.aembed_documents(texts)
+        self._record(len(texts), time.perf_counter() - start)
+        return vectors
+
+    async def aembed_query(self, text: str) -> list[float]:
+        start = time.perf_counter()
+        vector = await self.embeddings.aembed_query(text)
+        self._record(1, time.perf_counter() - start)
+        return vector
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port: int):
+    """Stellt /metrics auf einem eigenen Port bereit (einmal pro Prozess), z. B. fuer die Streamlit-Oberflaeche"""
+    global _server
+    with _lock:
+        if _server is not None:
+            return
+        _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    log_event("metrics_server", port=port)
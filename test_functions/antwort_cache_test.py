@@ -0,0 +1,50 @@
+import argparse
+import json
+import os
+import time
+
+import investmentadvisor_be as backend
+from fragebogen import format_answers
+from session_store import new_session_id
+
+# Trefferquote und eingesparte Latenz des semantischen Antwort-Caches: mehrere Beratungen zum selben Profil stellen
+# typische Produktfragen in leicht abweichenden Formulierungen.
+# Benoetigt OpenAI-Zugang. Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.antwort_cache_test
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+
+fragen = [
+    ["Wie hoch ist die Mindesteinlage?", "Wie hoch ist die Mindestanlage?", "Was ist die Mindesteinlage?"],
+    ["Welche Kosten fallen an?", "Welche Kosten fallen an", "Welche Kosten entstehen?"],
+    ["Wie lange ist die Laufzeit?", "Wie lang ist die Laufzeit?", "Welche Laufzeit hat das Produkt?"],
+    ["Kann ich vorzeitig kuendigen?", "Kann ich vorzeitig kündigen?", "Ist eine vorzeitige Kuendigung moeglich?"],
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=None, help="Aehnlichkeitsschwelle des Caches")
+    args = parser.parse_args()
+    if args.threshold is not None:
+        backend.antwort_cache.threshold = args.threshold
+
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        answers = format_answers(json.load(korpus_file)[0]["answers"])
+
+    for runde in range(len(fragen[0])):
+        session_id = new_session_id()
+        if backend.call_graph(answers, session_id, "pipeline")["empty_product"]:
+            print("Kein Produkt gefunden")
+            return
+        for varianten in fragen:
+            start = time.perf_counter()
+            backend.answer_with_rag(varianten[runde], session_id)
+            print(f"Runde {runde + 1}: {varianten[runde]:<45} {time.perf_counter() - start:.2f} s")
+
+    stats = backend.antwort_cache.stats()
+    print(f"Trefferquote {stats['hit_rate']:.0%} ({stats['hits']} Treffer, {stats['misses']} LLM-Aufrufe), "
+          f"eingesparte Latenz {stats['saved_seconds']:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+# Reproduzierbarer Benchmark fuer Empfehlung und Produktfragen:
+# - Empfehlungsgenauigkeit: Antwortsaetze aus antwort_korpus.json mit erwarteter Produktnummer
+# - Retrieval: Recall@k und Treffer@k fuer die Fragen aus rag_eval.json. Stuetzende Chunks sind die Chunks des
+#   Produkts, die eines der erwarteten Stichworte enthalten
+# - Latenz je Stufe (Metadaten, Produktsuche, Produktvorstellung, Retrieval, Antwort) und Token-Nutzung je Stufe
+# Mit --backend fake (Standard) laufen LLM und Embeddings ueber die deterministischen Stand-ins aus fake_backends.py,
+# die Produktinformationsblaetter werden in ein eigenes Persist-Verzeichnis eingelesen. --backend openai misst mit der
+# bestehenden Vektordatenbank gegen OpenAI (Kalibrierung der simulierten Latenzen).
+# Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.benchmark [--backend openai] [--output ergebnis.json]
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+eval_path = os.path.join(os.path.dirname(__file__), "rag_eval.json")
+
+stufen = ["metadaten", "produkt", "vorstellung", "retrieval", "antwort"]
+
+
+def perzentil(werte: list[float], p: float) -> float:
+    if not werte:
+        return 0.0
+    werte = sorted(werte)
+    return werte[min(int(round(p / 100 * (len(werte) - 1))), len(werte) - 1)]
+
+
+def stuetzend(chunk_text: str, stichworte: list[str]) -> bool:
+    text = chunk_text.lower()
+    return any(stichwort.lower() in text for stichwort in stichworte)
+
+
+class Messung:
+    """Sammelt Dauer und Token-Nutzung je Stufe"""
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self.dauer = {stufe: [] for stufe in stufen}
+        self.tokens = {stufe: {"input_tokens": 0, "output_tokens": 0, "aufrufe": 0} for stufe in stufen}
+
+    def run(self, stufe: str, func, *args):
+        from langchain_core.callbacks import get_usage_metadata_callback
+
+        ausgabe = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        with get_usage_metadata_callback() as callback, ausgabe:
+            start = time.perf_counter()
+            result = func(*args)
+            self.dauer[stufe].append(time.perf_counter() - start)
+        for usage in callback.usage_metadata.values():
+            self.tokens[stufe]["input_tokens"] += usage.get("input_tokens", 0)
+            self.tokens[stufe]["output_tokens"] += usage.get("output_tokens", 0)
+            self.tokens[stufe]["aufrufe"] += 1
+        return result
+
+    def bericht(self) -> dict:
+        return {stufe: {"anzahl": len(self.dauer[stufe]),
+                        "p50_ms": perzentil(self.dauer[stufe], 50) * 1000,
+                        "p95_ms": perzentil(self.dauer[stufe], 95) * 1000,
+                        "mittel_ms": statistics.mean(self.dauer[stufe]) * 1000 if self.dauer[stufe] else 0.0,
+                        **self.tokens[stufe]}
+                for stufe in stufen}
+
+
+def korpus_responder(korpus: list):
+    """Structured Output des Stand-in-LLM aus den erwarteten Feldern des Korpus. Sonst fuellt der Stand-in die
+    unsicheren Felder ueber den regelbasierten Parser, und die Genauigkeit misst nur den Parser gegen sich selbst"""
+    from fake_backends import default_structured_responder
+    from fragebogen import format_answers
+
+    erwartet = {format_answers(eintrag["answers"]): eintrag["expected"] for eintrag in korpus}
+
+    def responder(schema, text: str) -> dict:
+        if text in erwartet:
+            return dict(erwartet[text])
+        return default_structured_responder(schema, text)
+
+    return responder
+
+
+def empfehlungen(backend, korpus: list, messung: Messung) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    from fragebogen import format_answers
+    from session_store import new_session_id
+
+    richtig, fehler = 0, []
+    for eintrag in korpus:
+        session_id = new_session_id()
+        customer_input = format_answers(eintrag["answers"])
+        metadata = messung.run("metadaten", backend.extract_metadata, customer_input)
+        produkt, documents = messung.run("produkt", backend.find_product, metadata)
+        if documents:
+            state = {"messages": [HumanMessage(content=customer_input)], "documents": documents}
+            messung.run("vorstellung", backend.create_pitch, state, backend.llm, session_id)
+        produktnummer = produkt["produktnummer"] if produkt else None
+        if produktnummer == eintrag["produktnummer"]:
+            richtig += 1
+        else:
+            fehler.append({"answers": eintrag["answers"], "erwartet": eintrag["produktnummer"],
+                           "ermittelt": produktnummer})
+    return {"anzahl": len(korpus), "genauigkeit": richtig / len(korpus) if korpus else 0.0, "fehler": fehler}
+
+
+def produktfragen(backend, eval_set: list, ks: list[int], messung: Messung) -> dict:
+    import vectorstore_registry
+    from session_store import new_session_id
+
+    retriever = backend.kontext_retriever
+    vectordb = vectorstore_registry.get_collection(vectorstore_registry.chunks_collection, backend.embeddings)
+    recall = {k: [] for k in ks}
+    treffer = {k: 0 for k in ks}
+    ohne_stuetzende = []
+    for eintrag in eval_set:
+        produktnummer = eintrag["produktnummer"]
+        chunks = vectordb.get(where={"produktnummer": produktnummer}, include=["documents"])
+        erwartet = {chunk_id for chunk_id, text in zip(chunks["ids"], chunks["documents"])
+                    if stuetzend(text, eintrag["stichworte"])}
+        if not erwartet:
+            ohne_stuetzende.append(eintrag["frage"])
+            continue
+
+        # Ranking bis zum groessten k, die Antwort verwendet danach wieder das konfigurierte k
+        k_konfiguriert, retriever.k = retriever.k, max(ks)
+        try:
+            gefunden = messung.run("retrieval", retriever.retrieve_chunks, eintrag["frage"], produktnummer)
+        finally:
+            retriever.k = k_konfiguriert
+        gefunden_ids = [chunk.id for chunk in gefunden]
+        for k in ks:
+            relevant = len(erwartet & set(gefunden_ids[:k]))
+            recall[k].append(relevant / min(len(erwartet), k))
+            treffer[k] += relevant > 0
+
+        session_id = new_session_id()
+        backend.session_store.update(session_id, produktnummer=produktnummer, empty_product=False)
+        messung.run("antwort", backend.answer_with_rag, eintrag["frage"], session_id)
+
+    bewertet = len(eval_set) - len(ohne_stuetzende)
+    return {"anzahl": bewertet,
+            "recall": {k: statistics.mean(werte) if werte else 0.0 for k, werte in recall.items()},
+            "treffer": {k: treffer[k] / bewertet if bewertet else 0.0 for k in ks},
+            "ohne_stuetzende_chunks": ohne_stuetzende}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fuer Empfehlung und Produktfragen")
+    parser.add_argument("--backend", choices=["fake", "openai"], default="fake",
+                        help="fake: deterministische Stand-ins ohne Netzwerk, openai: Kalibrierung gegen OpenAI")
+    parser.add_argument("--path", default="Testdaten", help="Ordner mit den PDF-Dateien (nur --backend fake)")
+    parser.add_argument("--persist-directory", default="./benchmark_db",
+                        help="Persist-Verzeichnis fuer die Ingestion mit --backend fake")
+    parser.add_argument("-k", type=int, nargs="+", default=[1, 3, 5], help="Werte fuer Recall@k")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulierte Latenz pro LLM-Aufruf (fake)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="simulierte Latenz pro Token (fake)")
+    parser.add_argument("--embedding-latency", type=float, default=0.0,
+                        help="simulierte Latenz pro Embedding-Aufruf (fake)")
+    parser.add_argument("--output", help="Ergebnis zusaetzlich als JSON-Datei schreiben")
+    parser.add_argument("--verbose", action="store_true", help="Ausgaben des Backends anzeigen")
+    args = parser.parse_args()
+
+    # Konfiguration des Backends vor dem Import, da Modelle und Persist-Verzeichnis beim Import festgelegt werden
+    if args.backend == "fake":
+        os.environ["MODEL_BACKEND"] = "fake"
+        os.environ["CHROMA_PERSIST_DIRECTORY"] = args.persist_directory
+        os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+        os.environ["FAKE_LLM_TOKEN_LATENCY"] = str(args.token_latency)
+        os.environ["FAKE_EMBEDDING_LATENCY"] = str(args.embedding_latency)
+        # Ohne Embedding-Cache, damit die simulierte Latenz bei jedem Lauf gleich anfaellt
+        os.environ["EMBEDDING_CACHE_DB"] = "off"
+
+    import investmentadvisor_be as backend
+    import product_embedding
+    import telemetry
+
+    if not args.verbose:
+        telemetry.logger.setLevel(logging.WARNING)
+
+    if args.backend == "fake":
+        # Ohne eingelesene PDFs waeren Recall und Antworten leer, das Ergebnis waere nicht vergleichbar
+        if not os.path.isdir(args.path):
+            sys.exit(f"Ordner {args.path} nicht gefunden")
+        with contextlib.redirect_stdout(io.StringIO()):
+            product_embedding.ingest(args.path, embeddings=backend.embeddings)
+        if not product_embedding.load_manifest(args.persist_directory)["files"]:
+            sys.exit(f"Keine PDF-Dateien aus {args.path} indexiert")
+
+    # Ohne Caches fuer Metadaten und Antworten, sonst messen Wiederholungen nur Cache-Treffer
+    backend.metadaten_cache.clear()
+    backend.antwort_cache.clear()
+    backend.antwort_cache.threshold = 2.0
+
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        korpus = json.load(korpus_file)
+    with open(eval_path, encoding="utf-8") as eval_file:
+        eval_set = json.load(eval_file)
+    if args.backend == "fake":
+        backend.get_llm().structured_responder = korpus_responder(korpus)
+
+    messung = Messung(args.verbose)
+    ergebnis = {"backend": args.backend,
+                "empfehlung": empfehlungen(backend, korpus, messung),
+                "produktfragen": produktfragen(backend, eval_set, args.k, messung)}
+    ergebnis["stufen"] = messung.bericht()
+
+    empfehlung = ergebnis["empfehlung"]
+    print(f"\nEmpfehlung: {empfehlung['anzahl']} Antwortsaetze, Genauigkeit {empfehlung['genauigkeit']:.1%}")
+    if args.backend == "fake":
+        print("  Stand-in-LLM: unsichere Felder erhalten die erwarteten Werte aus dem Korpus. Gemessen werden die "
+              "sicher erkannten Felder des Parsers und die Produktauswahl, nicht die Extraktion durch ein LLM")
+    for fehler in empfehlung["fehler"]:
+        print(f"  {fehler['answers']}: erwartet {fehler['erwartet']}, ermittelt {fehler['ermittelt']}")
+
+    fragen = ergebnis["produktfragen"]
+    print(f"\nProduktfragen: {fragen['anzahl']} Fragen mit stuetzenden Chunks")
+    for k in args.k:
+        print(f"  Recall@{k:<3} {fragen['recall'][k]:.1%}   Treffer@{k:<3} {fragen['treffer'][k]:.1%}")
+    if fragen["ohne_stuetzende_chunks"]:
+        print(f"  {len(fragen['ohne_stuetzende_chunks'])} Fragen ohne stuetzende Chunks im Bestand (nicht bewertet)")
+
+    print(f"\n{'Stufe':<12} {'Anzahl':>7} {'p50':>10} {'p95':>10} {'Aufrufe':>8} {'Input-Tokens':>13} "
+          f"{'Output-Tokens':>14}")
+    for stufe, werte in ergebnis["stufen"].items():
+        print(f"{stufe:<12} {werte['anzahl']:>7} {werte['p50_ms']:>8.1f}ms {werte['p95_ms']:>8.1f}ms "
+              f"{werte['aufrufe']:>8} {werte['input_tokens']:>13} {werte['output_tokens']:>14}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(ergebnis, output_file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
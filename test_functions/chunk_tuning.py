@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from langchain_chroma import Chroma
+
+import model_provider
+import product_embedding as ingestion
+import vectorstore_registry
+from bm25_index import BM25Index, build_index, save_index
+from embedding_cache import cached_embeddings
+from fake_backends import HashEmbeddings
+from kontext_retriever import KontextRetriever
+
+# Tuning der Chunk-Groesse: Fuer jede Kombination aus Chunk-Groesse und Ueberlappung werden die Seiten aus dem
+# Docstore gesplittet und in eine temporaere Collection eingebettet. Bewertet wird mit dem Evaluationsset, ob der
+# Kontext (nach Erweiterung auf die Seiten) bzw. die gefundenen Chunks die erwarteten Stichworte enthalten, jeweils fuer
+# die reine Vektorsuche und die hybride Suche (BM25 und Vektorsuche).
+# Setzt eine vorherige Ingestion voraus (python product_embedding.py). Dank Embedding-Cache sind Wiederholungen guenstig.
+# Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.chunk_tuning
+
+eval_path = os.path.join(os.path.dirname(__file__), "rag_eval.json")
+
+kombinationen = [(150, 50), (300, 50), (500, 100), (800, 100), (1200, 200)]
+
+
+def treffer(documents, stichworte) -> bool:
+    text = " ".join(doc.page_content for doc in documents).lower()
+    return any(stichwort.lower() in text for stichwort in stichworte)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", type=int, default=6, help="Anzahl gesuchter Chunks")
+    parser.add_argument("--max-tokens", type=int, default=2000, help="Token-Budget fuer den Kontext")
+    parser.add_argument("--fake-embeddings", action="store_true", help="lokale Stand-in-Embeddings statt OpenAI")
+    args = parser.parse_args()
+
+    with open(eval_path, encoding="utf-8") as eval_file:
+        eval_set = json.load(eval_file)
+
+    if args.fake_embeddings:
+        embeddings = cached_embeddings(HashEmbeddings(), "hash-embeddings")
+    else:
+        embeddings = cached_embeddings(model_provider.embeddings(ingestion.embedding_model),
+                                       model_provider.embedding_cache_name(ingestion.embedding_model))
+
+    dokument_store = vectorstore_registry.get_dokument_store()
+    pages = [page for produktnummer in dokument_store.products() for page in dokument_store.by_product(produktnummer)]
+    page_ids = [page.id for page in pages]
+
+    print(f"{'Chunk':>6} {'Overlap':>8} {'Chunks':>7} {'Recall Chunks':>14} {'Recall Kontext':>15} "
+          f"{'Recall hybrid':>14} {'Kontext-Tokens':>15} {'Suche':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size, overlap in kombinationen:
+            ingestion.chunk_size, ingestion.chunk_overlap = size, overlap
+            chunks = ingestion.split_pages(pages, page_ids)
+            vectordb = Chroma(collection_name=f"tuning_{size}_{overlap}", embedding_function=embeddings,
+                              persist_directory=directory)
+            chunk_ids = ingestion.stable_ids(chunks)
+            vectordb.add_documents(chunks, ids=chunk_ids)
+            index_directory = os.path.join(directory, f"bm25_{size}_{overlap}")
+            os.makedirs(index_directory)
+            save_index(index_directory, build_index(chunk_ids, [chunk.page_content for chunk in chunks],
+                                                    [chunk.metadata for chunk in chunks]))
+            retriever = KontextRetriever(embeddings, "gpt-4o", k=args.k, max_tokens=args.max_tokens,
+                                         vectordb=vectordb, bm25=BM25Index(index_directory))
+
+            chunk_treffer, kontext_treffer, hybrid_treffer, tokens, dauer = 0, 0, 0, [], []
+            for eintrag in eval_set:
+                start = time.perf_counter()
+                gefunden = vectordb.similarity_search(eintrag["frage"], k=args.k,
+                                                      filter={"produktnummer": eintrag["produktnummer"]})
+                kontext = retriever.expand(gefunden)
+                dauer.append(time.perf_counter() - start)
+                chunk_treffer += treffer(gefunden, eintrag["stichworte"])
+                kontext_treffer += treffer(kontext, eintrag["stichworte"])
+                tokens.append(sum(retriever._tokens(doc) for doc in kontext))
+                hybrid_treffer += treffer(retriever.search(eintrag["frage"], eintrag["produktnummer"]),
+                                          eintrag["stichworte"])
+
+            print(f"{size:>6} {overlap:>8} {len(chunks):>7} {chunk_treffer / len(eval_set):>14.0%} "
+                  f"{kontext_treffer / len(eval_set):>15.0%} {hybrid_treffer / len(eval_set):>14.0%} "
+                  f"{statistics.mean(tokens):>15.0f} "
+                  f"{statistics.median(dauer) * 1000:>6.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
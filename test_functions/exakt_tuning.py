@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+
+from bm25_index import BM25Index
+from kontext_retriever import KontextRetriever
+
+# Abstimmung der Schwelle fuer Fachbegriffe (exact_max_df bzw. RAG_EXACT_MAX_DF): Fuer jede Schwelle wird mit dem
+# Evaluationsset geprueft, welche Fragen als exakt gelten und damit nur die BM25-Suche verwenden. Fragen mit
+# "exakt": true sollen erkannt werden, bei den uebrigen Fragen darf die BM25-Suche allein die erwarteten Stichworte
+# nicht verfehlen. Benoetigt nur den BM25-Index einer vorherigen Ingestion, keine Embeddings.
+# Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.exakt_tuning --persist-directory ./benchmark_db
+
+eval_path = os.path.join(os.path.dirname(__file__), "rag_eval.json")
+schwellen = [0.02, 0.05, 0.08, 0.1, 0.12, 0.15, 0.2]
+
+
+def treffer(documents, stichworte) -> bool:
+    text = " ".join(doc.page_content for doc in documents).lower()
+    return any(stichwort.lower() in text for stichwort in stichworte)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Abstimmung der Schwelle fuer Fachbegriffe der BM25-Suche")
+    parser.add_argument("--persist-directory", default=os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_langchain_db"),
+                        help="Persist-Verzeichnis mit dem BM25-Index")
+    parser.add_argument("-k", type=int, default=6, help="Anzahl gesuchter Chunks")
+    args = parser.parse_args()
+
+    with open(eval_path, encoding="utf-8") as eval_file:
+        eval_set = json.load(eval_file)
+    exakte = [eintrag for eintrag in eval_set if eintrag.get("exakt")]
+    uebrige = [eintrag for eintrag in eval_set if not eintrag.get("exakt")]
+    bm25 = BM25Index(args.persist_directory)
+
+    print(f"{len(exakte)} exakte und {len(uebrige)} uebrige Fragen")
+    print(f"{'Schwelle':>9} {'exakt erkannt':>14} {'davon Treffer':>14} {'uebrige exakt':>14} {'davon verfehlt':>15}")
+    for schwelle in schwellen:
+        retriever = KontextRetriever(None, "gpt-4o", k=args.k, bm25=bm25, exact_max_df=schwelle)
+        erkannt, erkannt_treffer, uebrige_exakt, verfehlt = 0, 0, 0, 0
+        for eintrag in eval_set:
+            chunks, exakt = retriever.lexical(eintrag["frage"], eintrag["produktnummer"])
+            if not exakt:
+                continue
+            if eintrag.get("exakt"):
+                erkannt += 1
+                erkannt_treffer += treffer(chunks, eintrag["stichworte"])
+            else:
+                uebrige_exakt += 1
+                verfehlt += not treffer(chunks, eintrag["stichworte"])
+        print(f"{schwelle:>9} {erkannt:>8}/{len(exakte):<5} {erkannt_treffer:>14} {uebrige_exakt:>8}/{len(uebrige):<5} "
+              f"{verfehlt:>15}")
+
+
+if __name__ == "__main__":
+    main()
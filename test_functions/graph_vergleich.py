@@ -0,0 +1,93 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+from fragebogen import format_answers
+from session_store import new_session_id
+
+# Vergleich der beiden Graph-Modi (agent: Tool-Routing ueber das LLM, pipeline: direkte Extraktion und Suche) nach
+# Latenz, gefundenen Produkten und Produktvorstellung. Beide Modi stellen das Produkt mit demselben Modell und
+# denselben Nachrichten vor, Unterschiede entstehen nur durch Routing und Extraktion.
+# Standard ist --backend fake (deterministische Stand-ins, simulierte Latenz ueber --llm-latency), --backend openai
+# misst gegen OpenAI mit der bestehenden Vektordatenbank. Ausfuehrung aus dem Projektverzeichnis:
+#   python -m test_functions.graph_vergleich --llm-latency 0.5 --token-latency 0.01
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+
+
+def run(backend, mode: str, answers: str):
+    session_id = new_session_id()
+    inputs = backend._start_recommendation(answers, session_id)
+    start = time.perf_counter()
+    state = backend.get_graph(mode).invoke(inputs, backend.session_config(session_id))
+    dauer = time.perf_counter() - start
+    produktnummern = sorted({doc.metadata.get("produktnummer") for doc in state.get("documents", [])})
+    return {"dauer": dauer, "produktnummern": produktnummern, "vorstellung": state["messages"][-1].content}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vergleich der Graph-Modi agent und pipeline")
+    parser.add_argument("-n", type=int, default=None, help="Anzahl Antwortsaetze aus dem Korpus (Standard alle)")
+    parser.add_argument("--backend", choices=["fake", "openai"], default="fake")
+    parser.add_argument("--path", default="Testdaten", help="Ordner mit den PDF-Dateien (nur --backend fake)")
+    parser.add_argument("--persist-directory", default="./benchmark_db",
+                        help="Persist-Verzeichnis fuer die Ingestion mit --backend fake")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulierte Latenz pro LLM-Aufruf (fake)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="simulierte Latenz pro Token (fake)")
+    args = parser.parse_args()
+
+    # Konfiguration des Backends vor dem Import (siehe benchmark.py). Ohne Metadaten-Cache, damit beide Modi
+    # die Extraktion ausfuehren
+    if args.backend == "fake":
+        os.environ["MODEL_BACKEND"] = "fake"
+        os.environ["CHROMA_PERSIST_DIRECTORY"] = args.persist_directory
+        os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+        os.environ["FAKE_LLM_TOKEN_LATENCY"] = str(args.token_latency)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import investmentadvisor_be as backend
+    import product_embedding
+    import telemetry
+
+    telemetry.logger.setLevel(logging.WARNING)
+    if args.backend == "fake":
+        if not os.path.isdir(args.path):
+            sys.exit(f"Ordner {args.path} nicht gefunden")
+        with contextlib.redirect_stdout(io.StringIO()):
+            product_embedding.ingest(args.path, embeddings=backend.embeddings)
+
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        korpus = json.load(korpus_file)[:args.n]
+
+    ergebnisse = {mode: [] for mode in backend.get_graphs()}
+    for eintrag in korpus:
+        answers = format_answers(eintrag["answers"])
+        for mode in ergebnisse:
+            backend.metadaten_cache.clear()
+            ergebnisse[mode].append(run(backend, mode, answers))
+
+    print(f"{len(korpus)} Antwortsaetze, Backend {args.backend}, LLM-Latenz {args.llm_latency}s "
+          f"+ {args.token_latency}s/Token")
+    for mode, werte in ergebnisse.items():
+        dauer = [wert["dauer"] for wert in werte]
+        print(f"{mode:<10} Mittelwert {statistics.mean(dauer):.3f} s, Median {statistics.median(dauer):.3f} s, "
+              f"Max {max(dauer):.3f} s")
+
+    paare = list(zip(ergebnisse["agent"], ergebnisse["pipeline"]))
+    gleiche_produkte = sum(1 for a, b in paare if a["produktnummern"] == b["produktnummern"])
+    gleiche_vorstellung = sum(1 for a, b in paare if a["vorstellung"] == b["vorstellung"])
+    print(f"Gleiche Produkte in beiden Modi: {gleiche_produkte}/{len(paare)}")
+    print(f"Gleiche Produktvorstellung in beiden Modi: {gleiche_vorstellung}/{len(paare)}")
+    for eintrag, (a, b) in zip(korpus, paare):
+        if a["produktnummern"] != b["produktnummern"]:
+            print(f"  {eintrag['answers']}: agent {a['produktnummern']}, pipeline {b['produktnummern']}")
+
+
+if __name__ == "__main__":
+    main()
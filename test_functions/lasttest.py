@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from test_functions.benchmark import perzentil
+
+# Lasttest mit simulierten Beratungen: Jede Sitzung spielt den Ablauf der Oberflaeche nach (fuenf Antworten, dann die
+# Produktempfehlung per stream_graph, danach Fragen zum Produkt per stream_with_rag). LLM und Embeddings laufen ueber
+# den OpenAI-kompatiblen Mock-Server (mock_openai.py) mit einstellbarer Latenz, der als eigener Prozess
+# gestartet wird. Gemessen werden p50/p95/p99 je Stufe (inkl. erstes Token), Durchsatz und Fehlerquote.
+# Mit --stufen wird die Anzahl gleichzeitiger Sitzungen schrittweise erhoeht, bis der Durchsatz nicht mehr steigt, die
+# Fehlerquote oder p95 der Sitzung die Grenzen ueberschreitet (Saettigungspunkt).
+# Ausfuehrung aus dem Projektverzeichnis:
+#   python -m test_functions.lasttest --sessions 40 --concurrency 8 --latency 0.8 --token-latency 0.02
+#   python -m test_functions.lasttest --stufen 1 2 4 8 16 32 --api async
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+eval_path = os.path.join(os.path.dirname(__file__), "rag_eval.json")
+
+# Fragen fuer Produkte ohne Eintrag im Evaluationsset
+standard_fragen = ["Welche Kosten fallen an?", "Wie lange ist die Laufzeit?", "Welche Risiken gibt es?"]
+
+stufen_namen = ["warteschlange", "empfehlung_erstes_token", "empfehlung", "frage_erstes_token", "frage", "sitzung"]
+
+
+class Ergebnis:
+    """Dauer und Fehler je Stufe eines Laufs (thread-sicher)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.dauer = {stufe: [] for stufe in stufen_namen}
+        self.fehler = {stufe: 0 for stufe in stufen_namen}
+        self.fehlermeldungen = {}
+
+    def messen(self, stufe: str, sekunden: float):
+        with self._lock:
+            self.dauer[stufe].append(sekunden)
+
+    def fehlschlag(self, stufe: str, error: Exception):
+        with self._lock:
+            self.fehler[stufe] += 1
+            meldung = f"{type(error).__name__}: {error}"[:200]
+            self.fehlermeldungen[meldung] = self.fehlermeldungen.get(meldung, 0) + 1
+
+    def bericht(self, sitzungen: int, gesamt: float) -> dict:
+        erfolgreich = len(self.dauer["sitzung"])
+        return {"sitzungen": sitzungen, "erfolgreich": erfolgreich, "dauer_s": gesamt,
+                "durchsatz": erfolgreich / gesamt if gesamt else 0.0,
+                "fehlerquote": (sitzungen - erfolgreich) / sitzungen if sitzungen else 0.0,
+                "stufen": {stufe: {"anzahl": len(werte), "fehler": self.fehler[stufe],
+                                   "p50": perzentil(werte, 50), "p95": perzentil(werte, 95),
+                                   "p99": perzentil(werte, 99)}
+                           for stufe, werte in self.dauer.items() if werte or self.fehler[stufe]},
+                "fehlermeldungen": self.fehlermeldungen}
+
+
+def sitzung(backend, skript: dict, ergebnis: Ergebnis, args):
+    """Eine Beratung wie in der Oberflaeche (synchrones Backend, ein Thread pro Sitzung)"""
+    from session_store import new_session_id
+
+    session_id = new_session_id()
+    start = time.perf_counter()
+    stufe = "empfehlung"
+    try:
+        erstes = None
+        for art, _ in backend.stream_graph(skript["answers"], session_id, args.mode):
+            if art == "token" and erstes is None:
+                erstes = time.perf_counter()
+        ergebnis.messen("empfehlung", time.perf_counter() - start)
+        if erstes:
+            ergebnis.messen("empfehlung_erstes_token", erstes - start)
+
+        session = backend.session_store.get(session_id)
+        if not session["empty_product"]:
+            stufe = "frage"
+            for frage in skript["fragen"].get(session["produktnummer"], standard_fragen)[:args.questions]:
+                time.sleep(args.think)
+                frage_start, erstes = time.perf_counter(), None
+                for _ in backend.stream_with_rag(frage, session_id):
+                    erstes = erstes or time.perf_counter()
+                ergebnis.messen("frage", time.perf_counter() - frage_start)
+                if erstes:
+                    ergebnis.messen("frage_erstes_token", erstes - frage_start)
+        ergebnis.messen("sitzung", time.perf_counter() - start)
+    except Exception as error:
+        ergebnis.fehlschlag(stufe, error)
+    finally:
+        backend.session_store.delete(session_id)
+
+
+async def asitzung(backend, skript: dict, ergebnis: Ergebnis, args):
+    """Eine Beratung ueber das asynchrone Backend (wie die HTTP-Schnittstelle)"""
+    from session_store import new_session_id
+
+    session_id = new_session_id()
+    start = time.perf_counter()
+    stufe = "empfehlung"
+    try:
+        erstes = None
+        async for art, _ in backend.astream_graph(skript["answers"], session_id, args.mode):
+            if art == "token" and erstes is None:
+                erstes = time.perf_counter()
+        ergebnis.messen("empfehlung", time.perf_counter() - start)
+        if erstes:
+            ergebnis.messen("empfehlung_erstes_token", erstes - start)
+
+        session = backend.session_store.get(session_id)
+        if not session["empty_product"]:
+            stufe = "frage"
+            for frage in skript["fragen"].get(session["produktnummer"], standard_fragen)[:args.questions]:
+                await asyncio.sleep(args.think)
+                frage_start, erstes = time.perf_counter(), None
+                async for _ in backend.astream_with_rag(frage, session_id):
+                    erstes = erstes or time.perf_counter()
+                ergebnis.messen("frage", time.perf_counter() - frage_start)
+                if erstes:
+                    ergebnis.messen("frage_erstes_token", erstes - frage_start)
+        ergebnis.messen("sitzung", time.perf_counter() - start)
+    except Exception as error:
+        ergebnis.fehlschlag(stufe, error)
+    finally:
+        backend.session_store.delete(session_id)
+
+
+def ankuenfte(anzahl: int, rate: float, seed: int) -> list[float]:
+    """Ankunftszeitpunkte in Sekunden ab Start: Poisson-Prozess mit der Rate, 0 = alle Sitzungen sofort"""
+    generator = random.Random(seed)
+    zeitpunkt, zeitpunkte = 0.0, []
+    for _ in range(anzahl):
+        zeitpunkte.append(zeitpunkt)
+        if rate > 0:
+            zeitpunkt += generator.expovariate(rate)
+    return zeitpunkte
+
+
+def lauf_sync(backend, skripte: list, concurrency: int, args) -> dict:
+    ergebnis = Ergebnis()
+    start = time.perf_counter()
+
+    def gestartet(skript: dict, ankunft: float):
+        if args.rate > 0:
+            ergebnis.messen("warteschlange", time.perf_counter() - start - ankunft)
+        sitzung(backend, skript, ergebnis, args)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for skript, ankunft in zip(skripte, ankuenfte(len(skripte), args.rate, args.seed)):
+            time.sleep(max(ankunft - (time.perf_counter() - start), 0.0))
+            executor.submit(gestartet, skript, ankunft)
+    return ergebnis.bericht(len(skripte), time.perf_counter() - start)
+
+
+async def lauf_async(backend, skripte: list, concurrency: int, args) -> dict:
+    ergebnis = Ergebnis()
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def gestartet(skript: dict, ankunft: float):
+        async with semaphore:
+            if args.rate > 0:
+                ergebnis.messen("warteschlange", time.perf_counter() - start - ankunft)
+            await asitzung(backend, skript, ergebnis, args)
+
+    tasks = []
+    for skript, ankunft in zip(skripte, ankuenfte(len(skripte), args.rate, args.seed)):
+        await asyncio.sleep(max(ankunft - (time.perf_counter() - start), 0.0))
+        tasks.append(asyncio.create_task(gestartet(skript, ankunft)))
+    await asyncio.gather(*tasks)
+    return ergebnis.bericht(len(skripte), time.perf_counter() - start)
+
+
+def skripte_laden(anzahl: int) -> list[dict]:
+    from fragebogen import format_answers
+
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        korpus = json.load(korpus_file)
+    with open(eval_path, encoding="utf-8") as eval_file:
+        eval_set = json.load(eval_file)
+    fragen = {}
+    for eintrag in eval_set:
+        fragen.setdefault(eintrag["produktnummer"], []).append(eintrag["frage"])
+    return [{"answers": format_answers(korpus[i % len(korpus)]["answers"]), "fragen": fragen} for i in range(anzahl)]
+
+
+def mock_starten(args) -> subprocess.Popen:
+    """Startet den Mock-Server als eigenen Prozess, damit er nicht um den GIL des Backends konkurriert"""
+    prozess = subprocess.Popen([sys.executable, "-m", "mock_openai", "--port", str(args.mock_port),
+                                "--latency", str(args.latency), "--token-latency", str(args.token_latency),
+                                "--embedding-latency", str(args.embedding_latency),
+                                "--error-rate", str(args.error_rate),
+                                "--max-concurrency", str(args.mock_max_concurrency)],
+                               stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.mock_port}/v1/models", timeout=0.2)
+            return prozess
+        except OSError:
+            time.sleep(0.1)
+    prozess.terminate()
+    raise RuntimeError("Mock-Server nicht erreichbar")
+
+
+def ausgabe(concurrency: int, bericht: dict):
+    stufen = bericht["stufen"]
+
+    def wert(stufe: str, p: str) -> str:
+        return f"{stufen[stufe][p]:>7.2f}s" if stufe in stufen else f"{'-':>8}"
+
+    print(f"{concurrency:>5} {bericht['sitzungen']:>9} {bericht['durchsatz']:>10.2f}/s {bericht['fehlerquote']:>8.1%} "
+          f"{wert('empfehlung', 'p50')} {wert('empfehlung', 'p95')} {wert('empfehlung', 'p99')} "
+          f"{wert('frage', 'p50')} {wert('frage', 'p95')} {wert('frage', 'p99')} {wert('sitzung', 'p95')}")
+
+
+def details(bericht: dict):
+    print(f"\n{'Stufe':<24} {'Anzahl':>7} {'Fehler':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for stufe, werte in bericht["stufen"].items():
+        print(f"{stufe:<24} {werte['anzahl']:>7} {werte['fehler']:>7} {werte['p50']:>7.2f}s {werte['p95']:>7.2f}s "
+              f"{werte['p99']:>7.2f}s")
+    for meldung, anzahl in bericht["fehlermeldungen"].items():
+        print(f"  {anzahl}x {meldung}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lasttest mit simulierten Beratungen")
+    parser.add_argument("--sessions", type=int, default=40, help="Anzahl Sitzungen (je Stufe)")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximale Anzahl gleichzeitiger Sitzungen")
+    parser.add_argument("--stufen", type=int, nargs="+",
+                        help="Saettigungssuche: Anzahl gleichzeitiger Sitzungen je Stufe, z. B. 1 2 4 8 16 32")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Ankuenfte pro Sekunde (Poisson), 0 = alle Sitzungen sofort (geschlossene Schleife)")
+    parser.add_argument("--questions", type=int, default=2, help="Fragen zum Produkt pro Sitzung")
+    parser.add_argument("--think", type=float, default=0.0, help="Bedenkzeit vor jeder Frage in Sekunden")
+    parser.add_argument("--api", choices=["sync", "async"], default="sync",
+                        help="sync: Threads wie die Streamlit-Oberflaeche, async: Event-Loop wie die HTTP-Schnittstelle")
+    parser.add_argument("--mode", default=None, help="Graph-Modus (agent oder pipeline, Standard GRAPH_MODE)")
+    parser.add_argument("--base-url", help="bestehenden OpenAI-kompatiblen Endpunkt verwenden statt Mock-Server")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.8, help="Mock: Latenz pro Chat-Aufruf in Sekunden")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="Mock: Latenz pro Token in Sekunden")
+    parser.add_argument("--embedding-latency", type=float, default=0.1, help="Mock: Latenz pro Embedding-Aufruf")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock: Anteil simulierter Serverfehler")
+    parser.add_argument("--mock-max-concurrency", type=int, default=0,
+                        help="Mock: maximale Anzahl gleichzeitiger Anfragen, darueber 429 (Rate-Limit)")
+    parser.add_argument("--path", default="Testdaten", help="Ordner mit den PDF-Dateien fuer die Ingestion")
+    parser.add_argument("--persist-directory", default="./lasttest_db")
+    parser.add_argument("--slo", type=float, default=30.0, help="Grenze fuer p95 der Sitzung in Sekunden")
+    parser.add_argument("--max-errors", type=float, default=0.01, help="Grenze fuer die Fehlerquote")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Ergebnis zusaetzlich als JSON-Datei schreiben")
+    args = parser.parse_args()
+
+    mock = None
+    if args.base_url is None:
+        mock = mock_starten(args)
+        args.base_url = f"http://127.0.0.1:{args.mock_port}/v1"
+
+    # Konfiguration des Backends vor dem Import. Antwort-Cache aus, damit jede Frage Retrieval und LLM durchlaeuft
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ["CHROMA_PERSIST_DIRECTORY"] = args.persist_directory
+    os.environ["ANSWER_CACHE_THRESHOLD"] = "2"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    try:
+        import investmentadvisor_be as backend
+        import product_embedding
+
+        if os.path.isdir(args.path):
+            with contextlib.redirect_stdout(io.StringIO()):
+                product_embedding.ingest(args.path, embeddings=backend.embeddings)
+        else:
+            print(f"Ordner {args.path} nicht gefunden, verwendet wird der bestehende Bestand in {args.persist_directory}")
+
+        stufen = args.stufen or [args.concurrency]
+        print(f"API {args.api}, Mock-Latenz {args.latency}s + {args.token_latency}s/Token, Rate "
+              f"{args.rate or 'geschlossen'}")
+        print(f"{'Gleichz.':>5} {'Sitzungen':>9} {'Durchsatz':>12} {'Fehler':>8} {'Empf. p50':>8} {'p95':>8} "
+              f"{'p99':>8} {'Frage p50':>8} {'p95':>8} {'p99':>8} {'Sitz. p95':>8}")
+        berichte, bester, saettigung = {}, 0.0, None
+        for concurrency in stufen:
+            backend.metadaten_cache.clear()
+            skripte = skripte_laden(max(args.sessions, 2 * concurrency))
+            if args.api == "async":
+                bericht = asyncio.run(lauf_async(backend, skripte, concurrency, args))
+            else:
+                bericht = lauf_sync(backend, skripte, concurrency, args)
+            berichte[concurrency] = bericht
+            ausgabe(concurrency, bericht)
+
+            sitzung_p95 = bericht["stufen"].get("sitzung", {}).get("p95", 0.0)
+            if len(stufen) > 1 and (bericht["durchsatz"] < 1.1 * bester or bericht["fehlerquote"] > args.max_errors
+                                    or sitzung_p95 > args.slo):
+                saettigung = concurrency
+                break
+            bester = max(bester, bericht["durchsatz"])
+
+        details(berichte[concurrency])
+        if len(stufen) > 1:
+            if saettigung is None:
+                print(f"\nKeine Saettigung bis {stufen[-1]} gleichzeitigen Sitzungen")
+            else:
+                vorher = stufen[stufen.index(saettigung) - 1] if stufen.index(saettigung) else None
+                print(f"\nSaettigung bei {saettigung} gleichzeitigen Sitzungen (Durchsatz steigt um weniger als 10 %, "
+                      f"Fehlerquote oder p95 ueber der Grenze). Tragfaehig: {vorher} gleichzeitige Sitzungen, "
+                      f"{bester:.2f} Sitzungen/s")
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output_file:
+                json.dump({"args": vars(args), "stufen": berichte, "saettigung": saettigung}, output_file,
+                          ensure_ascii=False, indent=2)
+    finally:
+        if mock is not None:
+            mock.terminate()
+
+
+if __name__ == "__main__":
+    main()
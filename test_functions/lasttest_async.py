@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fragebogen import format_answers
+from session_store import new_session_id
+
+# Lasttest: Wie viele Beratungen (Empfehlung + eine Produktfrage) schafft ein Prozess gleichzeitig?
+# Vergleich des synchronen Backends (ein Thread pro Beratung) mit dem asynchronen Backend (ein Event-Loop). Der
+# Antwort-Cache ist aus und vor jedem Lauf werden die Caches geleert, damit kein Lauf von dem anderen profitiert.
+# Standard ist --backend fake (Stand-ins mit simulierter Latenz), --backend openai misst gegen OpenAI.
+# Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.lasttest_async -n 20
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+frage = "Welche Kosten fallen an?"
+backend = None
+
+
+def beratung(answers: str) -> float:
+    session_id = new_session_id()
+    start = time.perf_counter()
+    if backend.call_graph(answers, session_id, "pipeline")["empty_product"] is False:
+        backend.answer_with_rag(frage, session_id)
+    return time.perf_counter() - start
+
+
+async def abratung(answers: str) -> float:
+    session_id = new_session_id()
+    start = time.perf_counter()
+    if (await backend.acall_graph(answers, session_id, "pipeline"))["empty_product"] is False:
+        await backend.aanswer_with_rag(frage, session_id)
+    return time.perf_counter() - start
+
+
+def ausgabe(name: str, dauer: list, gesamt: float):
+    print(f"{name:<6} {len(dauer)} Beratungen in {gesamt:.1f} s ({len(dauer) / gesamt:.2f} Beratungen/s), "
+          f"Median {statistics.median(dauer):.2f} s, Max {max(dauer):.2f} s")
+
+
+async def async_lauf(inputs: list[str]):
+    return await asyncio.gather(*[abratung(answers) for answers in inputs])
+
+
+def caches_leeren():
+    backend.metadaten_cache.clear()
+    backend.antwort_cache.clear()
+
+
+def main():
+    global backend
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20, help="Anzahl gleichzeitiger Beratungen")
+    parser.add_argument("--threads", type=int, default=8, help="Thread-Pool-Groesse fuer das synchrone Backend")
+    parser.add_argument("--backend", choices=["fake", "openai"], default="fake")
+    parser.add_argument("--path", default="Testdaten", help="Ordner mit den PDF-Dateien (nur --backend fake)")
+    parser.add_argument("--persist-directory", default="./benchmark_db",
+                        help="Persist-Verzeichnis fuer die Ingestion mit --backend fake")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="simulierte Latenz pro LLM-Aufruf (fake)")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="simulierte Latenz pro Token (fake)")
+    parser.add_argument("--embedding-latency", type=float, default=0.1,
+                        help="simulierte Latenz pro Embedding-Aufruf (fake)")
+    args = parser.parse_args()
+
+    # Konfiguration des Backends vor dem Import (siehe benchmark.py)
+    if args.backend == "fake":
+        os.environ["MODEL_BACKEND"] = "fake"
+        os.environ["CHROMA_PERSIST_DIRECTORY"] = args.persist_directory
+        os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+        os.environ["FAKE_LLM_TOKEN_LATENCY"] = str(args.token_latency)
+        os.environ["FAKE_EMBEDDING_LATENCY"] = str(args.embedding_latency)
+        os.environ["EMBEDDING_CACHE_DB"] = "off"
+    # Antwort-Cache aus, damit jede Frage Retrieval und LLM durchlaeuft (siehe lasttest.py)
+    os.environ["ANSWER_CACHE_THRESHOLD"] = "2"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import investmentadvisor_be
+    import product_embedding
+    import telemetry
+
+    backend = investmentadvisor_be
+    telemetry.logger.setLevel(logging.WARNING)
+    if args.backend == "fake":
+        if not os.path.isdir(args.path):
+            sys.exit(f"Ordner {args.path} nicht gefunden")
+        with contextlib.redirect_stdout(io.StringIO()):
+            product_embedding.ingest(args.path, embeddings=backend.embeddings)
+
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        korpus = json.load(korpus_file)
+    inputs = [format_answers(korpus[i % len(korpus)]["answers"]) for i in range(args.n)]
+
+    caches_leeren()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        dauer = list(executor.map(beratung, inputs))
+    ausgabe("sync", dauer, time.perf_counter() - start)
+
+    caches_leeren()
+    start = time.perf_counter()
+    dauer = asyncio.run(async_lauf(inputs))
+    ausgabe("async", dauer, time.perf_counter() - start)
+    print(f"Treffer im Antwort-Cache: {backend.antwort_cache.stats()['hits']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from test_functions.benchmark import perzentil
+
+# Benchmark der Modellanbindung (model_provider.py) gegen den lokalen Stand-in-Server (mock_openai.py, eigener Prozess)
+# mit Ausreissern und simulierten Serverfehlern. Verglichen werden Embedding-Aufrufe
+# - direkt: OpenAIEmbeddings mit eigenem Client und den Standard-Wiederholungen des OpenAI-Clients (bisheriger Stand)
+# - pool: gemeinsamer Verbindungspool mit Wiederholungen mit Jitter
+# - hedging: zusaetzlich zweite Anfrage nach --hedge-delay Sekunden ohne Antwort
+# Gemessen werden p50/p95/p99, Fehler und Durchsatz sowie die Wiederholungen und Hedges des Transports.
+# Ausfuehrung aus dem Projektverzeichnis:
+#   python -m test_functions.modell_benchmark --requests 400 --concurrency 16 --tail-rate 0.05 --error-rate 0.02
+
+varianten_namen = ["direkt", "pool", "hedging"]
+
+
+def mock_starten(args) -> subprocess.Popen:
+    prozess = subprocess.Popen([sys.executable, "-m", "mock_openai", "--port", str(args.port),
+                                "--embedding-latency", str(args.latency), "--error-rate", str(args.error_rate),
+                                "--tail-rate", str(args.tail_rate), "--tail-latency", str(args.tail_latency)],
+                               stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/v1/models", timeout=0.2)
+            return prozess
+        except OSError:
+            time.sleep(0.1)
+    prozess.terminate()
+    raise RuntimeError("Stand-in-Server nicht erreichbar")
+
+
+def embeddings_erstellen(variante: str, args):
+    import model_provider
+
+    if variante == "direkt":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(model=args.model, base_url=model_provider.base_url, api_key="mock",
+                                check_embedding_ctx_length=False)
+    model_provider.hedge_delay = args.hedge_delay if variante == "hedging" else 0.0
+    return model_provider.embeddings(args.model)
+
+
+def aufruf_sync(embeddings, text: str, dauer: list, fehler: list):
+    start = time.perf_counter()
+    try:
+        embeddings.embed_query(text)
+        dauer.append(time.perf_counter() - start)
+    except Exception as error:
+        fehler.append(f"{type(error).__name__}: {error}"[:120])
+
+
+async def lauf_async(embeddings, texte: list[str], concurrency: int, dauer: list, fehler: list):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def aufruf(text: str):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await embeddings.aembed_query(text)
+                dauer.append(time.perf_counter() - start)
+            except Exception as error:
+                fehler.append(f"{type(error).__name__}: {error}"[:120])
+
+    await asyncio.gather(*(aufruf(text) for text in texte))
+
+
+def messung(variante: str, args) -> dict:
+    import model_provider
+
+    embeddings = embeddings_erstellen(variante, args)
+    texte = [f"{variante} Anfrage {i}" for i in range(args.requests)]
+    vorher = model_provider.stats()
+    dauer, fehler = [], []
+    start = time.perf_counter()
+    if args.api == "async":
+        asyncio.run(lauf_async(embeddings, texte, args.concurrency, dauer, fehler))
+    else:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(lambda text: aufruf_sync(embeddings, text, dauer, fehler), texte))
+    gesamt = time.perf_counter() - start
+    nachher = model_provider.stats()
+    return {"anzahl": len(dauer), "fehler": len(fehler), "durchsatz": len(dauer) / gesamt,
+            "p50": perzentil(dauer, 50), "p95": perzentil(dauer, 95), "p99": perzentil(dauer, 99),
+            "max": max(dauer, default=0.0),
+            "transport": {name: nachher[name] - vorher[name] for name in ("requests", "retries", "hedges",
+                                                                         "hedges_won")},
+            "fehlermeldungen": sorted(set(fehler))[:5]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark der Modellanbindung (Verbindungspool, Retries, Hedging)")
+    parser.add_argument("--varianten", nargs="+", choices=varianten_namen, default=varianten_namen)
+    parser.add_argument("--api", choices=["sync", "async"], default="sync")
+    parser.add_argument("--requests", type=int, default=400, help="Anzahl Embedding-Aufrufe je Variante")
+    parser.add_argument("--concurrency", type=int, default=16, help="gleichzeitige Aufrufe")
+    parser.add_argument("--model", default="text-embedding-3-large")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stand-in: Latenz pro Embedding-Aufruf")
+    parser.add_argument("--tail-rate", type=float, default=0.05, help="Stand-in: Anteil der Ausreisser")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="Stand-in: zusaetzliche Latenz der Ausreisser")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Stand-in: Anteil simulierter Serverfehler")
+    parser.add_argument("--hedge-delay", type=float, default=0.15, help="Verzoegerung der zweiten Anfrage (hedging)")
+    parser.add_argument("--output", help="Ergebnis zusaetzlich als JSON-Datei schreiben")
+    args = parser.parse_args()
+
+    # Konfiguration vor dem Import der Modellanbindung
+    os.environ["MODEL_BACKEND"] = "openai"
+    os.environ["MODEL_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ.setdefault("MODEL_API_KEY", "mock")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+    mock = mock_starten(args)
+    try:
+        ergebnisse = {variante: messung(variante, args) for variante in args.varianten}
+    finally:
+        mock.terminate()
+
+    print(f"API {args.api}, {args.requests} Aufrufe, {args.concurrency} gleichzeitig, Latenz {args.latency}s, "
+          f"Ausreisser {args.tail_rate:.0%} (+{args.tail_latency}s), Fehler {args.error_rate:.0%}")
+    print(f"{'Variante':<9} {'Fehler':>6} {'Durchsatz':>11} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+          f"{'Anfragen':>9} {'Retries':>8} {'Hedges':>7} {'gewonnen':>9}")
+    for variante, ergebnis in ergebnisse.items():
+        transport = ergebnis["transport"]
+        print(f"{variante:<9} {ergebnis['fehler']:>6} {ergebnis['durchsatz']:>9.1f}/s {ergebnis['p50']:>7.3f}s "
+              f"{ergebnis['p95']:>7.3f}s {ergebnis['p99']:>7.3f}s {ergebnis['max']:>7.3f}s "
+              f"{transport['requests']:>9} {transport['retries']:>8} {transport['hedges']:>7} "
+              f"{transport['hedges_won']:>9}")
+        for meldung in ergebnis["fehlermeldungen"]:
+            print(f"  {meldung}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"args": vars(args), "ergebnisse": ergebnisse}, output_file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import time
+
+from antwort_parser import parse_answers, unsichere_felder
+from fragebogen import format_answers
+
+# Vergleich des regelbasierten Parsers mit der LLM-Extraktion anhand des gelabelten Korpus (antwort_korpus.json).
+# Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.parser_benchmark [--llm]
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+felder = ["mindestanlagebetrag", "laufzeit", "risiko", "nachhaltigkeit"]
+
+
+def auswerten(name: str, ergebnisse: list, korpus: list, dauer: float):
+    print(f"\n{name}: {len(korpus)} Antwortsaetze, {dauer / len(korpus) * 1000:.3f} ms pro Antwortsatz")
+    for feld in felder:
+        richtig = sum(1 for metadata, eintrag in zip(ergebnisse, korpus)
+                      if metadata[feld] == eintrag["expected"][feld])
+        print(f"  {feld:<20} Genauigkeit {richtig / len(korpus):.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm", action="store_true", help="zusaetzlich die LLM-Extraktion messen (OpenAI-Zugang)")
+    args = parser.parse_args()
+
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        korpus = json.load(korpus_file)
+    inputs = [format_answers(eintrag["answers"]) for eintrag in korpus]
+
+    start = time.perf_counter()
+    regel_ergebnisse = [parse_answers(customer_input) for customer_input in inputs]
+    dauer = time.perf_counter() - start
+    auswerten("Regelbasierter Parser", [metadata for metadata, _ in regel_ergebnisse], korpus, dauer)
+
+    # Nur sicher erkannte Felder: Anteil ohne LLM-Aufruf und Fehlerquote dieser Felder
+    ohne_llm = sum(1 for _, konfidenz in regel_ergebnisse if not unsichere_felder(konfidenz))
+    sichere_felder = [(metadata[feld], eintrag["expected"][feld])
+                      for (metadata, konfidenz), eintrag in zip(regel_ergebnisse, korpus)
+                      for feld in felder if feld not in unsichere_felder(konfidenz)]
+    fehler = sum(1 for wert, erwartet in sichere_felder if wert != erwartet)
+    print(f"  ohne LLM-Aufruf: {ohne_llm / len(korpus):.1%}, Fehler bei sicheren Feldern: {fehler}/{len(sichere_felder)}")
+
+    if args.llm:
+        from investmentadvisor_be import few_shot_structured_llm
+
+        start = time.perf_counter()
+        llm_ergebnisse = [few_shot_structured_llm.invoke(customer_input) for customer_input in inputs]
+        dauer = time.perf_counter() - start
+        auswerten("LLM-Extraktion", llm_ergebnisse, korpus, dauer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import json
+import os
+import statistics
+import time
+
+from langchain_core.messages import HumanMessage
+
+import investmentadvisor_be as backend
+from fragebogen import format_answers
+
+# Vergleich der Produktvorstellung aus den vollstaendigen Produktinformationen (PITCH_MODE=full) mit der Anpassung der
+# vorberechneten Vorstellung (PITCH_MODE=precomputed): Prompt-Tokens und Latenz je Empfehlung.
+# Benoetigt OpenAI-Zugang und vorberechnete Vorstellungen (python product_embedding.py --pitches).
+# Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.pitch_vergleich
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+
+
+def main():
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        korpus = json.load(korpus_file)[:5]
+
+    ergebnisse = {"full": [], "precomputed": []}
+    for eintrag in korpus:
+        answers = format_answers(eintrag["answers"])
+        _, documents = backend.find_product(backend.extract_metadata(answers))
+        if not documents:
+            continue
+        state = {"messages": [HumanMessage(answers)], "documents": documents}
+        for mode in ergebnisse:
+            backend.pitch_mode = mode
+            messages, model = backend._pitch_messages(state, backend.llm)
+            start = time.perf_counter()
+            response = model.invoke(messages)
+            ergebnisse[mode].append((time.perf_counter() - start, response.usage_metadata["input_tokens"]))
+
+    for mode, werte in ergebnisse.items():
+        if werte:
+            print(f"{mode:<12} Median {statistics.median(d for d, _ in werte):.2f} s, "
+                  f"Median {statistics.median(t for _, t in werte):.0f} Prompt-Tokens ({len(werte)} Empfehlungen)")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,10 @@ from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_community.query_constructors.chroma import ChromaTranslator
 from langchain_core.structured_query import Comparison, Comparator, Operator, Operation
-from langchain_openai import OpenAIEmbeddings
 from pydantic.v1 import BaseModel
 
+import model_provider
+
 load_dotenv()
 
 # Test der RAG Funktionalitaet sowie Filter
@@ -58,8 +59,7 @@ print(ChromaTranslator().visit_operation(_filter))
 
 embedding_model = "text-embedding-3-large"
 
-embeddings = OpenAIEmbeddings(
-    model=embedding_model)
+embeddings = model_provider.embeddings(embedding_model)
 
 vectordb = Chroma(persist_directory="./chroma_langchain_db", collection_name="pdf_collection_documents",
                   embedding_function=embeddings)
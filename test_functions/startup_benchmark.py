@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Benchmark fuer den Kaltstart: Jeder Lauf startet einen neuen Python-Prozess und misst
+# - import: Import des Backends (investmentadvisor_be)
+# - warmup: Initialisierung von Modellen, Graphen, Retriever und Vektordatenbank (investmentadvisor_be.warmup)
+# - erstes_token: erstes Token der ersten Produktempfehlung, mit und ohne vorherigen Warm-up
+# - erste_frage: erstes Token der Antwort auf die erste Frage zum Produkt (oeffnet Retriever und Vektordatenbank)
+# Mit --importtime werden die Module mit dem groessten Anteil an der Importzeit ausgegeben (python -X importtime),
+# mit --streamlit die Zeit vom Start der Oberflaeche bis zur ersten ausgelieferten Seite.
+# Standardmaessig laufen LLM und Embeddings ueber die Stand-ins aus fake_backends.py (wie test_functions.benchmark).
+# Ausfuehrung aus dem Projektverzeichnis: python -m test_functions.startup_benchmark [--runs 5] [--importtime]
+
+korpus_path = os.path.join(os.path.dirname(__file__), "antwort_korpus.json")
+
+# Wird im neuen Prozess ausgefuehrt, Ergebnis als JSON in der letzten Zeile der Ausgabe
+probe = """
+import json, sys, time
+start = time.perf_counter()
+import investmentadvisor_be as backend
+ergebnis = {"import": time.perf_counter() - start}
+if sys.argv[1] == "warmup":
+    start = time.perf_counter()
+    backend.warmup()
+    ergebnis["warmup"] = time.perf_counter() - start
+from session_store import new_session_id
+session_id = new_session_id()
+start = time.perf_counter()
+for art, text in backend.stream_graph(sys.argv[2], session_id):
+    if art == "token" and "erstes_token" not in ergebnis:
+        ergebnis["erstes_token"] = time.perf_counter() - start
+if not backend.session_store.get(session_id)["empty_product"]:
+    start = time.perf_counter()
+    for token in backend.stream_with_rag("Welche Kosten fallen an?", session_id):
+        ergebnis.setdefault("erste_frage", time.perf_counter() - start)
+print(json.dumps(ergebnis))
+"""
+
+
+def umgebung(args) -> dict:
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    if args.backend == "fake":
+        env.update(MODEL_BACKEND="fake", CHROMA_PERSIST_DIRECTORY=args.persist_directory, EMBEDDING_CACHE_DB="off")
+    return env
+
+
+def lauf(args, variante: str, answers: str) -> dict:
+    result = subprocess.run([sys.executable, "-c", probe, variante, answers], env=umgebung(args),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def importtime(args, anzahl: int = 12) -> list:
+    """Module mit der groessten kumulierten Importzeit (direkt vom Backend importiert)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import investmentadvisor_be"],
+                            env=umgebung(args), capture_output=True, text=True, check=True)
+    module = []
+    for zeile in result.stderr.splitlines():
+        if not zeile.startswith("import time:") or "cumulative" in zeile:
+            continue
+        _, kumuliert, name = zeile[len("import time:"):].split("|")
+        # Einrueckung zwei Leerzeichen: direkt importiert
+        if len(name) - len(name.lstrip()) <= 3:
+            module.append((int(kumuliert) / 1e6, name.strip()))
+    return sorted(module, reverse=True)[:anzahl]
+
+
+def streamlit_start(args, timeout: float = 60.0) -> float:
+    """Zeit vom Start der Oberflaeche bis zur ersten ausgelieferten Seite. Das Skript der Oberflaeche laeuft erst mit
+    der ersten Browser-Session, die Initialisierung von Modellen und Vektordatenbank danach im Hintergrund"""
+    url = f"http://127.0.0.1:{args.port}"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "streamlit", "run", "investmentadvisor_ui.py",
+                                "--server.headless", "true", "--server.port", str(args.port)],
+                               env=umgebung(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"{url}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        with urllib.request.urlopen(url, timeout=5):
+                            return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError(f"Streamlit nach {timeout:.0f}s nicht erreichbar")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def zusammenfassung(werte: list[float]) -> str:
+    return f"{statistics.median(werte) * 1000:>8.0f}ms {min(werte) * 1000:>8.0f}ms {max(werte) * 1000:>8.0f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fuer den Kaltstart des Backends und der Oberflaeche")
+    parser.add_argument("--backend", choices=["fake", "openai"], default="fake",
+                        help="fake: deterministische Stand-ins ohne Netzwerk, openai: Konfiguration aus der Umgebung")
+    parser.add_argument("--persist-directory", default="./benchmark_db",
+                        help="Persist-Verzeichnis mit --backend fake (Ingestion ueber test_functions.benchmark)")
+    parser.add_argument("--runs", type=int, default=5, help="Anzahl neuer Prozesse je Variante")
+    parser.add_argument("--importtime", action="store_true", help="Module mit der groessten Importzeit ausgeben")
+    parser.add_argument("--streamlit", action="store_true", help="Start der Oberflaeche messen")
+    parser.add_argument("--port", type=int, default=8599, help="Port fuer --streamlit")
+    parser.add_argument("--output", help="Ergebnis zusaetzlich als JSON-Datei schreiben")
+    args = parser.parse_args()
+
+    from fragebogen import format_answers
+
+    with open(korpus_path, encoding="utf-8") as korpus_file:
+        answers = format_answers(json.load(korpus_file)[0]["answers"])
+
+    ergebnis = {"backend": args.backend}
+    for variante in ["kalt", "warmup"]:
+        laeufe = [lauf(args, variante, answers) for _ in range(args.runs)]
+        ergebnis[variante] = {stufe: [messung[stufe] for messung in laeufe] for stufe in laeufe[0]}
+
+    print(f"\n{'Variante':<8} {'Stufe':<14} {'Median':>10} {'Min':>10} {'Max':>10}")
+    for variante in ["kalt", "warmup"]:
+        for stufe, werte in ergebnis[variante].items():
+            print(f"{variante:<8} {stufe:<14} {zusammenfassung(werte)}")
+
+    if args.importtime:
+        ergebnis["importtime"] = importtime(args)
+        print("\nImportzeit (kumuliert) der direkt importierten Module:")
+        for sekunden, name in ergebnis["importtime"]:
+            print(f"  {sekunden * 1000:>8.1f}ms  {name}")
+
+    if args.streamlit:
+        ergebnis["streamlit"] = streamlit_start(args)
+        print(f"\nStreamlit: erste Seite nach {ergebnis['streamlit'] * 1000:.0f}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(ergebnis, output_file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
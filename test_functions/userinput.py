@@ -6,11 +6,12 @@ from langchain_core.messages import HumanMessage, BaseMessage
 from langgraph.graph import MessagesState, START, add_messages
 from langchain_core.tools import tool
 from langgraph.prebuilt import ToolNode
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from pydantic import BaseModel
 from langgraph.graph import END, StateGraph
 from langgraph.checkpoint.memory import MemorySaver
 
+import model_provider
+
 
 # Test Agent mit Human-in-the-Loop, um nach Produktempfehlung fragen zuzulassen.
 # Da Userinput bzw. Fragen als Tool-Message interpretiert werden, ist der Workflow nicht geeignet und wird fuer die
@@ -20,8 +21,7 @@ load_dotenv()
 embedding_model = "text-embedding-3-large"
 
 # Initialisiere Vektordatenbank (Chroma) mit gespeicherten, vektorisierten Produktinformationen
-embeddings = OpenAIEmbeddings(
-    model=embedding_model)
+embeddings = model_provider.embeddings(embedding_model)
 
 
 def format_docs(docs):
@@ -48,7 +48,7 @@ tool_node = ToolNode(tools)
 
 # Set up the model
 
-model = ChatOpenAI(model="gpt-4o")
+model = model_provider.chat_model("gpt-4o")
 
 
 # We are going "bind" all tools to the model
@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from test_functions.benchmark import perzentil
+
+# Benchmark des exportierten Vektorindex (vektor_index.py) gegen die Chroma-Collection:
+# - Recall@k je Konfiguration (Format und Dimensionen) gegenueber Chroma und gegenueber der exakten Suche (float32)
+# - Latenz je Anfrage (p50/p95, mit Filter auf das Produkt wie im Backend und ohne Filter) fuer Chroma und jede
+#   Konfiguration, Groesse des Index auf der Festplatte
+# - RSS und PSS je Worker: --workers Prozesse oeffnen gleichzeitig Chroma bzw. den Index und fuehren die Anfragen aus.
+#   PSS verteilt gemeinsam genutzte Seiten (Memory-Mapping) auf die Prozesse
+# Anfragen sind die Fragen aus rag_eval.json und Textanfaenge zufaelliger Chunks, jeweils mit Filter auf das Produkt,
+# sowie dieselben Anfragen ohne Filter. --synthetisch N ersetzt den Bestand durch N zufaellige Vektoren in einer
+# temporaeren Collection, um das Verhalten bei groesseren Bestaenden zu messen.
+# Ausfuehrung aus dem Projektverzeichnis:
+#   python -m test_functions.vektor_index_benchmark --persist-directory ./benchmark_db
+#   python -m test_functions.vektor_index_benchmark --synthetisch 50000 --workers 4
+
+eval_path = os.path.join(os.path.dirname(__file__), "rag_eval.json")
+
+standard_konfigurationen = ["float32", "float16", "int8", "float16:1024", "int8:1024", "int8:256"]
+
+# Wird in jedem Worker ausgefuehrt: Collection bzw. Index oeffnen, Anfragen ausfuehren, auf das Startsignal warten
+# und erst dann messen, damit alle Worker den Index gleichzeitig geoeffnet haben
+worker_probe = """
+import json, sys
+import numpy as np
+
+def speicher():
+    werte = {}
+    for datei, felder in (("/proc/self/status", ("VmRSS",)), ("/proc/self/smaps_rollup", ("Pss",))):
+        try:
+            with open(datei) as handle:
+                for zeile in handle:
+                    name = zeile.split(":")[0]
+                    if name in felder:
+                        werte[name] = int(zeile.split()[1]) / 1024
+        except OSError:
+            pass
+    return werte
+
+import vectorstore_registry
+basis = speicher()
+vectordb = vectorstore_registry.get_collection(vectorstore_registry.chunks_collection, None)
+anfragen = json.load(open(sys.argv[1]))
+vektoren = np.load(sys.argv[2])
+for anfrage, vektor in zip(anfragen, vektoren):
+    vectordb.similarity_search_by_vector(vektor.tolist(), k=anfrage["k"], filter=anfrage["filter"])
+print("bereit", flush=True)
+sys.stdin.readline()
+print(json.dumps({"basis": basis, "nach_suche": speicher()}), flush=True)
+"""
+
+
+def konfiguration(text: str) -> tuple[str, int]:
+    dtype, _, dimensionen = text.partition(":")
+    return dtype, int(dimensionen) if dimensionen else None
+
+
+def synthetische_collection(directory: str, anzahl: int, dimensionen: int, produkte: int = 20, seed: int = 0):
+    """Collection mit zufaelligen, normierten Vektoren. Rueckgabe: Chroma-Collection"""
+    import chromadb
+    from langchain_chroma import Chroma
+
+    import vectorstore_registry
+
+    generator = np.random.default_rng(seed)
+    collection = chromadb.PersistentClient(path=directory).get_or_create_collection(
+        vectorstore_registry.chunks_collection)
+    for start in range(0, anzahl, 2000):
+        stop = min(start + 2000, anzahl)
+        vektoren = generator.standard_normal((stop - start, dimensionen)).astype(np.float32)
+        vektoren /= np.linalg.norm(vektoren, axis=1, keepdims=True)
+        collection.add(ids=[f"s{i}" for i in range(start, stop)], embeddings=vektoren,
+                       documents=[f"Synthetischer Chunk {i}" for i in range(start, stop)],
+                       metadatas=[{"produktnummer": int(i % produkte)} for i in range(start, stop)])
+    return Chroma(collection_name=vectorstore_registry.chunks_collection, persist_directory=directory)
+
+
+def anfragen_erstellen(vectordb, embeddings, anzahl: int, k: int, synthetisch: bool, seed: int = 0):
+    """Anfragen (Filter, k) und ihre Vektoren, jeweils mit Filter auf das Produkt und ohne Filter"""
+    generator = random.Random(seed)
+    bestand = vectordb.get(include=["documents", "metadatas", "embeddings"] if synthetisch
+                           else ["documents", "metadatas"])
+    zeilen = generator.sample(range(len(bestand["ids"])), min(anzahl, len(bestand["ids"])))
+    if synthetisch:
+        # Verrauschte Kopien gespeicherter Vektoren
+        rauschen = np.random.default_rng(seed)
+        vektoren = [np.asarray(bestand["embeddings"][zeile]) + rauschen.normal(0, 0.02, len(bestand["embeddings"][0]))
+                    for zeile in zeilen]
+        produktnummern = [bestand["metadatas"][zeile]["produktnummer"] for zeile in zeilen]
+    else:
+        with open(eval_path, encoding="utf-8") as eval_file:
+            eval_set = json.load(eval_file)
+        texte = [eintrag["frage"] for eintrag in eval_set]
+        produktnummern = [eintrag["produktnummer"] for eintrag in eval_set]
+        for zeile in zeilen:
+            texte.append(" ".join(bestand["documents"][zeile].split()[:12]))
+            produktnummern.append(bestand["metadatas"][zeile]["produktnummer"])
+        vektoren = embeddings.embed_documents(texte)
+    vektoren = np.asarray(vektoren, dtype=np.float32)
+    anfragen = ([{"filter": {"produktnummer": int(nummer)}, "k": k} for nummer in produktnummern]
+                + [{"filter": None, "k": k} for _ in produktnummern])
+    return anfragen, np.concatenate([vektoren, vektoren])
+
+
+def suche(vectordb, anfragen, vektoren) -> tuple[list[list[str]], list[float]]:
+    ergebnisse, dauer = [], []
+    for anfrage, vektor in zip(anfragen, vektoren):
+        start = time.perf_counter()
+        documents = vectordb.similarity_search_by_vector(vektor.tolist(), k=anfrage["k"], filter=anfrage["filter"])
+        dauer.append(time.perf_counter() - start)
+        ergebnisse.append([document.id for document in documents])
+    return ergebnisse, dauer
+
+
+def latenz(anfragen, dauer) -> dict:
+    """p50/p95 in ms getrennt nach Anfragen mit Filter auf das Produkt (wie im Backend) und ohne Filter"""
+    mit = [wert for anfrage, wert in zip(anfragen, dauer) if anfrage["filter"]]
+    ohne = [wert for anfrage, wert in zip(anfragen, dauer) if not anfrage["filter"]]
+    return {"p50_ms": perzentil(mit, 50) * 1000, "p95_ms": perzentil(mit, 95) * 1000,
+            "p50_ohne_filter_ms": perzentil(ohne, 50) * 1000, "p95_ohne_filter_ms": perzentil(ohne, 95) * 1000}
+
+
+def recall(ergebnisse, referenz, k: int) -> float:
+    werte = [len(set(gefunden[:k]) & set(erwartet[:k])) / min(k, len(erwartet))
+             for gefunden, erwartet in zip(ergebnisse, referenz) if erwartet]
+    return statistics.mean(werte) if werte else 0.0
+
+
+def zeiten(messung: dict) -> str:
+    return " ".join(f"{messung[feld]:>7.2f}ms" for feld in ("p50_ms", "p95_ms", "p50_ohne_filter_ms",
+                                                            "p95_ohne_filter_ms"))
+
+
+def verzeichnis_groesse(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(directory) for file in files)
+
+
+def worker_speicher(persist_directory: str, vector_backend: str, anfragen, vektoren, workers: int) -> dict:
+    """Startet die Worker gleichzeitig und liefert RSS/PSS (MB) je Worker nach dem Oeffnen und den Anfragen"""
+    with tempfile.TemporaryDirectory() as directory:
+        anfragen_path = os.path.join(directory, "anfragen.json")
+        vektoren_path = os.path.join(directory, "vektoren.npy")
+        with open(anfragen_path, "w", encoding="utf-8") as anfragen_file:
+            json.dump(anfragen, anfragen_file)
+        np.save(vektoren_path, vektoren)
+
+        env = dict(os.environ, VECTOR_BACKEND=vector_backend, CHROMA_PERSIST_DIRECTORY=persist_directory,
+                   LOG_LEVEL="WARNING")
+        prozesse = [subprocess.Popen([sys.executable, "-c", worker_probe, anfragen_path, vektoren_path], env=env,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     text=True) for _ in range(workers)]
+        try:
+            for prozess in prozesse:
+                if prozess.stdout.readline().strip() != "bereit":
+                    raise RuntimeError(f"Worker ({vector_backend}) ohne Ergebnis beendet")
+            for prozess in prozesse:
+                prozess.stdin.write("\n")
+                prozess.stdin.flush()
+            messungen = [json.loads(prozess.stdout.readline()) for prozess in prozesse]
+        finally:
+            for prozess in prozesse:
+                prozess.kill()
+                prozess.wait()
+
+    def mittel(feld, wert):
+        return statistics.mean(messung[feld].get(wert, 0.0) for messung in messungen)
+
+    return {"rss_mb": mittel("nach_suche", "VmRSS"), "pss_mb": mittel("nach_suche", "Pss"),
+            "rss_zuwachs_mb": mittel("nach_suche", "VmRSS") - mittel("basis", "VmRSS"),
+            "pss_zuwachs_mb": mittel("nach_suche", "Pss") - mittel("basis", "Pss")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des exportierten Vektorindex gegen Chroma")
+    parser.add_argument("--backend", choices=["fake", "openai"], default="fake",
+                        help="Embeddings der Anfragen: fake (Stand-in) oder openai (mit Embedding-Cache)")
+    parser.add_argument("--persist-directory", default="./benchmark_db",
+                        help="Persist-Verzeichnis mit der Chunk-Collection (passend zu --backend eingebettet)")
+    parser.add_argument("--konfigurationen", nargs="+", default=standard_konfigurationen,
+                        help="Format[:Dimensionen] je Konfiguration, z. B. int8:1024")
+    parser.add_argument("-k", type=int, nargs="+", default=[1, 3, 6], help="Werte fuer Recall@k")
+    parser.add_argument("--queries", type=int, default=200, help="Anzahl Anfragen aus zufaelligen Chunks")
+    parser.add_argument("--synthetisch", type=int, default=0, help="Anzahl zufaelliger Vektoren statt des Bestands")
+    parser.add_argument("--dimensionen", type=int, default=3072, help="Dimensionen der synthetischen Vektoren")
+    parser.add_argument("--workers", type=int, default=0, help="Anzahl Worker fuer die Messung von RSS/PSS")
+    parser.add_argument("--worker-konfiguration", default="int8", help="Konfiguration des Index fuer --workers")
+    parser.add_argument("--output", help="Ergebnis zusaetzlich als JSON-Datei schreiben")
+    args = parser.parse_args()
+
+    import vektor_index
+    from embedding_cache import cached_embeddings
+    from fake_backends import HashEmbeddings
+
+    if args.backend == "fake":
+        embeddings = HashEmbeddings()
+    else:
+        import model_provider
+        import product_embedding
+        embeddings = cached_embeddings(model_provider.embeddings(product_embedding.embedding_model),
+                                       model_provider.embedding_cache_name(product_embedding.embedding_model))
+
+    with tempfile.TemporaryDirectory() as arbeitsverzeichnis:
+        persist_directory = args.persist_directory
+        if args.synthetisch:
+            persist_directory = os.path.join(arbeitsverzeichnis, "synthetisch")
+            vectordb = synthetische_collection(persist_directory, args.synthetisch, args.dimensionen)
+        else:
+            from langchain_chroma import Chroma
+
+            import vectorstore_registry
+            vectordb = Chroma(collection_name=vectorstore_registry.chunks_collection,
+                              persist_directory=persist_directory)
+
+        k = max(args.k)
+        anfragen, vektoren = anfragen_erstellen(vectordb, embeddings, args.queries, k, bool(args.synthetisch))
+        bestand = vectordb.get(include=["embeddings", "documents", "metadatas"])
+        print(f"{len(bestand['ids'])} Chunks, {len(anfragen)} Anfragen (mit und ohne Filter auf das Produkt)")
+
+        chroma_ids, chroma_dauer = suche(vectordb, anfragen, vektoren)
+        exakt_directory = os.path.join(arbeitsverzeichnis, "exakt")
+        vektor_index.export_index(exakt_directory, bestand["ids"], bestand["embeddings"], bestand["documents"],
+                                  bestand["metadatas"], dtype="float32")
+        exakt_ids, _ = suche(vektor_index.VektorIndex(vektor_index.index_directory(exakt_directory)), anfragen,
+                             vektoren)
+
+        ergebnis = {"chunks": len(bestand["ids"]), "anfragen": len(anfragen),
+                    "chroma": {"recall_exakt": {n: recall(chroma_ids, exakt_ids, n) for n in args.k},
+                               **latenz(anfragen, chroma_dauer),
+                               "mb": verzeichnis_groesse(persist_directory) / 1024 / 1024},
+                    "index": {}}
+        for text in args.konfigurationen:
+            dtype, dimensionen = konfiguration(text)
+            directory = os.path.join(arbeitsverzeichnis, text.replace(":", "_"))
+            vektor_index.export_index(directory, bestand["ids"], bestand["embeddings"], bestand["documents"],
+                                      bestand["metadatas"], dimensionen, dtype)
+            index = vektor_index.VektorIndex(vektor_index.index_directory(directory))
+            ids, dauer = suche(index, anfragen, vektoren)
+            ergebnis["index"][text] = {"recall_chroma": {n: recall(ids, chroma_ids, n) for n in args.k},
+                                       "recall_exakt": {n: recall(ids, exakt_ids, n) for n in args.k},
+                                       **latenz(anfragen, dauer),
+                                       "mb": verzeichnis_groesse(vektor_index.index_directory(directory)) / 1024 / 1024}
+
+        recall_spalten = " ".join(f"{'R@' + str(n) + ' Chroma':>12} {'R@' + str(n) + ' exakt':>11}" for n in args.k)
+        print(f"\n{'Konfiguration':<14} {recall_spalten} {'p50':>9} {'p95':>9} {'p50 ohne':>9} {'p95 ohne':>9} "
+              f"{'Groesse':>9}")
+        chroma = ergebnis["chroma"]
+        werte = " ".join(f"{'':>12} {chroma['recall_exakt'][n]:>11.1%}" for n in args.k)
+        print(f"{'chroma':<14} {werte} {zeiten(chroma)} {chroma['mb']:>7.1f}MB")
+        for text, messung in ergebnis["index"].items():
+            werte = " ".join(f"{messung['recall_chroma'][n]:>12.1%} {messung['recall_exakt'][n]:>11.1%}"
+                             for n in args.k)
+            print(f"{text:<14} {werte} {zeiten(messung)} {messung['mb']:>7.1f}MB")
+
+        if args.workers:
+            dtype, dimensionen = konfiguration(args.worker_konfiguration)
+            index_directory = os.path.join(arbeitsverzeichnis, "worker")
+            vektor_index.export_index(index_directory, bestand["ids"], bestand["embeddings"], bestand["documents"],
+                                      bestand["metadatas"], dimensionen, dtype)
+            ergebnis["worker"] = {
+                "chroma": worker_speicher(persist_directory, "chroma", anfragen, vektoren, args.workers),
+                f"index {args.worker_konfiguration}": worker_speicher(index_directory, "index", anfragen, vektoren,
+                                                                      args.workers)}
+            print(f"\nSpeicher je Worker ({args.workers} Worker gleichzeitig, Zuwachs durch Oeffnen und Suche):")
+            print(f"{'Backend':<16} {'RSS':>10} {'PSS':>10} {'RSS Zuwachs':>12} {'PSS Zuwachs':>12}")
+            for name, messung in ergebnis["worker"].items():
+                print(f"{name:<16} {messung['rss_mb']:>8.1f}MB {messung['pss_mb']:>8.1f}MB "
+                      f"{messung['rss_zuwachs_mb']:>10.1f}MB {messung['pss_zuwachs_mb']:>10.1f}MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(ergebnis, output_file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
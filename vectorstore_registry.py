@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import telemetry
+import vektor_index
+from dokument_store import DokumentStore
+from ingest_manifest import manifest_path
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+
+# Zentrale Registry fuer die Chroma-Collections. Jede Collection wird pro Prozess nur einmal geoeffnet und von allen
+# Streamlit-Sessions bzw. Threads gemeinsam verwendet. Nach einer erneuten Ingestion (product_embedding.py schreibt
+# zuletzt das Manifest) werden die Collections automatisch neu geoeffnet.
+
+# Verzeichnis der Vektordatenbank (abweichend z. B. fuer Benchmarks ueber CHROMA_PERSIST_DIRECTORY)
+default_persist_directory = "./chroma_langchain_db"
+persist_directory = os.getenv("CHROMA_PERSIST_DIRECTORY", default_persist_directory)
+
+# Eingebettet werden nur die Chunks, die vollstaendigen Seiten liegen im Docstore (dokument_store.py)
+chunks_collection = "pdf_collection_chunks"
+
+# Suche ueber die Chroma-Collection (chroma) oder den exportierten, per Memory-Mapping geoeffneten Vektorindex (index,
+# vektor_index.py). Fehlt der Index, wird die Chroma-Collection verwendet
+vector_backend = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Mindestabstand in Sekunden zwischen zwei Pruefungen des Manifests
+check_interval = 2.0
+
+_lock = threading.Lock()
+_collections = {}
+# Signatur des Manifests bei der letzten Pruefung (None: kein Manifest)
+_nicht_geprueft = object()
+_signature = _nicht_geprueft
+_last_check = 0.0
+_dokument_store = None
+
+
+def _ingest_signature(path: str):
+    """Signatur (Groesse, Aenderungszeit) des Ingestion-Manifests. Beobachtet wird nur das Manifest, das die Ingestion
+    als letzte Datei schreibt: Chroma selbst aendert chroma.sqlite3 bereits beim Oeffnen eines Clients"""
+    try:
+        stat = os.stat(manifest_path(path))
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _reset_clients():
+    """Verwirft alle geoeffneten Collections und beendet die Chroma-Systeme, bevor ihr Cache geleert wird"""
+    _collections.clear()
+    try:
+        from chromadb.api.client import SharedSystemClient
+        for system in list(SharedSystemClient._identifier_to_system.values()):
+            system.stop()
+        SharedSystemClient.clear_system_cache()
+    except (ImportError, AttributeError):
+        pass
+
+
+def _check_for_changes():
+    global _signature, _last_check
+    now = time.monotonic()
+    if now - _last_check < check_interval:
+        return
+    _last_check = now
+    signature = _ingest_signature(persist_directory)
+    if _signature is not _nicht_geprueft and signature != _signature:
+        telemetry.log_event("persist_verzeichnis_geaendert", persist_directory=persist_directory)
+        _reset_clients()
+    _signature = signature
+
+
+def get_collection(collection_name: str, embedding_function) -> "Chroma":
+    """Liefert die gemeinsam genutzte Collection (Chroma bzw. Vektorindex) und oeffnet sie bei Bedarf. Chroma wird erst
+    beim Oeffnen importiert, damit der Start der Anwendung nicht auf chromadb wartet"""
+    with _lock:
+        _check_for_changes()
+        key = (collection_name, id(embedding_function))
+        vectordb = _collections.get(key)
+        if vectordb is None:
+            vectordb = _open(collection_name, embedding_function)
+            _collections[key] = vectordb
+        return vectordb
+
+
+def _open(collection_name: str, embedding_function):
+    if vector_backend == "index" and collection_name == chunks_collection:
+        if vektor_index.exists(persist_directory):
+            return vektor_index.VektorIndex(vektor_index.index_directory(persist_directory), embedding_function)
+        telemetry.log_event("vektor_index_fehlt", logging.WARNING, persist_directory=persist_directory)
+
+    from langchain_chroma import Chroma
+
+    return Chroma(persist_directory=persist_directory,
+                  collection_name=collection_name,
+                  embedding_function=embedding_function)
+
+
+def clear():
+    """Schliesst alle Collections, z. B. fuer Tests oder nach manueller Neuindexierung"""
+    global _signature
+    with _lock:
+        _reset_clients()
+        _signature = _nicht_geprueft
+
+
+def get_dokument_store() -> DokumentStore:
+    """Liefert den gemeinsam genutzten Docstore mit den Seiten der Produktinformationsblaetter"""
+    global _dokument_store
+    with _lock:
+        if _dokument_store is None:
+            _dokument_store = DokumentStore(persist_directory)
+        return _dokument_store
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Kompakter, unveraenderlicher Vektorindex der Chunks als Alternative zur Chroma-Collection (VECTOR_BACKEND=index).
+# product_embedding.py exportiert den Index nach jeder Ingestion in das Verzeichnis vektor_index im Persist-Verzeichnis:
+# - vektoren.npy: Embeddings, optional auf die ersten Dimensionen gekuerzt (bei text-embedding-3 zulaessig) und neu
+#   normiert, als float32, float16 oder int8 (je Zeile symmetrisch skaliert, Skalen in skalen.npy)
+# - produktnummern.npy: Produktnummer je Zeile. Die Zeilen sind nach Produktnummer sortiert, die Suche mit Filter auf
+#   ein Produkt liest nur den zusammenhaengenden Abschnitt des Produkts
+# - dokumente.json: IDs, Texte und Metadaten der Chunks, manifest.json: Format, Dimensionen, Anzahl
+# Die Arrays werden per Memory-Mapping geoeffnet, alle Worker-Prozesse teilen sich dieselben Seiten im Page Cache.
+# Ein neuer Export ersetzt das Verzeichnis als Ganzes, bestehende Mappings bleiben gueltig.
+
+index_directory_name = "vektor_index"
+dtypes = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+format_version = 1
+
+
+def index_directory(persist_directory: str) -> str:
+    return os.path.join(persist_directory, index_directory_name)
+
+
+def exists(persist_directory: str) -> bool:
+    return os.path.exists(os.path.join(index_directory(persist_directory), "manifest.json"))
+
+
+def reduce_dimensions(vectors: np.ndarray, dimensions: int = None) -> np.ndarray:
+    """Kuerzt die Vektoren auf die ersten Dimensionen und normiert sie neu (Kosinus-Aehnlichkeit als Skalarprodukt)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dimensions:
+        vectors = vectors[..., :dimensions]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """Rueckgabe: (quantisierte Vektoren, Skala je Zeile oder None)"""
+    if dtype != "int8":
+        return vectors.astype(dtypes[dtype]), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def export_index(persist_directory: str, ids: list[str], embeddings, documents: list[str], metadatas: list[dict],
+                 dimensions: int = None, dtype: str = "float16", model: str = None) -> dict:
+    """Schreibt den Index in ein temporaeres Verzeichnis und ersetzt anschliessend das bestehende Verzeichnis.
+    Rueckgabe: Manifest"""
+    if dtype not in dtypes:
+        raise ValueError(f"Unbekanntes Format {dtype}, moeglich sind {', '.join(dtypes)}")
+    vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+    original_dimensions = vectors.shape[1]
+    vectors = reduce_dimensions(vectors, dimensions)
+    produktnummern = np.array([int(metadata.get("produktnummer", -1)) for metadata in metadatas], dtype=np.int64)
+
+    order = np.argsort(produktnummern, kind="stable")
+    quantized, scales = quantize(vectors[order], dtype)
+
+    target = index_directory(persist_directory)
+    tmp = target + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "vektoren.npy"), quantized)
+    np.save(os.path.join(tmp, "produktnummern.npy"), produktnummern[order])
+    if scales is not None:
+        np.save(os.path.join(tmp, "skalen.npy"), scales)
+    with open(os.path.join(tmp, "dokumente.json"), "w", encoding="utf-8") as dokumente_file:
+        json.dump({"ids": [ids[i] for i in order], "documents": [documents[i] for i in order],
+                   "metadatas": [metadatas[i] for i in order]}, dokumente_file, ensure_ascii=False)
+    manifest = {"version": format_version, "dtype": dtype, "dimensions": int(vectors.shape[1]),
+                "original_dimensions": int(original_dimensions), "count": len(ids), "model": model,
+                "created": time.time()}
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    # Austausch des ganzen Verzeichnisses: Leser sehen entweder den alten oder den neuen Index
+    old = target + ".alt"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(target):
+        os.replace(target, old)
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def export_from_collection(persist_directory: str, vectordb, dimensions: int = None, dtype: str = "float16",
+                           model: str = None) -> dict:
+    """Exportiert alle Chunks einer Chroma-Collection"""
+    result = vectordb.get(include=["embeddings", "documents", "metadatas"])
+    return export_index(persist_directory, result["ids"], result["embeddings"], result["documents"],
+                        result["metadatas"], dimensions, dtype, model)
+
+
+class VektorIndex:
+    """Lesezugriff auf den exportierten Index mit der Such-Schnittstelle der Chroma-Collection (similarity_search,
+    similarity_search_by_vector, get), Filter nur auf produktnummer"""
+
+    def __init__(self, directory: str, embedding_function=None):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest["version"] != format_version:
+            raise ValueError(f"Format {self.manifest['version']} des Vektorindex wird nicht unterstuetzt")
+        self.vectors = np.load(os.path.join(directory, "vektoren.npy"), mmap_mode="r")
+        self.produktnummern = np.load(os.path.join(directory, "produktnummern.npy"), mmap_mode="r")
+        scales_path = os.path.join(directory, "skalen.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        with open(os.path.join(directory, "dokumente.json"), encoding="utf-8") as dokumente_file:
+            dokumente = json.load(dokumente_file)
+        self.ids, self.documents, self.metadatas = dokumente["ids"], dokumente["documents"], dokumente["metadatas"]
+
+    def _rows(self, filter: dict = None) -> slice:
+        if not filter:
+            return slice(0, len(self.ids))
+        if set(filter) != {"produktnummer"}:
+            raise ValueError(f"Filter {filter} wird vom Vektorindex nicht unterstuetzt (nur produktnummer)")
+        produktnummer = int(filter["produktnummer"])
+        return slice(int(np.searchsorted(self.produktnummern, produktnummer, side="left")),
+                     int(np.searchsorted(self.produktnummern, produktnummer, side="right")))
+
+    def _document(self, row: int) -> Document:
+        return Document(id=self.ids[row], page_content=self.documents[row], metadata=self.metadatas[row])
+
+    def scores(self, vector, rows: slice, block_size: int = 4096) -> np.ndarray:
+        """Kosinus-Aehnlichkeit der Anfrage zu allen Zeilen des Abschnitts (blockweise, ohne den Index zu kopieren)"""
+        query = reduce_dimensions(np.asarray(vector, dtype=np.float32), self.manifest["dimensions"])
+        result = np.empty(rows.stop - rows.start, dtype=np.float32)
+        for start in range(rows.start, rows.stop, block_size):
+            stop = min(start + block_size, rows.stop)
+            block = np.asarray(self.vectors[start:stop], dtype=np.float32) @ query
+            if self.scales is not None:
+                block *= self.scales[start:stop]
+            result[start - rows.start:stop - rows.start] = block
+        return result
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter: dict = None):
+        rows = self._rows(filter)
+        if rows.stop <= rows.start:
+            return []
+        scores = self.scores(embedding, rows)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(self._document(rows.start + int(i)), float(scores[i])) for i in best]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: dict = None, **kwargs) -> list[Document]:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None, **kwargs) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+    async def asimilarity_search_by_vector(self, embedding, k: int = 4, filter: dict = None,
+                                           **kwargs) -> list[Document]:
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k, filter)
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: dict = None, **kwargs) -> list[Document]:
+        embedding = await self.embedding_function.aembed_query(query)
+        return await self.asimilarity_search_by_vector(embedding, k, filter)
+
+    def get(self, where: dict = None, include: list[str] = None, **kwargs) -> dict:
+        include = ["documents", "metadatas"] if include is None else include
+        rows = range(*self._rows(where).indices(len(self.ids)))
+        result = {"ids": [self.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self.documents[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[row] for row in rows]
+        return result